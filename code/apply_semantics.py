@@ -1,7 +1,8 @@
 """
 Applies axes to word embeddings in extreme_rel, general_rel
 """
-from validate_semantics import load_wordnet_axes, get_poles_bert
+import validate_semantics
+from validate_semantics import load_axis_artifact
 from tqdm import tqdm
 from scipy.spatial.distance import cosine
 import json
@@ -9,10 +10,14 @@ import numpy as np
 from collections import Counter, defaultdict
 from fastdist import fastdist
 from helpers import get_vocab
+from bert_batching import pack_batches
+from embedding_engine import embed_spans, device
+from embedding_cache import enable_cache
+from embedding_store import load_embedding_store, save_embedding_store, stack_stores, group_means
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler
 import pandas as pd
-from transformers import BasicTokenizer, BertTokenizerFast, BertModel, BertTokenizer
+from transformers import BasicTokenizer
 import os
 import csv
 import torch
@@ -31,83 +36,43 @@ AGG_EMBED_PATH = LOGS + 'semantics_mano/agg_embed/'
 VARIANT_OUT = LOGS + 'semantics_mano/variant_scores/'
 WOMEN_OUT = LOGS + 'semantics_mano/women_scores/'
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
 def load_manosphere_vecs(inpath): 
     '''
     Load z-scored embeddings for each vocabulary term
+    @input: 
+    - inpath: embedding store prefix, e.g. AGG_EMBED_PATH + 'mano_overall'
     '''
     bert_mean = np.load(LOGS + 'wikipedia/mean_BERT.npy')
     bert_std = np.load(LOGS + 'wikipedia/std_BERT.npy')
     
-    vocab_order = []
-    full_reps = []
-    with open(inpath, 'r') as infile: 
-        d = json.load(infile) # {term : vector}
-    for term in sorted(d.keys()): 
-        standard_vec = (np.array(d[term]) - bert_mean) / bert_std
-        vocab_order.append(term)
-        full_reps.append(standard_vec)
-    full_reps = np.array(full_reps)
+    matrix, keys, _ = load_embedding_store(inpath) # rows in sorted key order
+    full_reps = (matrix - bert_mean) / bert_std
+    vocab_order = keys
     print("Number of reps", full_reps.shape)
     return full_reps, vocab_order
 
 def get_good_axes(zscore=True): 
-    '''
-    This is copied from axes_occupation_viz.ipynb. 
-    '''
     if zscore: 
-        quality_file_path = LOGS + 'semantics_val/axes_quality_bert-base-prob-zscore.txt'
-    else: 
-        quality_file_path = LOGS + 'semantics_val/axes_quality_bert-base-prob.txt'
-    scores = defaultdict(dict) # {synset: {word : (predicted, true)}}
-    with open(quality_file_path, 'r') as infile: 
-        for line in infile: 
-            contents = line.strip().split('\t')
-            scores[contents[0]][contents[1]] = (float(contents[2]), contents[3])
-    avg_scores = Counter()
-    good_synsets = set()
-    for synset in scores: 
-        left_scores = []
-        right_scores = []
-        for w in scores[synset]: 
-            if scores[synset][w][1] == 'left': 
-                left_scores.append(-1*scores[synset][w][0])
-            else: 
-                right_scores.append(scores[synset][w][0])
-        if left_scores != []: 
-            # some are empty since they only had one word with reps
-            avg_scores[synset + '_left'] = np.mean(left_scores) 
-        if right_scores != []: 
-            avg_scores[synset + '_right'] = np.mean(right_scores) 
-        if avg_scores[synset + '_left'] >= 0 and avg_scores[synset + '_right'] >= 0: 
-            good_synsets.add(synset)
-    return good_synsets
+        return validate_semantics.get_good_axes('bert-base-prob-zscore')
+    return validate_semantics.get_good_axes('bert-base-prob')
 
 def project_onto_axes(): 
     '''
     The output is a dictionary of axis: list of scores, in order of full_reps
     '''
     print("getting axes...")
-    axes, axes_vocab = load_wordnet_axes()
-    # synset : (right_vec, left_vec)
-    adj_poles = get_poles_bert(axes, 'bert-base-prob-zscore')
-    good_axes = get_good_axes()
+    axes_art = load_axis_artifact('bert-base-prob-zscore')
     
     print("getting word vectors...")
-    full_reps, vocab_order = load_manosphere_vecs(AGG_EMBED_PATH + 'mano_overall.json')
+    full_reps, vocab_order = load_manosphere_vecs(AGG_EMBED_PATH + 'mano_overall')
     
     print("calculating bias of every word to every axis...")
     scores = defaultdict(list) 
-    for pole in tqdm(adj_poles): 
-        if pole not in good_axes: continue
-        left_vecs, right_vecs = adj_poles[pole]
-        left_pole = left_vecs.mean(axis=0)
-        right_pole = right_vecs.mean(axis=0)
-        microframe = right_pole - left_pole
+    for i in tqdm(np.nonzero(axes_art['good_mask'])[0]): 
+        microframe = axes_art['microframes'][i]
         # note that this is cosine distance, not cosine similarity
         c_w_f = fastdist.vector_to_matrix_distance(microframe, full_reps, fastdist.cosine, "cosine")
-        scores[pole] = list(c_w_f)
+        scores[str(axes_art['poles'][i])] = list(c_w_f)
         
     with open(LOGS + 'semantics_mano/results/scores.json', 'w') as outfile: 
         json.dump(scores, outfile)
@@ -115,114 +80,67 @@ def project_onto_axes():
     with open(LOGS + 'semantics_mano/results/vocab_order.txt', 'w') as outfile: 
         outfile.write('\n'.join(vocab_order))
             
+REDDIT_YEARS = range(2008, 2020)
+FORUMS = ['avfm', 'mgtow', 'incels', 'pua_forum', 'red_pill_talk', 'rooshv', 'the_attraction']
+
+def split_embed_key(key, source): 
+    '''
+    @inputs: 
+    - key: term_category_year from reddit_forum_embeddings.py 
+    - source: store prefix the key came from 
+    @output: 
+    - {'term', 'category', 'year', 'platform', 'source'}, year is 'None' for
+    undated forum posts 
+    '''
+    parts = key.split('_')
+    source_name = source.split('/')[-1]
+    return {'term': parts[0], 'category': '_'.join(parts[1:-1]), 'year': parts[-1], 
+            'platform': source_name.split('_')[0], 'source': source_name}
+
+def reaggregate(group_by, out_name): 
+    '''
+    Reaggregates per-year, per-community/platform embeddings into
+    count-weighted means over any grouping. 
+    @inputs: 
+    - group_by: tuple of fields from split_embed_key, e.g. ('term', 'year'), 
+    where the output key is the fields joined by '_', or a function from 
+    the split_embed_key dict to an output key, or None to drop the row 
+    - out_name: output store name in AGG_EMBED_PATH
+    '''
+    prefixes = [EMBED_PATH + 'reddit_' + str(y) for y in REDDIT_YEARS] + \
+        [EMBED_PATH + 'forum_' + f for f in FORUMS]
+    matrix, keys, counts, sources = stack_stores(prefixes)
+    if not callable(group_by): 
+        fields = group_by
+        group_by = lambda parts: '_'.join(parts[f] for f in fields)
+    group_keys = [group_by(split_embed_key(key, source)) for key, source in zip(keys, sources)]
+    groups, means, group_counts = group_means(matrix, counts, group_keys)
+    save_embedding_store(AGG_EMBED_PATH + out_name, groups, means, group_counts)
+
 def get_overall_embeddings(): 
     '''
     Reaggregates based on per-year, per-community/platform
     embeddings and their counts
     This way each vocab word has one embedding. 
     '''
-    total_count = Counter() # {term : count}
-    overall_vec = {}
-    
-    # go through reddit
-    years = range(2008, 2020)
-    for y in tqdm(years):
-        with open(EMBED_PATH + 'reddit_' + str(y) + '.json', 'r') as infile: 
-            d = json.load(infile) # { term_category_year : vector }
-        with open(EMBED_PATH + 'reddit_' + str(y) + '_wordcounts.json', 'r') as infile: 
-            word_counts = json.load(infile)
-        for key in sorted(d.keys()): 
-            count = word_counts[key]
-            parts = key.split('_')
-            term = parts[0]
-            vec = np.array(d[key])*count
-            total_count[term] += count
-            if term not in overall_vec: 
-                overall_vec[term] = np.zeros(3072)
-            overall_vec[term] += vec
-    forums = ['avfm', 'mgtow', 'incels', 'pua_forum', 'red_pill_talk', 'rooshv', 'the_attraction']
-    # go through forum 
-    for f in tqdm(forums): 
-        with open(EMBED_PATH + 'forum_' + f + '.json', 'r') as infile: 
-            d = json.load(infile) # { term_category_year : vector }
-        with open(EMBED_PATH + 'forum_' + f + '_wordcounts.json', 'r') as infile: 
-            word_counts = json.load(infile)
-        for key in sorted(d.keys()): 
-            count = word_counts[key]
-            parts = key.split('_')
-            term = parts[0]
-            vec = np.array(d[key])*count
-            total_count[term] += count
-            if term not in overall_vec: 
-                overall_vec[term] = np.zeros(3072)
-            overall_vec[term] += vec
-    
-    for term in overall_vec: 
-        overall_vec[term] = list(overall_vec[term] / total_count[term]) 
-    with open(AGG_EMBED_PATH + 'mano_overall.json', 'w') as outfile: 
-        json.dump(overall_vec, outfile)
+    reaggregate(('term',), 'mano_overall')
         
 def get_yearly_embeddings(): 
     '''
     Reaggregates based on per-year, per-community/platform
     embeddings and their counts
-    This way each vocab word has one embedding. 
+    This way each vocab word has one embedding per year. 
     '''
-    total_count = Counter() # {term + year : count}
-    overall_vec = {}
-    
-    # go through reddit
-    years = range(2008, 2020)
-    for y in tqdm(years):
-        with open(EMBED_PATH + 'reddit_' + str(y) + '.json', 'r') as infile: 
-            d = json.load(infile) # { term_category_year : vector }
-        with open(EMBED_PATH + 'reddit_' + str(y) + '_wordcounts.json', 'r') as infile: 
-            word_counts = json.load(infile)
-        for key in sorted(d.keys()): 
-            count = word_counts[key]
-            parts = key.split('_')
-            term = parts[0]
-            vec = np.array(d[key])*count
-            total_count[term + '_' + str(y)] += count
-            if term not in overall_vec: 
-                overall_vec[term + '_' + str(y)] = np.zeros(3072)
-            overall_vec[term + '_' + str(y)] += vec
-    forums = ['avfm', 'mgtow', 'incels', 'pua_forum', 'red_pill_talk', 'rooshv', 'the_attraction']
-    # go through forum 
-    for f in tqdm(forums): 
-        with open(EMBED_PATH + 'forum_' + f + '.json', 'r') as infile: 
-            d = json.load(infile) # { term_category_year : vector }
-        with open(EMBED_PATH + 'forum_' + f + '_wordcounts.json', 'r') as infile: 
-            word_counts = json.load(infile)
-        for key in sorted(d.keys()): 
-            count = word_counts[key]
-            parts = key.split('_')
-            term = parts[0]
-            y = parts[-1]
-            if y == 'None': continue
-            vec = np.array(d[key])*count
-            total_count[term + '_' + str(y)] += count
-            if term not in overall_vec: 
-                overall_vec[term + '_' + str(y)] = np.zeros(3072)
-            overall_vec[term + '_' + str(y)] += vec
-    
-    for term in overall_vec: 
-        overall_vec[term] = list(overall_vec[term] / total_count[term]) 
-    with open(AGG_EMBED_PATH + 'mano_yearly.json', 'w') as outfile: 
-        json.dump(overall_vec, outfile)
+    reaggregate(lambda parts: None if parts['year'] == 'None' else parts['term'] + '_' + parts['year'], 
+                'mano_yearly')
         
 def batch_data(): 
     vocab = ['moids', 'femoids', 'foids', 'women', 'men']
     tokenizer = BasicTokenizer(do_lower_case=True)
 
-    batch_size = 8
-    batch_sentences = [] # each item is a list
-    batch_words = [] # each item is a list
-    batch_meta = []
-    
-    curr_batch = []
-    curr_words = []
-    curr_meta = []
+    sentences = [] # each item is a list
+    words = [] # (target word, token index)
+    metas = []
     
     VAR_DIR = LOGS + 'variants/'
     for json_file in os.listdir(VAR_DIR):
@@ -249,45 +167,26 @@ def batch_data():
             sent = id2sent[sentID]
             tokens = tokenizer.tokenize(sent)
             meta = sentID_meta[sentID]
-            words = sentID_word[sentID]
-            for w in words: 
+            sent_words = sentID_word[sentID]
+            for w in sent_words: 
                 idx = tokens.index(w)
                 replaced_tokens = copy.deepcopy(tokens)
                 replaced_tokens[idx] = 'people'
-                curr_batch.append(replaced_tokens)
-                curr_words.append((w, idx))
-                curr_meta.append(meta)
-                if len(curr_batch) == batch_size: 
-                    batch_sentences.append(curr_batch)
-                    batch_words.append(curr_words)
-                    batch_meta.append(curr_meta)
-                    curr_batch = []
-                    curr_words = []   
-                    curr_meta = []
-        if len(curr_batch) != 0: # fence post
-            batch_sentences.append(curr_batch)
-            batch_words.append(curr_words)
-            batch_meta.append(curr_meta)
-    return batch_sentences, batch_words, batch_meta
+                sentences.append(replaced_tokens)
+                words.append((w, idx))
+                metas.append(meta)
+    return pack_batches(sentences, words, metas)
 
 def get_microframe_matrix(zscore=True): 
-    axes, axes_vocab = load_wordnet_axes()
-    # synset : (right_vec, left_vec)
+    '''
+    Microframes of good axes, from the cached axis artifact 
+    '''
     if zscore: 
-        adj_poles = get_poles_bert(axes, 'bert-base-prob-zscore')
+        axes_art = load_axis_artifact('bert-base-prob-zscore')
     else: 
-        adj_poles = get_poles_bert(axes, 'bert-base-prob')
-    good_axes = get_good_axes(zscore=zscore)
-    m = []
-    pole_order = []
-    for pole in sorted(adj_poles.keys()): 
-        if pole not in good_axes: continue
-        pole_order.append(pole)
-        left_vecs, right_vecs = adj_poles[pole]
-        left_pole = left_vecs.mean(axis=0)
-        right_pole = right_vecs.mean(axis=0)
-        microframe = right_pole - left_pole
-        m.append(microframe)
+        axes_art = load_axis_artifact('bert-base-prob')
+    m = axes_art['microframes'][axes_art['good_mask']]
+    pole_order = [str(pole) for pole in axes_art['poles'][axes_art['good_mask']]]
     if zscore: 
         variant_outpath = VARIANT_OUT + 'pole_order.txt'
     else: 
@@ -295,50 +194,44 @@ def get_microframe_matrix(zscore=True):
     with open(variant_outpath, 'w') as outfile: 
         for pole in pole_order:
             outfile.write(pole + '\n')
-    return np.array(m)
+    return m
 
-def get_bert_embeddings(batch_sentences, batch_words, batch_meta, bert_mean, bert_std, m, zscore=True): 
-    word_reps = defaultdict(list) # {word : [[axis scores for each occurrence]]} 
-    tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
-    model = BertModel.from_pretrained('bert-base-uncased')
-    layers = [-4, -3, -2, -1] # last four layers
-    model.to(device)
-    model.eval()
+def normalize_rows(t): 
+    return t / t.norm(dim=1, keepdim=True)
+
+def get_bert_embeddings(batch_sentences, batch_words, batch_meta, batch_idx, bert_mean, bert_std, m, zscore=True): 
+    '''
+    Each batch is scored on the device: target wordpieces are mean-pooled, 
+    z-scored, and compared to every microframe in m with one matmul, 
+    so only the batch's score matrix is moved to host. 
+    Scores are cosine similarities, same as fastdist's "cosine". 
+    batch_idx is from pack_batches(), and is used to list occurrences in input order. 
+    '''
+    occurrences = [] # [(example index, word_cat, axis scores)]
+    
+    # scoring is in float64 like the numpy version 
+    m_normed = normalize_rows(torch.tensor(m, dtype=torch.float64, device=device))
+    bert_mean = torch.tensor(bert_mean, dtype=torch.float64, device=device)
+    bert_std = torch.tensor(bert_std, dtype=torch.float64, device=device)
     
     for i, batch in enumerate(tqdm(batch_sentences)): # for every batch
-        encoded_inputs = tokenizer(batch, is_split_into_words=True, padding=True, truncation=True, 
-             return_tensors="pt")
-        encoded_inputs.to(device)
-        outputs = model(**encoded_inputs, output_hidden_states=True)
-        states = outputs.hidden_states # tuple
-        # batch_size x seq_len x 3072
-        vector = torch.cat([states[i] for i in layers], 2) # concatenate last four
-        for j in range(len(batch)): # for every example
-            word_ids = encoded_inputs.word_ids(j)
-            word_tokenids = defaultdict(list) # {word : [token ids]}
-            for k, word_id in enumerate(word_ids): # for every token
-                target_word_id = batch_words[i][j][1]
-                target_word = batch_words[i][j][0]
-                if word_id is not None and word_id == target_word_id: 
-                    word_tokenids[target_word].append(k)
-            for word in word_tokenids: 
-                token_ids_word = np.array(word_tokenids[word]) 
-                word_embed = vector[j][token_ids_word]
-                word_embed = word_embed.mean(dim=0).detach().cpu().numpy() # average word pieces
-                if np.isnan(word_embed).any(): 
-                    print("PROBLEM!!!", word, batch[j])
-                    return 
-                word_cat = word + '_' + batch_meta[i][j]
-                if zscore: 
-                    word_embed = (word_embed - bert_mean) / bert_std # z-score
-                else: 
-                    word_embed = np.float64(word_embed)
-                    m = np.float64(m)
-                word_scores = fastdist.vector_to_matrix_distance(word_embed, m, fastdist.cosine, "cosine")
-                word_reps[word_cat].append(list(word_scores))
+        batch_spans = [[[target_word_id]] for _, target_word_id in batch_words[i]]
+        word_embeds = embed_spans(batch, batch_spans)
+        # targets that were truncated away are nan
+        found = ~torch.isnan(word_embeds).any(dim=1)
+        word_embeds = word_embeds[found].double()
+        if zscore: 
+            word_embeds = (word_embeds - bert_mean) / bert_std # z-score
+        scores = torch.mm(normalize_rows(word_embeds), m_normed.t()).cpu().numpy()
+        for row, j in enumerate(found.nonzero(as_tuple=True)[0].tolist()): 
+            word_cat = batch_words[i][j][0] + '_' + batch_meta[i][j]
+            occurrences.append((batch_idx[i][j], word_cat, list(scores[row])))
                 
         torch.cuda.empty_cache()
         
+    word_reps = defaultdict(list) # {word : [[axis scores for each occurrence]]} 
+    for _, word_cat, word_scores in sorted(occurrences, key=lambda tup: tup[0]): 
+        word_reps[word_cat].append(word_scores)
     return word_reps
         
 def get_axes_scores_variants(): 
@@ -350,7 +243,7 @@ def get_axes_scores_variants():
     'Foids' and 'foid' are wordpieces.
     '''
     print("batching...")
-    batch_sentences, batch_words, batch_meta = batch_data()
+    batch_sentences, batch_words, batch_meta, batch_idx = batch_data()
     print("NUMBER OF BATCHES:", len(batch_sentences))
     
     bert_mean = np.load(LOGS + 'wikipedia/mean_BERT.npy')
@@ -359,7 +252,7 @@ def get_axes_scores_variants():
     print("getting microframe matrix...")
     m = get_microframe_matrix()
     
-    word_reps = get_bert_embeddings(batch_sentences, batch_words, batch_meta, bert_mean, bert_std, m)
+    word_reps = get_bert_embeddings(batch_sentences, batch_words, batch_meta, batch_idx, bert_mean, bert_std, m)
         
     with open(VARIANT_OUT + 'scores.json', 'w') as outfile: 
         json.dump(word_reps, outfile)
@@ -367,13 +260,9 @@ def get_axes_scores_variants():
 def batch_data_domains(replace=False): 
     tokenizer = BasicTokenizer(do_lower_case=True)
     vocab = set(['feminists', 'women', 'girls', 'females'])
-    batch_size = 8
-    batch_sentences = [] # each item is a list
-    batch_words = [] # each item is a list
-    batch_meta = []
-    curr_batch = []
-    curr_words = []
-    curr_meta = []
+    sentences = [] # each item is a list
+    words = [] # (target word, token index)
+    metas = []
     
     with open(LOGS + 'wikipedia/women_data/part-00000', 'r') as infile: 
         print("going through wikipedia...")
@@ -389,18 +278,11 @@ def batch_data_domains(replace=False):
                 if replace: 
                     replaced_tokens = copy.deepcopy(tokens)
                     replaced_tokens[idx] = 'people'
-                    curr_batch.append(replaced_tokens)
+                    sentences.append(replaced_tokens)
                 else: 
-                    curr_batch.append(tokens)
-                curr_words.append((w, idx))
-                curr_meta.append('wikipedia')
-                if len(curr_batch) == batch_size: 
-                    batch_sentences.append(curr_batch)
-                    batch_words.append(curr_words)
-                    batch_meta.append(curr_meta)
-                    curr_batch = []
-                    curr_words = []   
-                    curr_meta = []
+                    sentences.append(tokens)
+                words.append((w, idx))
+                metas.append('wikipedia')
     with open(LOGS + 'women_control_sample.csv', 'r') as infile: 
         print("going through control...")
         reader = csv.reader(infile, delimiter='\t')
@@ -414,18 +296,11 @@ def batch_data_domains(replace=False):
                     if replace: 
                         replaced_tokens = copy.deepcopy(tokens)
                         replaced_tokens[idx] = 'people'
-                        curr_batch.append(replaced_tokens)
+                        sentences.append(replaced_tokens)
                     else: 
-                        curr_batch.append(tokens)
-                    curr_words.append((w, idx))
-                    curr_meta.append('control')
-                    if len(curr_batch) == batch_size: 
-                        batch_sentences.append(curr_batch)
-                        batch_words.append(curr_words)
-                        batch_meta.append(curr_meta)
-                        curr_batch = []
-                        curr_words = []   
-                        curr_meta = []
+                        sentences.append(tokens)
+                    words.append((w, idx))
+                    metas.append('control')
                     break
     with open(LOGS + 'women_extreme_sample.csv', 'r') as infile: 
         print("going through extreme...")
@@ -440,24 +315,13 @@ def batch_data_domains(replace=False):
                     if replace: 
                         replaced_tokens = copy.deepcopy(tokens)
                         replaced_tokens[idx] = 'people'
-                        curr_batch.append(replaced_tokens)
+                        sentences.append(replaced_tokens)
                     else: 
-                        curr_batch.append(tokens)
-                    curr_words.append((w, idx))
-                    curr_meta.append('extreme')
-                    if len(curr_batch) == batch_size: 
-                        batch_sentences.append(curr_batch)
-                        batch_words.append(curr_words)
-                        batch_meta.append(curr_meta)
-                        curr_batch = []
-                        curr_words = []   
-                        curr_meta = []
+                        sentences.append(tokens)
+                    words.append((w, idx))
+                    metas.append('extreme')
                     break            
-    if len(curr_batch) != 0: # fence post
-        batch_sentences.append(curr_batch)
-        batch_words.append(curr_words)
-        batch_meta.append(curr_meta)
-    return batch_sentences, batch_words, batch_meta
+    return pack_batches(sentences, words, metas)
         
 def get_axes_scores_domains(replace=False, zscore=True): 
     '''
@@ -465,7 +329,7 @@ def get_axes_scores_domains(replace=False, zscore=True):
     across domains. 
     '''
     print("batching...")
-    batch_sentences, batch_words, batch_meta = batch_data_domains(replace=replace)
+    batch_sentences, batch_words, batch_meta, batch_idx = batch_data_domains(replace=replace)
     
     bert_mean = np.load(LOGS + 'wikipedia/mean_BERT.npy')
     bert_std = np.load(LOGS + 'wikipedia/std_BERT.npy')
@@ -473,7 +337,8 @@ def get_axes_scores_domains(replace=False, zscore=True):
     print("getting microframe matrix...")
     m = get_microframe_matrix(zscore=zscore)
     
-    word_reps = get_bert_embeddings(batch_sentences, batch_words, batch_meta, bert_mean, bert_std, m, zscore=zscore)
+    word_reps = get_bert_embeddings(batch_sentences, batch_words, batch_meta, batch_idx, bert_mean, bert_std, m, 
+                                    zscore=zscore)
         
     if zscore: 
         with open(WOMEN_OUT + str(replace) + '_scores.json', 'w') as outfile: 
@@ -487,13 +352,9 @@ def batch_data_time(replace=True):
     
     p = inflect.engine()
     tokenizer = BasicTokenizer(do_lower_case=True)
-    batch_size = 8
-    batch_sentences = [] # each item is a list
-    batch_words = [] # each item is a list
-    batch_meta = []
-    curr_batch = []
-    curr_words = []
-    curr_meta = []
+    sentences = [] # each item is a list
+    words = [] # (target word, token index)
+    metas = []
     with open(LOGS + 'women_control_sample_time.csv', 'r') as infile: 
         print("going through control...")
         reader = csv.reader(infile, delimiter='\t')
@@ -516,18 +377,11 @@ def batch_data_time(replace=True):
                     if replace: 
                         replaced_tokens = copy.deepcopy(tokens)
                         replaced_tokens[idx] = replacement
-                        curr_batch.append(replaced_tokens)
+                        sentences.append(replaced_tokens)
                     else: 
-                        curr_batch.append(tokens)
-                    curr_words.append((w, idx))
-                    curr_meta.append('control_' + month + '_' + replacement + '_' + line_num)
-                    if len(curr_batch) == batch_size: 
-                        batch_sentences.append(curr_batch)
-                        batch_words.append(curr_words)
-                        batch_meta.append(curr_meta)
-                        curr_batch = []
-                        curr_words = []   
-                        curr_meta = []
+                        sentences.append(tokens)
+                    words.append((w, idx))
+                    metas.append('control_' + month + '_' + replacement + '_' + line_num)
                     break
     with open(LOGS + 'women_extreme_sample_time.csv', 'r') as infile: 
         print("going through extreme...")
@@ -550,28 +404,17 @@ def batch_data_time(replace=True):
                     if replace: 
                         replaced_tokens = copy.deepcopy(tokens)
                         replaced_tokens[idx] = replacement
-                        curr_batch.append(replaced_tokens)
+                        sentences.append(replaced_tokens)
                     else: 
-                        curr_batch.append(tokens)
-                    curr_words.append((w, idx))
-                    curr_meta.append('extreme_' + month + '_' + replacement + '_' + line_num)
-                    if len(curr_batch) == batch_size: 
-                        batch_sentences.append(curr_batch)
-                        batch_words.append(curr_words)
-                        batch_meta.append(curr_meta)
-                        curr_batch = []
-                        curr_words = []   
-                        curr_meta = []
+                        sentences.append(tokens)
+                    words.append((w, idx))
+                    metas.append('extreme_' + month + '_' + replacement + '_' + line_num)
                     break            
-    if len(curr_batch) != 0: # fence post
-        batch_sentences.append(curr_batch)
-        batch_words.append(curr_words)
-        batch_meta.append(curr_meta)
-    return batch_sentences, batch_words, batch_meta
+    return pack_batches(sentences, words, metas)
         
 def get_axes_scores_over_time(replace=True): 
     print("batching...")
-    batch_sentences, batch_words, batch_meta = batch_data_time(replace=replace)
+    batch_sentences, batch_words, batch_meta, batch_idx = batch_data_time(replace=replace)
     
     bert_mean = np.load(LOGS + 'wikipedia/mean_BERT.npy')
     bert_std = np.load(LOGS + 'wikipedia/std_BERT.npy')
@@ -579,12 +422,13 @@ def get_axes_scores_over_time(replace=True):
     print("getting microframe matrix...")
     m = get_microframe_matrix()
     
-    word_reps = get_bert_embeddings(batch_sentences, batch_words, batch_meta, bert_mean, bert_std, m)
+    word_reps = get_bert_embeddings(batch_sentences, batch_words, batch_meta, batch_idx, bert_mean, bert_std, m)
     
     with open(WOMEN_OUT + str(replace) + '_time_scores.json', 'w') as outfile: 
         json.dump(word_reps, outfile)
 
 def main(): 
+    enable_cache(LOGS + 'bert_cache/embeddings.sqlite')
     #get_overall_embeddings()
     #project_onto_axes() 
     #get_axes_scores_variants()
@@ -0,0 +1,62 @@
+'''
+Batching for BERT inference, shared by the embedding scripts.
+
+Instead of a fixed number of sentences in corpus order, examples are
+sorted by wordpiece length and packed into batches up to a token budget,
+so that sentences in a batch are padded to similar lengths.
+'''
+from transformers import BertTokenizerFast
+
+# padded tokens per batch, about the size of 8 long wikipedia sentences
+MAX_TOKENS = 2048
+MAX_BATCH_SIZE = 64
+
+def wordpiece_lengths(sentences, tokenizer=None):
+    '''
+    Number of wordpieces of each sentence after truncation, with [CLS] and [SEP]
+    @inputs:
+    - sentences: list of examples, each a list of words
+    '''
+    if tokenizer is None:
+        tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
+    if len(sentences) == 0:
+        return []
+    encoded = tokenizer(sentences, is_split_into_words=True, truncation=True)
+    return [len(ids) for ids in encoded['input_ids']]
+
+def length_batches(lengths, max_tokens=MAX_TOKENS, max_batch_size=MAX_BATCH_SIZE):
+    '''
+    Packs examples sorted by length so that each batch's
+    size times its longest example is at most max_tokens
+    @output:
+    - list of batches, each a list of example indices
+    '''
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    curr_batch = []
+    for i in order:
+        # lengths are increasing, so lengths[i] is the padded length
+        if curr_batch and ((len(curr_batch) + 1) * lengths[i] > max_tokens or len(curr_batch) == max_batch_size):
+            batches.append(curr_batch)
+            curr_batch = []
+        curr_batch.append(i)
+    if len(curr_batch) != 0: # fence post
+        batches.append(curr_batch)
+    return batches
+
+def pack_batches(sentences, *fields, tokenizer=None, max_tokens=MAX_TOKENS, max_batch_size=MAX_BATCH_SIZE):
+    '''
+    @inputs:
+    - sentences: list of examples, each a list of words
+    - fields: lists parallel to sentences, e.g. target words and metadata
+    @output:
+    - batch_sentences, then one batched list per field, in the same
+    format as fixed-size batching: each item is a list
+    - batch_idx: positions in the input of each batch's examples,
+    for putting results back into input order
+    '''
+    lengths = wordpiece_lengths(sentences, tokenizer=tokenizer)
+    batches = length_batches(lengths, max_tokens=max_tokens, max_batch_size=max_batch_size)
+    batch_sentences = [[sentences[i] for i in batch] for batch in batches]
+    batch_fields = [[[field[i] for i in batch] for batch in batches] for field in fields]
+    return (batch_sentences, *batch_fields, batches)
@@ -8,11 +8,16 @@ SUB_META = ROOT + 'data/subreddits.txt'
 
 from collections import defaultdict, Counter
 from tqdm import tqdm
+from functools import partial
+from multiprocessing import Pool
 import csv
 import os
-import pandas as pd
 import string
 
+PRONOUN_TYPES = ['fem', 'masc', 'they', 'it', 'you']
+PRONOUN_IDX = {pn: i for i, pn in enumerate(PRONOUN_TYPES)}
+PUNCT_TABLE = str.maketrans('', '', string.punctuation)
+
 def load_vocabulary(): 
     words = []
     with open(ANN_FILE, 'r') as csvfile:
@@ -57,100 +62,130 @@ def get_subreddit_categories():
             categories_rev[row['Category after majority agreement']].append(name)
     return categories, categories_rev
 
-def create_coref_df(dataset): 
+def count_coref_file(filename, dataset='', words=set(), pronoun_map={}, categories={}): 
+    '''
+    Counts pronouns referring to vocab terms in one coref output file
+    @output: 
+    - counts: { (year, community, word) : [count for each of PRONOUN_TYPES] }
+    - errors: lines for the error file, for clusters without a vocab term
+    '''
+    counts = {}
+    errors = []
+    if dataset == 'reddit' or dataset == 'dating': 
+        year_month = filename.replace(dataset + '_', '')
+        year = year_month.split('-')[0]  
+    else: 
+        year_month = filename
+    line_num = 0
+    with open(COREF_FOLDER + dataset.lower() + '/' + filename, 'r') as infile: 
+        reader = csv.reader(infile, delimiter='\t')
+        for contents in reader: 
+            if len(contents) <= 1: 
+                line_num += 1
+                continue # no clusters
+            if dataset == 'reddit': 
+                community = contents[0]
+                cat = categories[community]
+            elif dataset == 'dating': 
+                cat = 'dating'
+            elif dataset == 'forum':
+                cat = filename
+                date = contents[0]
+                year = date.split('-')[0]
+            if cat == 'Health' or cat == 'Criticism': 
+                line_num += 1
+                continue
+            for clust in contents[1:]:
+                # remove stray emoji and punctuation mark from error file
+                clust = clust.lower().replace('‘', '').replace('💘', '')
+                clust = set(clust.split('$'))
+                clust_vocab_terms = set()
+                pronouns = set()
+                for term in clust: 
+                    term = term.translate(PUNCT_TABLE)
+                    # bigrams and unigrams with deteminers/posessives
+                    w_tokens = term.split(' ')
+                    if len(w_tokens) > 3: continue
+                    # 'the wife' -> wife, 'the hot wife' -> hot wife
+                    w_except_first = ' '.join(w_tokens[1:])
+                    # 'hot wife' -> wife
+                    last_token = w_tokens[-1]
+                    if term in words: 
+                        # 'wife'
+                        clust_vocab_terms.add(term)
+                    if w_except_first in words: 
+                        clust_vocab_terms.add(w_except_first)
+                    if last_token in words: 
+                        clust_vocab_terms.add(last_token)
+                    # find pronouns
+                    if term in pronoun_map: 
+                        pronouns.add(pronoun_map[term])
+
+                if len(clust_vocab_terms) == 0: 
+                    errors.append(str(line_num) + ' ' + year_month + '\n')
+                    errors.append('\t'.join(contents) + '\n')
+                    errors.append('$'.join(clust) + '\n')
+
+                for k in clust_vocab_terms: 
+                    for pn in pronouns: 
+                        key = (year, cat, k)
+                        if key not in counts: 
+                            counts[key] = [0] * len(PRONOUN_TYPES)
+                        counts[key][PRONOUN_IDX[pn]] += 1
+            line_num += 1
+    return counts, errors
+
+def get_file_group(dataset, filename): 
+    '''
+    Files in different groups never share a (year, community, word) key: 
+    reddit and dating files are grouped by year, and forums by forum. 
+    '''
+    if dataset == 'reddit' or dataset == 'dating': 
+        return filename.replace(dataset + '_', '').split('-')[0]
+    return filename
+
+def create_coref_df(dataset, processes=None): 
+    '''
+    Coref result files are counted in a process pool, and each
+    group of files (see get_file_group) is written out to the
+    dataframe csv as soon as all of its files are counted, so memory
+    only holds counts for groups that are in progress. 
+    '''
     # load vocabulary 
-    words = load_vocabulary()
+    words = set(load_vocabulary())
     pronoun_map = get_pronoun_map()
     categories, categories_rev = get_subreddit_categories()
+    count_file = partial(count_coref_file, dataset=dataset, words=words, 
+                         pronoun_map=pronoun_map, categories=categories)
     
-    d = defaultdict(list) # { (month, community, word) : [fem, masc, masc, fem, etc...] } 
+    filenames = os.listdir(COREF_FOLDER + dataset.lower() + '/')
+    filenames = sorted(filenames, key=lambda f: get_file_group(dataset, f))
+    files_left = Counter([get_file_group(dataset, f) for f in filenames])
+    group_counts = defaultdict(dict) # { group : { (year, community, word) : counts } } 
     
     error_file = open(COREF_FOLDER + dataset + '_errors.temp', 'w')
-    for filename in tqdm(os.listdir(COREF_FOLDER + dataset.lower() + '/')):
-        if dataset == 'reddit' or dataset == 'dating': 
-            year_month = filename.replace(dataset + '_', '')
-            year = year_month.split('-')[0]  
-        line_num = 0
-        with open(COREF_FOLDER + dataset.lower() + '/' + filename, 'r') as infile: 
-            reader = csv.reader(infile, delimiter='\t')
-            for contents in reader: 
-                if len(contents) <= 1: 
-                    line_num += 1
-                    continue # no clusters
-                if dataset == 'reddit': 
-                    community = contents[0]
-                    cat = categories[community]
-                elif dataset == 'dating': 
-                    cat = 'dating'
-                elif dataset == 'forum':
-                    cat = filename
-                    date = contents[0]
-                    year = date.split('-')[0]
-                if cat == 'Health' or cat == 'Criticism': 
-                    line_num += 1
-                    continue
-                for clust in contents[1:]:
-                    # remove stray emoji and punctuation mark from error file
-                    clust = clust.lower().replace('‘', '').replace('💘', '')
-                    clust = set(clust.split('$'))
-                    clust_vocab_terms = set()
-                    pronouns = set()
-                    for term in clust: 
-                        term = term.translate(str.maketrans('', '', string.punctuation))
-                        # bigrams and unigrams with deteminers/posessives
-                        w_tokens = term.split(' ')
-                        if len(w_tokens) > 3: continue
-                        # 'the wife' -> wife, 'the hot wife' -> hot wife
-                        w_except_first = ' '.join(w_tokens[1:])
-                        # 'hot wife' -> wife
-                        last_token = w_tokens[-1]
-                        if term in words: 
-                            # 'wife'
-                            clust_vocab_terms.add(term)
-                        if w_except_first in words: 
-                            clust_vocab_terms.add(w_except_first)
-                        if last_token in words: 
-                            clust_vocab_terms.add(last_token)
-                        # find pronouns
-                        if term in pronoun_map: 
-                            pronouns.add(pronoun_map[term])
-
-                    if len(clust_vocab_terms) == 0: 
-                        error_file.write(str(line_num) + ' ' + year_month + '\n')
-                        error_file.write('\t'.join(contents) + '\n')
-                        error_file.write('$'.join(clust) + '\n')
-
-                    for k in clust_vocab_terms: 
-                        for pn in pronouns: 
-                            d[(year, cat, k)].append(pn)
-                line_num += 1
+    outfile = open(COREF_FOLDER + 'coref_' + dataset + '_df.csv', 'w')
+    writer = csv.writer(outfile)
+    writer.writerow(['year', 'community', 'word'] + PRONOUN_TYPES)
+    with Pool(processes) as pool: 
+        results = pool.imap(count_file, filenames)
+        for filename, (counts, errors) in tqdm(zip(filenames, results), total=len(filenames)):
+            group = get_file_group(dataset, filename)
+            # merge partial counts
+            merged = group_counts[group]
+            for key in counts: 
+                if key not in merged: 
+                    merged[key] = counts[key]
+                else: 
+                    merged[key] = [a + b for a, b in zip(merged[key], counts[key])]
+            error_file.writelines(errors)
+            files_left[group] -= 1
+            if files_left[group] == 0: 
+                for key in group_counts[group]: 
+                    writer.writerow(list(key) + group_counts[group][key])
+                del group_counts[group]
     error_file.close()
-                            
-    print("Creating dataframe...")
-    dataframe_d = {'year': [],
-                   'community': [], 
-                   'word': [], 
-                   'fem': [], # count
-                   'masc': [], # count
-                   'they': [], # count
-                   'it': [],
-                   'you': []
-                          }
-    for tup in tqdm(d): 
-        year, community, word = tup
-        pronoun_count = Counter(d[tup])
-        dataframe_d['year'].append(year)
-        dataframe_d['community'].append(community)
-        dataframe_d['word'].append(word)
-        dataframe_d['fem'].append(pronoun_count['fem'])
-        dataframe_d['masc'].append(pronoun_count['masc'])
-        dataframe_d['they'].append(pronoun_count['they'])
-        dataframe_d['it'].append(pronoun_count['it'])
-        dataframe_d['you'].append(pronoun_count['you'])
-        
-    df = pd.DataFrame.from_dict(dataframe_d)
-    
-    df.to_csv(COREF_FOLDER + 'coref_' + dataset + '_df.csv', index=False, header=True)
+    outfile.close()
     
 def main(): 
     create_coref_df('dating')
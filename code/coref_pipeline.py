@@ -0,0 +1,91 @@
+'''
+Batched spaCy + neuralcoref driver used by coref_runner.py.
+
+Chunks of documents are streamed through nlp.pipe, and output rows
+are written in input order so that coref_helper.create_coref_df
+can read the results as before.
+
+Output format: label \t cluster1word1$cluster1word2 \t cluster2word1$cluster2word2$cluster2word3$cluster2word4 \n
+where label is a subreddit or a date.
+'''
+
+import spacy
+import neuralcoref
+
+# neuralcoref's mention detection uses tags, dependencies and entities
+COREF_PIPES = set(['tagger', 'parser', 'ner'])
+BATCH_SIZE = 64
+CHUNK_SIZE = 2000
+
+def load_nlp():
+    '''
+    Loads spaCy with neuralcoref, removing any pipeline
+    components that coref does not need
+    '''
+    nlp = spacy.load('en_core_web_sm')
+    for name in nlp.pipe_names:
+        if name not in COREF_PIPES:
+            nlp.remove_pipe(name)
+    neuralcoref.add_to_pipe(nlp)
+    return nlp
+
+def write_out_clusters(label, doc, writer, words):
+    outstring = [label.lower()]
+    for c in doc._.coref_clusters: # for coref cluster in doc
+        keep_cluster = False
+        for s in c.mentions: # for span in cluster
+            if s.text.lower() in words: # SCENARIO 2
+                keep_cluster = True
+                break
+            if s[0].dep_ in {'det','poss'}: # SCENARIO 1
+                new_s = s[1:]
+                if new_s.text.lower() in words:
+                    keep_cluster = True
+                    break
+        if keep_cluster:
+            curr_cluster = []
+            for s in c.mentions: # for span in cluster
+                entity = s.text.lower()
+                entity = entity.replace("\n", "")
+                entity = entity.replace("\r", "")
+                entity = entity.replace("\t", "")
+                curr_cluster.append(entity)
+            outstring.append("$".join(curr_cluster))
+    writer.writerow(outstring)
+
+def parse_chunk(nlp, texts, batch_size, n_process):
+    '''
+    Runs a chunk of texts through nlp.pipe. If the chunk runs out of memory,
+    it is redone one text at a time so that only the offending texts
+    are skipped, and those get None.
+    '''
+    try:
+        return list(nlp.pipe(texts, batch_size=batch_size, n_process=n_process))
+    except MemoryError:
+        docs = []
+        for text in texts:
+            try:
+                docs.append(nlp(text))
+            except MemoryError:
+                docs.append(None)
+        return docs
+
+def process_chunk(nlp, chunk, writer, words, error_outfile, batch_size=BATCH_SIZE, n_process=1):
+    '''
+    @inputs:
+    - chunk: list of (label, text, line), where text is None if the
+    document is not valid, in which case only the label is written out
+    - batch_size, n_process: passed to nlp.pipe
+    '''
+    texts = [text for _, text, _ in chunk if text is not None]
+    docs = iter(parse_chunk(nlp, texts, batch_size, n_process))
+    for label, text, line in chunk:
+        if text is None:
+            writer.writerow([label.lower()])
+            continue
+        doc = next(docs)
+        if doc is None:
+            writer.writerow([label.lower()])
+            error_outfile.write(line + '\n')
+            continue
+        write_out_clusters(label, doc, writer, words)
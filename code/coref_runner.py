@@ -0,0 +1,265 @@
+'''
+Goal: get pronouns that refer to
+a word in our vocabulary.
+
+Resumable coref jobs for all of our datasets. A job is one month
+(reddit, dating, control) or one forum, and can be split into
+shards, which are byte ranges of each of its input files.
+Progress is checkpointed by byte offset after every chunk, so a
+killed job continues where it left off when rerun with the same arguments.
+
+Examples of use:
+python coref_runner.py --dataset reddit --subset 2015-01
+python coref_runner.py --dataset forum --subset incels --num_shards 8
+# on a cluster, run each shard as its own job and then merge
+python coref_runner.py --dataset reddit --subset 2019-06 --num_shards 8 --shard 3
+python coref_runner.py --dataset reddit --subset 2019-06 --num_shards 8 --merge
+
+Output format: subreddit (or date) \t cluster1word1$cluster1word2 \t cluster2word1$cluster2word2$cluster2word3$cluster2word4 \n
+'''
+
+import argparse
+import csv
+import json
+import os
+from functools import partial
+from multiprocessing import Process
+from coref_validity import load_vocabulary, check_valid_comment, check_valid_post, check_valid_forum
+from coref_pipeline import load_nlp, process_chunk, BATCH_SIZE, CHUNK_SIZE
+
+
+ROOT = '/global/scratch/users/lucy3_li/manosphere/'
+LOGS = ROOT + 'logs/'
+POSTS = ROOT + 'data/submissions/'
+COMMENTS = ROOT + 'data/comments/'
+DATING = ROOT + 'data/reddit_dating/'
+REDDIT_CONTROL = ROOT + 'data/reddit_control/'
+FORUMS = ROOT + 'data/cleaned_forums/'
+COREF_OUT = LOGS + 'coref_results/'
+CKPT_DIR = LOGS + 'coref_checkpoints/'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dataset', required=True, type=str,
+                    help='reddit, dating, control, or forum')
+parser.add_argument('--subset', required=True, type=str,
+                    help='for reddit/dating/control, should be a month, for forum, should be a forum')
+parser.add_argument('--num_shards', type=int, default=1,
+                    help='number of byte ranges to split input files into')
+parser.add_argument('--shard', type=int,
+                    help='only run this shard, otherwise all shards are run in parallel and merged')
+parser.add_argument('--merge', action='store_true',
+                    help='concatenate finished shards into the final output')
+parser.add_argument('--n_process', type=int, default=1,
+                    help='passed to nlp.pipe')
+parser.add_argument('--batch_size', type=int, default=BATCH_SIZE,
+                    help='passed to nlp.pipe')
+parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE,
+                    help='number of lines between checkpoints')
+
+def comment_item(d):
+    if check_valid_comment(d):
+        return d['subreddit'], d['body']
+    return d['subreddit'], None
+
+def post_item(d):
+    if check_valid_post(d):
+        return d['subreddit'], d['selftext']
+    return d['subreddit'], None
+
+def control_item(d):
+    '''
+    Control months have comments and posts in the same file
+    '''
+    valid_post = check_valid_post(d)
+    valid_comment = check_valid_comment(d)
+    if valid_post and not valid_comment:
+        return d['subreddit'], d['selftext']
+    if valid_comment and not valid_post:
+        return d['subreddit'], d['body']
+    return d['subreddit'], None
+
+def forum_item(d, forum_name=''):
+    '''
+    Forum posts are labeled by date, and posts without a date are skipped
+    '''
+    # skip the really long post (id_post: 2380578)
+    if forum_name == "incels" and d["id_post"] == 2380578: return None
+    if d['date_post'] is None: return None
+    date = d['date_post'][0:10]
+    if check_valid_forum(d):
+        return date, d['text_post']
+    return date, None
+
+def reddit_inputs(com_dir, post_dir, month):
+    if os.path.exists(post_dir + 'RS_' + month + '/part-00000'):
+        post_path = post_dir + 'RS_' + month + '/part-00000'
+    else:
+        post_path = post_dir + 'RS_v2_' + month + '/part-00000'
+    return [(com_dir + 'RC_' + month + '/part-00000', comment_item), (post_path, post_item)]
+
+def get_job(dataset, subset):
+    '''
+    Dataset adapters.
+    @output:
+    - inputs: [(input path, item function)], where the item function maps a json
+    to (label, text), with text None if the json is not valid, or returns None to skip the line
+    - out_name: name of the output file in COREF_OUT
+    - error_name: name of the error file in LOGS
+    '''
+    month = subset.replace('RC_', '')
+    if dataset == 'reddit':
+        return reddit_inputs(COMMENTS, POSTS, month), 'reddit_' + month, 'reddit_errors'
+    elif dataset == 'dating':
+        return reddit_inputs(DATING, DATING, month), 'dating_' + month, 'reddit_dating_errors'
+    elif dataset == 'control':
+        return [(REDDIT_CONTROL + month + '/part-00000', control_item)], 'CONTROL_' + month, 'reddit_control_errors'
+    elif dataset == 'forum':
+        return [(FORUMS + subset, partial(forum_item, forum_name=subset))], subset, 'forum_errors'
+    else:
+        raise ValueError('Unknown dataset: ' + dataset)
+
+def shard_name(out_name, shard, num_shards):
+    return out_name + '.shard' + str(shard) + 'of' + str(num_shards)
+
+def load_checkpoint(path):
+    '''
+    {input file index : {'offset': byte offset in input, 'out_bytes': size of output,
+    'err_bytes': size of the shard's error file, 'done': bool}}
+    '''
+    if not os.path.exists(path): return {}
+    with open(path, 'r') as infile:
+        return json.load(infile)
+
+def save_checkpoint(path, ckpt):
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump(ckpt, outfile)
+    os.replace(path + '.tmp', path)
+
+def read_lines(infile, end, chunk_size):
+    '''
+    Reads up to chunk_size lines that start before byte offset end
+    '''
+    lines = []
+    while len(lines) < chunk_size and infile.tell() < end:
+        raw = infile.readline()
+        if not raw: break
+        lines.append(raw.decode('utf-8').rstrip('\n'))
+    return lines
+
+def run_shard(dataset, subset, shard, num_shards, batch_size=BATCH_SIZE, n_process=1, chunk_size=CHUNK_SIZE):
+    '''
+    Runs coref on the lines of each input file that start in this shard's byte range,
+    writing to a part file and an error file in CKPT_DIR and checkpointing after every chunk.
+    '''
+    inputs, out_name, _ = get_job(dataset, subset)
+    words = load_vocabulary()
+    nlp = load_nlp()
+    name = shard_name(out_name, shard, num_shards)
+    ckpt_path = CKPT_DIR + name + '.json'
+    ckpt = load_checkpoint(ckpt_path)
+    # the error file is shared by the shard's inputs, and only grows
+    error_path = CKPT_DIR + name + '.errors'
+    if os.path.exists(error_path):
+        os.truncate(error_path, max([state.get('err_bytes', 0) for state in ckpt.values()] + [0]))
+    error_outfile = open(error_path, 'a')
+    for file_idx, (path, item_fn) in enumerate(inputs):
+        key = str(file_idx)
+        state = ckpt.get(key, {'offset': None, 'out_bytes': 0, 'err_bytes': 0, 'done': False})
+        if state['done']: continue
+        part_path = CKPT_DIR + name + '.part' + key
+        size = os.path.getsize(path)
+        start = size * shard // num_shards
+        end = size * (shard + 1) // num_shards
+        # drop any output written after the last checkpoint
+        if os.path.exists(part_path):
+            os.truncate(part_path, state['out_bytes'])
+        with open(path, 'rb') as infile, open(part_path, 'a') as outfile:
+            writer = csv.writer(outfile, delimiter='\t')
+            if state['offset'] is not None:
+                infile.seek(state['offset'])
+            elif start > 0:
+                # move to the first line that starts in this shard
+                infile.seek(start - 1)
+                infile.readline()
+            while True:
+                lines = read_lines(infile, end, chunk_size)
+                if len(lines) == 0: break
+                chunk = []
+                for line in lines:
+                    item = item_fn(json.loads(line))
+                    if item is not None:
+                        chunk.append((item[0], item[1], line))
+                process_chunk(nlp, chunk, writer, words, error_outfile,
+                              batch_size=batch_size, n_process=n_process)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+                error_outfile.flush()
+                os.fsync(error_outfile.fileno())
+                state['offset'] = infile.tell()
+                state['out_bytes'] = os.path.getsize(part_path)
+                state['err_bytes'] = os.path.getsize(error_path)
+                ckpt[key] = state
+                save_checkpoint(ckpt_path, ckpt)
+        state['done'] = True
+        ckpt[key] = state
+        save_checkpoint(ckpt_path, ckpt)
+    error_outfile.close()
+
+def merge_shards(dataset, subset, num_shards):
+    '''
+    Concatenates finished part files, in input file and shard order,
+    into the final output in COREF_OUT, appends the shards' error files
+    to the error file in LOGS, and removes them.
+    '''
+    inputs, out_name, error_name = get_job(dataset, subset)
+    names = [shard_name(out_name, shard, num_shards) for shard in range(num_shards)]
+    for name in names:
+        ckpt = load_checkpoint(CKPT_DIR + name + '.json')
+        for file_idx in range(len(inputs)):
+            if not ckpt.get(str(file_idx), {}).get('done', False):
+                print("NOT DONE:", name, 'input', file_idx)
+                return
+    out_path = COREF_OUT + out_name
+    with open(out_path + '.tmp', 'w') as outfile:
+        for file_idx in range(len(inputs)):
+            for name in names:
+                with open(CKPT_DIR + name + '.part' + str(file_idx), 'r') as infile:
+                    for line in infile:
+                        outfile.write(line)
+    os.replace(out_path + '.tmp', out_path)
+    with open(LOGS + error_name, 'a') as outfile:
+        for name in names:
+            if not os.path.exists(CKPT_DIR + name + '.errors'): continue
+            with open(CKPT_DIR + name + '.errors', 'r') as infile:
+                for line in infile:
+                    outfile.write(line)
+    for name in names:
+        for file_idx in range(len(inputs)):
+            os.remove(CKPT_DIR + name + '.part' + str(file_idx))
+        if os.path.exists(CKPT_DIR + name + '.errors'):
+            os.remove(CKPT_DIR + name + '.errors')
+        os.remove(CKPT_DIR + name + '.json')
+
+def main():
+    args = parser.parse_args()
+    os.makedirs(CKPT_DIR, exist_ok=True)
+    if args.merge:
+        merge_shards(args.dataset, args.subset, args.num_shards)
+        return
+    shard_args = dict(batch_size=args.batch_size, n_process=args.n_process, chunk_size=args.chunk_size)
+    if args.shard is not None:
+        run_shard(args.dataset, args.subset, args.shard, args.num_shards, **shard_args)
+        return
+    # not a Pool, since its daemonic workers can't start nlp.pipe's processes
+    workers = []
+    for shard in range(args.num_shards):
+        p = Process(target=run_shard, args=(args.dataset, args.subset, shard, args.num_shards),
+                    kwargs=shard_args)
+        p.start()
+        workers.append(p)
+    for p in workers:
+        p.join()
+    merge_shards(args.dataset, args.subset, args.num_shards)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''
+Shared vocabulary loading and validity checks
+for the coref scripts.
+
+Checks take already parsed jsons, and the bot set
+is read from disk once per process.
+'''
+
+import csv
+from functools import lru_cache
+
+ROOT = '/global/scratch/users/lucy3_li/manosphere/'
+LOGS = ROOT + 'logs/'
+ANN_FILE = ROOT + 'data/ann_sig_entities.csv'
+BOTS = LOGS + 'reddit_bots.txt'
+# neuralcoref runs out of memory on longer texts
+MAX_LEN = 1000000
+
+@lru_cache(maxsize=None)
+def get_bots():
+    '''
+    frozenset of bot usernames from reddit_bots.txt
+    '''
+    bots = set()
+    with open(BOTS, 'r') as infile:
+        for line in infile:
+            bots.add(line.strip())
+    return frozenset(bots)
+
+def load_vocabulary():
+    '''
+    Set of lowercased vocab words, without 'he' and 'she'
+    '''
+    words = set()
+    with open(ANN_FILE, 'r') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            if row['keep'] == 'Y':
+                words.add(row['entity'].lower())
+    words.discard('he')
+    words.discard('she')
+    return words
+
+def valid_text(text):
+    if len(text) > MAX_LEN: return False
+    if text == "" or text == "[deleted]" or text == "[removed]": return False
+    return True
+
+def check_valid_comment(d):
+    '''
+    For Reddit comments
+    '''
+    if 'body' not in d: return False
+    if not valid_text(d['body']): return False
+    return d.get('author') not in get_bots()
+
+def check_valid_post(d):
+    '''
+    For Reddit posts
+    '''
+    if 'selftext' not in d: return False
+    if not valid_text(d['selftext']): return False
+    return d.get('author') not in get_bots()
+
+def check_valid_forum(d):
+    '''
+    For forums posts
+    '''
+    if 'text_post' not in d: return False
+    return valid_text(d['text_post'])
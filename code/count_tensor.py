@@ -0,0 +1,193 @@
+'''
+N-gram counts as a sparse word x community x month tensor, an
+alternative to the (word, count, community, month) parquets from
+gram_counting.py that can be queried in memory without Spark.
+
+A tensor is a folder with:
+- words.txt, communities.txt, months.txt: labels, one per line, whose
+line numbers are the integer ids
+- word_ids.npy, community_ids.npy, month_ids.npy, counts.npy: nonzero
+entries in COO format, sorted by month, then community, then word
+- month_ptr.npy: entries of month m are month_ptr[m]:month_ptr[m+1],
+so each month is a CSR matrix of communities x words
+- ngram.npy: number of tokens in each word, e.g. 2 for bigrams
+'''
+import os
+import numpy as np
+from scipy import sparse
+
+AXES = ('word', 'community', 'month')
+LABEL_NAMES = {'word': 'words', 'community': 'communities', 'month': 'months'}
+
+def new_array_file(path, dtype, size):
+    '''
+    Writable memory-mapped .npy of the given length
+    '''
+    if size == 0: # can't memory-map an empty file
+        np.save(path, np.zeros(0, dtype=dtype))
+        return np.zeros(0, dtype=dtype)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(size,))
+
+def label_ids(df, column):
+    '''
+    @output:
+    - ids: dataframe of (column, column_id), with ids in sorted label order
+    - labels: sorted RDD of the distinct labels, persisted
+    '''
+    labels = df.select(column).distinct().rdd.map(lambda row: row[0]).sortBy(lambda label: label)
+    labels = labels.persist()
+    ids = labels.zipWithIndex().toDF([column, column + '_id'])
+    return ids, labels
+
+def write_labels(folder, axis, labels):
+    '''
+    Streams sorted labels to their text file, and for words, their ngram.npy
+    @output:
+    - number of labels
+    '''
+    num_labels = labels.count()
+    ngram = new_array_file(folder + 'ngram.npy', np.int8, num_labels) if axis == 'word' else None
+    with open(folder + LABEL_NAMES[axis] + '.txt', 'w') as outfile:
+        for i, label in enumerate(labels.toLocalIterator()):
+            outfile.write(label + '\n')
+            if ngram is not None:
+                ngram[i] = len(label.split(' '))
+    if ngram is not None and num_labels > 0:
+        ngram.flush()
+    return num_labels
+
+def entry_chunk(rows):
+    '''
+    One int64 array of (month id, community id, word id, count) per Spark partition
+    '''
+    entries = [(row.month_id, row.community_id, row.word_id, row['count']) for row in rows]
+    return [np.array(entries, dtype=np.int64).reshape(-1, 4)]
+
+def export_count_tensor(df, folder):
+    '''
+    Label ids, summing of duplicate cells, and sorting are done in Spark.
+    Sorted partitions are then streamed into memory-mapped files, so
+    the driver holds one partition at a time rather than the whole tensor.
+    @inputs:
+    - df: spark dataframe of (word, count, community, month) rows
+    - folder: where to write the tensor, created if it doesn't exist
+    '''
+    # imported here so that the query functions below don't need Spark
+    from pyspark.sql.functions import sum
+    if not folder.endswith('/'):
+        folder += '/'
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    entries = df
+    sizes = {}
+    all_labels = []
+    for axis in AXES:
+        ids, labels = label_ids(df, axis)
+        sizes[axis] = write_labels(folder, axis, labels)
+        entries = entries.join(ids, axis)
+        all_labels.append(labels)
+    entries = entries.groupBy('month_id', 'community_id', 'word_id').agg(sum('count').alias('count'))
+    entries = entries.orderBy('month_id', 'community_id', 'word_id').persist()
+    num_entries = entries.count()
+    
+    outputs = {'month_ids': new_array_file(folder + 'month_ids.npy', np.int32, num_entries),
+               'community_ids': new_array_file(folder + 'community_ids.npy', np.int32, num_entries),
+               'word_ids': new_array_file(folder + 'word_ids.npy', np.int32, num_entries),
+               'counts': new_array_file(folder + 'counts.npy', np.int64, num_entries)}
+    month_sizes = np.zeros(sizes['month'], dtype=np.int64)
+    start = 0
+    # partitions of a sorted dataframe come back in sort order
+    for chunk in entries.rdd.mapPartitions(entry_chunk).toLocalIterator():
+        end = start + chunk.shape[0]
+        for col_idx, name in enumerate(['month_ids', 'community_ids', 'word_ids', 'counts']):
+            outputs[name][start:end] = chunk[:, col_idx]
+        month_sizes += np.bincount(chunk[:, 0], minlength=sizes['month'])
+        start = end
+    assert start == num_entries
+    for name in outputs:
+        if num_entries > 0:
+            outputs[name].flush()
+    np.save(folder + 'month_ptr.npy', np.concatenate([[0], np.cumsum(month_sizes)]).astype(np.int64))
+    entries.unpersist()
+    for labels in all_labels:
+        labels.unpersist()
+
+def load_count_tensor(folder, mmap=True):
+    '''
+    @output:
+    - tensor: dict with the arrays above, memory-mapped if mmap, labels
+    as lists under 'words', 'communities', 'months', and {label : id}
+    under 'word_index', 'community_index', 'month_index'
+    '''
+    if not folder.endswith('/'):
+        folder += '/'
+    mode = 'r' if mmap else None
+    tensor = {}
+    for name in ['word_ids', 'community_ids', 'month_ids', 'counts', 'month_ptr', 'ngram']:
+        tensor[name] = np.load(folder + name + '.npy', mmap_mode=mode)
+    for axis in AXES:
+        with open(folder + LABEL_NAMES[axis] + '.txt', 'r') as infile:
+            labels = [line.rstrip('\n') for line in infile]
+        tensor[LABEL_NAMES[axis]] = labels
+        tensor[axis + '_index'] = {label: i for i, label in enumerate(labels)}
+    return tensor
+
+def axis_size(tensor, axis):
+    return len(tensor[axis + '_index'])
+
+def select(tensor, words=None, communities=None, months=None, ngram=None):
+    '''
+    Subset of a tensor's entries, with the same labels and ids
+    - words, communities, months: labels to keep, all if None
+    - ngram: only keep words with this many tokens, e.g. 1 for unigrams
+    '''
+    keep = np.ones(len(tensor['counts']), dtype=bool)
+    for axis, labels in [('word', words), ('community', communities), ('month', months)]:
+        if labels is None: continue
+        ids = [tensor[axis + '_index'][label] for label in labels if label in tensor[axis + '_index']]
+        keep &= np.isin(tensor[axis + '_ids'], ids)
+    if ngram is not None:
+        keep &= np.asarray(tensor['ngram'])[tensor['word_ids']] == ngram
+    subset = dict(tensor)
+    for name in ['word_ids', 'community_ids', 'month_ids', 'counts']:
+        subset[name] = np.asarray(tensor[name])[keep]
+    subset['month_ptr'] = np.searchsorted(subset['month_ids'], np.arange(axis_size(tensor, 'month') + 1))
+    return subset
+
+def total(tensor):
+    return int(np.sum(tensor['counts']))
+
+def marginal(tensor, keep):
+    '''
+    Sums counts over the axes that are not in keep
+    - keep: one axis name, e.g. 'month', or a pair, e.g. ('word', 'month')
+    @output:
+    - array of counts per label for one axis, or a sparse csr matrix for a pair
+    '''
+    if isinstance(keep, str):
+        return np.bincount(tensor[keep + '_ids'], weights=tensor['counts'],
+                           minlength=axis_size(tensor, keep)).astype(np.int64)
+    row_axis, col_axis = keep
+    matrix = sparse.coo_matrix((np.asarray(tensor['counts']), (tensor[row_axis + '_ids'], tensor[col_axis + '_ids'])),
+                               shape=(axis_size(tensor, row_axis), axis_size(tensor, col_axis)))
+    return matrix.tocsr() # sums duplicates
+
+def marginal_dict(tensor, axis):
+    '''
+    {label : count} for labels with a nonzero count, e.g. the
+    unigram totals per month used by lexical_change.py
+    '''
+    labels = tensor[LABEL_NAMES[axis]]
+    counts = marginal(tensor, axis)
+    return {labels[i]: int(counts[i]) for i in np.nonzero(counts)[0]}
+
+def month_slice(tensor, month):
+    '''
+    @output:
+    - communities x words csr matrix of counts in one month
+    '''
+    m = tensor['month_index'][month]
+    start, end = tensor['month_ptr'][m], tensor['month_ptr'][m + 1]
+    return sparse.csr_matrix((np.asarray(tensor['counts'][start:end]),
+                              (tensor['community_ids'][start:end], tensor['word_ids'][start:end])),
+                             shape=(axis_size(tensor, 'community'), axis_size(tensor, 'word')))
@@ -5,15 +5,20 @@ Single pass over each subreddit and forum
 to sample a specific number of posts from each. 
 
 This is used for evaluating different NER models. 
+
+Months/forums are sampled in a process pool, and each
+shard's reservoirs are merged exactly afterwards (see reservoir_add). 
 """
 import json
 import os
 import sys
 from collections import defaultdict, Counter
+from functools import partial
+from multiprocessing import Pool
+import heapq
 import random
 import csv
-import re
-from helpers import get_sr_cats, valid_line, get_manual_people
+from helpers import get_sr_cats, valid_line, get_manual_people, read_month_store, build_vocab_matcher, vocab_in_text
 import inflect
 
 #ROOT = '/global/scratch/lucy3_li/manosphere/'
@@ -28,82 +33,118 @@ GLOSSWORD_OUT = LOGS + 'glossword_sample'
 PEOPLE_FILE = ROOT + 'data/people.csv'
 CONTROL = ROOT + 'data/reddit_dating/'
 
+def shard_rng(seed, shard): 
+    '''
+    Random number generator for one shard (e.g. a month or forum), 
+    so that runs are reproducible regardless of process scheduling
+    '''
+    return random.Random(str(seed) + '_' + str(shard))
+
+def reservoir_add(reservoir, item, rng, k, weight=1.0): 
+    '''
+    Weighted reservoir sampling (Efraimidis & Spirakis' A-Res). 
+    Each item gets the random priority u^(1/weight), and the reservoir, 
+    a min-heap of (priority, item), keeps the k items with highest priority. 
+    Since the sample only depends on priorities, reservoirs filled on different
+    shards can be merged exactly with merge_reservoirs(). 
+    '''
+    priority = rng.random() ** (1.0 / weight)
+    if len(reservoir) < k: 
+        heapq.heappush(reservoir, (priority, item))
+    elif priority > reservoir[0][0]: 
+        heapq.heapreplace(reservoir, (priority, item))
+        
+def merge_reservoirs(partials, k): 
+    '''
+    Merges a list of {key : reservoir} from different shards into one
+    {key : reservoir}, which is distributed the same as if all
+    shards were sampled in one sequential pass. 
+    '''
+    merged = defaultdict(list)
+    for part in partials: 
+        for key in part: 
+            for entry in part[key]: 
+                if len(merged[key]) < k: 
+                    heapq.heappush(merged[key], entry)
+                elif entry[0] > merged[key][0][0]: 
+                    heapq.heapreplace(merged[key], entry)
+    return merged
+
+def reservoir_items(reservoir): 
+    return [entry[1] for entry in reservoir]
+
+def run_sampler(shard_fn, shards, k, seed=0, processes=None): 
+    '''
+    Runs shard_fn(shard, k, seed), which returns {key : reservoir}, 
+    on every shard in a process pool and merges the results. 
+    @output: 
+    - {key : [items]}
+    '''
+    with Pool(processes) as pool: 
+        partials = pool.starmap(shard_fn, [(shard, k, seed) for shard in shards])
+    merged = merge_reservoirs(partials, k)
+    return {key: reservoir_items(merged[key]) for key in merged}
+
+def sample_reddit_month(month, k, seed, categories={}): 
+    '''
+    Reservoirs of comments and posts for each category in a month. 
+    
+    Reads from the month store, so Health and Criticism
+    subreddits are never read in. line_number is the position
+    of the comment/post within its month in the store. 
+    '''
+    print(month)
+    rng = shard_rng(seed, month)
+    keep_cats = set(categories.values()) - set(['Health', 'Criticism'])
+    reservoirs = defaultdict(list) # {cat: reservoir}
+    line_number = 0
+    for kind, field in [('RC', 'body'), ('RS', 'selftext')]: 
+        for d in read_month_store(months=[month], categories=keep_cats, kind=kind, 
+                                  columns=['subreddit', field]): 
+            text = d.get(field, '')
+            sr = d['subreddit']
+            if valid_line(text): 
+                reservoir_add(reservoirs[categories[sr]], (line_number, month, sr, text), rng, k)
+            line_number += 1
+    return reservoirs
+
 def sample_reddit(): 
     '''
     For NER evaluation, k = 25
     '''
     categories = get_sr_cats()
     k = 25
-    samples = defaultdict(list) # {cat: [25 comments]}
-    subreddit_count = Counter() # {cat: number of times seen}
-    for f in os.listdir(COMMENTS):
-        if f == 'bad_jsons': continue 
-        month = f.replace('RC_', '')
-        print(month)
-        line_number = 0
-        with open(COMMENTS + f + '/part-00000', 'r') as infile: 
-            for line in infile: 
-                d = json.loads(line)
-                text = d['body']
-                sr = d['subreddit'].lower()
-                cat = categories[sr]
-                if cat == 'Health' or cat == 'Criticism': continue
-                subreddit_count[cat] += 1
-                if len(samples[cat]) < k and valid_line(text): 
-                    samples[cat].append((line_number, month, sr, text))
-                elif valid_line(text): 
-                    idx = int(random.random() * subreddit_count[cat])
-                    if idx < k: 
-                        samples[cat][idx] = (line_number, month, sr, text)
-                line_number += 1
-        if os.path.exists(POSTS + 'RS_' + month + '/part-00000'): 
-            post_path = POSTS + 'RS_' + month + '/part-00000'
-        else: 
-            post_path = POSTS + 'RS_v2_' + month + '/part-00000'
-        with open(post_path, 'r') as infile: 
-            for line in infile: 
-                d = json.loads(line)
-                text = d['selftext']
-                sr = d['subreddit'].lower()
-                cat = categories[sr]
-                if cat == 'Health' or cat == 'Criticism': continue
-                subreddit_count[cat] += 1
-                if len(samples[cat]) < k and valid_line(text): 
-                    samples[cat].append((line_number, month, sr, text))
-                elif valid_line(text): 
-                    idx = int(random.random() * subreddit_count[cat])
-                    if idx < k: 
-                        samples[cat][idx] = (line_number, month, sr, text)
-                line_number += 1
+    months = [f.replace('RC_', '') for f in os.listdir(COMMENTS) if f != 'bad_jsons']
+    samples = run_sampler(partial(sample_reddit_month, categories=categories), months, k)
         
     with open(REDDIT_OUT + '_' + str(k), 'w') as outfile: 
         writer = csv.writer(outfile, delimiter='\t')
         for cat in samples: 
             for tup in samples[cat]: 
                 writer.writerow([cat, str(tup[0]), tup[1], tup[2], tup[3]])
+                
+def sample_forum(f, k, seed): 
+    '''
+    Reservoir of posts in a forum
+    '''
+    print(f) 
+    rng = shard_rng(seed, f)
+    reservoirs = defaultdict(list)
+    line_number = 0
+    with open(FORUMS + f, 'r') as infile: 
+        for line in infile: 
+            d = json.loads(line)
+            text = d['text_post']
+            reservoir_add(reservoirs[f], (line_number, f, text), rng, k)
+            line_number += 1
+    return reservoirs
 
 def sample_forums(): 
     '''
     For NER evaluation, k = 25
     '''
     k = 25
-    samples = defaultdict(list)
-    forum_count = Counter()
-    for f in os.listdir(FORUMS):
-        print(f) 
-        line_number = 0
-        with open(FORUMS + f, 'r') as infile: 
-            for line in infile: 
-                d = json.loads(line)
-                text = d['text_post']
-                forum_count[f] += 1
-                if len(samples[f]) < k:
-                    samples[f].append((line_number, f, text))
-                else: 
-                    idx = int(random.random() * forum_count[f])
-                    if idx < k: 
-                        samples[f][idx] = (line_number, f, text)
-                line_number += 1
+    samples = run_sampler(sample_forum, os.listdir(FORUMS), k)
     with open(FORUM_OUT + '_' + str(k), 'w') as outfile: 
         writer = csv.writer(outfile, delimiter='\t')
         for f in samples: 
@@ -119,6 +160,7 @@ def sample_by_glossword():
     for human to go through. 
     '''
     all_words, _ = get_manual_people()
+    matcher = build_vocab_matcher(all_words)
     categories = get_sr_cats()
     k = 2
     samples = defaultdict(list) # {word: [comments]}
@@ -138,16 +180,14 @@ def sample_by_glossword():
                 cat = categories[sr]
                 if cat == 'Health' or cat == 'Criticism': continue
 
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            glossword_count[word] += 1
-                            if len(samples[word]) < k and valid_line(text): 
-                                samples[word].append((line_number, month, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * glossword_count[word])
-                                if idx < k: 
-                                    samples[word][idx] = (line_number, month, sr, text)
+                for word in vocab_in_text(matcher, text): 
+                    glossword_count[word] += 1
+                    if len(samples[word]) < k and valid_line(text): 
+                        samples[word].append((line_number, month, sr, text))
+                    elif valid_line(text): 
+                        idx = int(random.random() * glossword_count[word])
+                        if idx < k: 
+                            samples[word][idx] = (line_number, month, sr, text)
                 line_number += 1
                 
         if os.path.exists(POSTS + 'RS_' + month + '/part-00000'): 
@@ -162,16 +202,14 @@ def sample_by_glossword():
                 cat = categories[sr]
                 if cat == 'Health' or cat == 'Criticism': continue
 
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            glossword_count[word] += 1
-                            if len(samples[word]) < k and valid_line(text): 
-                                samples[word].append((line_number, month, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * glossword_count[word])
-                                if idx < k: 
-                                    samples[word][idx] = (line_number, month, sr, text)
+                for word in vocab_in_text(matcher, text): 
+                    glossword_count[word] += 1
+                    if len(samples[word]) < k and valid_line(text): 
+                        samples[word].append((line_number, month, sr, text))
+                    elif valid_line(text): 
+                        idx = int(random.random() * glossword_count[word])
+                        if idx < k: 
+                            samples[word][idx] = (line_number, month, sr, text)
                 line_number += 1
                 
     # through forums
@@ -182,17 +220,15 @@ def sample_by_glossword():
             for line in infile: 
                 d = json.loads(line)
                 text = d['text_post']
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            glossword_count[word] += 1
-                            if len(samples[word]) < k:
-                                samples[word].append((line_number, 'no-month', f, text))
-                            else: 
-                                idx = int(random.random() * glossword_count[word])
-                                if idx < k: 
-                                    samples[word][idx] = (line_number, 'no-month', f, text)
-                            line_number += 1
+                for word in vocab_in_text(matcher, text): 
+                    glossword_count[word] += 1
+                    if len(samples[word]) < k:
+                        samples[word].append((line_number, 'no-month', f, text))
+                    else: 
+                        idx = int(random.random() * glossword_count[word])
+                        if idx < k: 
+                            samples[word][idx] = (line_number, 'no-month', f, text)
+                    line_number += 1
     
     with open(GLOSSWORD_OUT, 'w') as outfile: 
         writer = csv.writer(outfile, delimiter='\t')
@@ -200,98 +236,46 @@ def sample_by_glossword():
             for tup in samples[word]: 
                 writer.writerow([word, str(tup[0]), tup[1], tup[2], tup[3]])
 
-def sample_by_vocab(all_words): 
+def sample_vocab_shard(shard, k, seed, matcher=None, categories={}): 
     '''
-    This is to get a sample of occurrences of a set
-    of words from extreme_rel and reddit_control
-    for comparison. 
+    Reservoirs of occurrences of each vocab word in one shard, 
+    where shard is (dataset, name) and dataset is 'reddit' (name is a month),
+    'forum' (name is a forum), or 'control' (name is a folder in CONTROL). 
     '''
-    k = 1000
-    categories = get_sr_cats()
-    samples = defaultdict(list) # {word: [text]}
-    word_count = Counter() # {word: number of times seen}
-    # through reddit comments and posts
-    for f in os.listdir(COMMENTS):
-        if f == 'bad_jsons': continue 
-        month = f.replace('RC_', '')
-        print(month)
-        line_number = 0
-        with open(COMMENTS + f + '/part-00000', 'r') as infile: 
-            for line in infile: 
-                d = json.loads(line)
-                text = d['body']
-                sr = d['subreddit'].lower()
-                cat = categories[sr]
-                if cat == 'Health' or cat == 'Criticism': continue
-
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            word_count[word] += 1
-                            if len(samples[word]) < k and valid_line(text): 
-                                samples[word].append((line_number, month, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * word_count[word])
-                                if idx < k: 
-                                    samples[word][idx] = (line_number, month, sr, text)
-                line_number += 1  
+    dataset, name = shard
+    print(name)
+    rng = shard_rng(seed, dataset + '_' + name)
+    reservoirs = defaultdict(list) # {word: reservoir}
+    line_number = 0
+    if dataset == 'reddit': 
+        month = name
         if os.path.exists(POSTS + 'RS_' + month + '/part-00000'): 
             post_path = POSTS + 'RS_' + month + '/part-00000'
         else: 
             post_path = POSTS + 'RS_v2_' + month + '/part-00000'
-        with open(post_path, 'r') as infile: 
-            for line in infile: 
-                d = json.loads(line)
-                text = d['selftext']
-                sr = d['subreddit'].lower()
-                cat = categories[sr]
-                if cat == 'Health' or cat == 'Criticism': continue
-
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            word_count[word] += 1
-                            if len(samples[word]) < k and valid_line(text): 
-                                samples[word].append((line_number, month, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * word_count[word])
-                                if idx < k: 
-                                    samples[word][idx] = (line_number, month, sr, text)
-                line_number += 1           
-    # through forums
-    for f in os.listdir(FORUMS):
-        print(f) 
-        line_number = 0
-        with open(FORUMS + f, 'r') as infile: 
+        for path, field in [(COMMENTS + 'RC_' + month + '/part-00000', 'body'), (post_path, 'selftext')]: 
+            with open(path, 'r') as infile: 
+                for line in infile: 
+                    d = json.loads(line)
+                    text = d[field]
+                    sr = d['subreddit'].lower()
+                    cat = categories[sr]
+                    if cat == 'Health' or cat == 'Criticism': continue
+                    if valid_line(text): 
+                        for word in vocab_in_text(matcher, text): 
+                            reservoir_add(reservoirs[word], (line_number, month, sr, text), rng, k)
+                    line_number += 1
+    elif dataset == 'forum': 
+        with open(FORUMS + name, 'r') as infile: 
             for line in infile: 
                 d = json.loads(line)
                 text = d['text_post']
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            word_count[word] += 1
-                            if len(samples[word]) < k:
-                                samples[word].append((line_number, 'no-month', f, text))
-                            else: 
-                                idx = int(random.random() * word_count[word])
-                                if idx < k: 
-                                    samples[word][idx] = (line_number, 'no-month', f, text)
-                            line_number += 1
-    with open(LOGS + 'women_extreme_sample.csv', 'w') as outfile: 
-        writer = csv.writer(outfile, delimiter='\t')
-        for word in samples: 
-            for tup in samples[word]: 
-                writer.writerow([word, str(tup[0]), tup[1], tup[2], tup[3]])
-
-    samples = defaultdict(list) # {word: [text]}
-    word_count = Counter() # {word: number of times seen}
-    # through control
-    for filename in os.listdir(CONTROL):
-        if filename == 'bad_jsons': continue 
-        month = filename.replace('RC_', '').replace('RS_v2_', '').replace('RS_', '')
-        print(month)
-        line_number = 0
-        with open(CONTROL + filename + '/part-00000', 'r') as infile: 
+                for word in vocab_in_text(matcher, text): 
+                    reservoir_add(reservoirs[word], (line_number, 'no-month', name, text), rng, k)
+                line_number += 1
+    elif dataset == 'control': 
+        month = name.replace('RC_', '').replace('RS_v2_', '').replace('RS_', '')
+        with open(CONTROL + name + '/part-00000', 'r') as infile: 
             for line in infile: 
                 d = json.loads(line)
                 if 'body' in d: 
@@ -302,18 +286,34 @@ def sample_by_vocab(all_words):
                     line_number += 1
                     continue
                 sr = d['subreddit'].lower()
-
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            word_count[word] += 1
-                            if len(samples[word]) < k and valid_line(text): 
-                                samples[word].append((line_number, month, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * word_count[word])
-                                if idx < k: 
-                                    samples[word][idx] = (line_number, month, sr, text)
+                if valid_line(text): 
+                    for word in vocab_in_text(matcher, text): 
+                        reservoir_add(reservoirs[word], (line_number, month, sr, text), rng, k)
                 line_number += 1
+    return reservoirs
+
+def sample_by_vocab(all_words): 
+    '''
+    This is to get a sample of occurrences of a set
+    of words from extreme_rel and reddit_control
+    for comparison. 
+    '''
+    k = 1000
+    shard_fn = partial(sample_vocab_shard, matcher=build_vocab_matcher(all_words), 
+                       categories=get_sr_cats())
+    # through reddit comments and posts, and forums
+    shards = [('reddit', f.replace('RC_', '')) for f in os.listdir(COMMENTS) if f != 'bad_jsons']
+    shards += [('forum', f) for f in os.listdir(FORUMS)]
+    samples = run_sampler(shard_fn, shards, k)
+    with open(LOGS + 'women_extreme_sample.csv', 'w') as outfile: 
+        writer = csv.writer(outfile, delimiter='\t')
+        for word in samples: 
+            for tup in samples[word]: 
+                writer.writerow([word, str(tup[0]), tup[1], tup[2], tup[3]])
+
+    # through control
+    shards = [('control', f) for f in os.listdir(CONTROL) if f != 'bad_jsons']
+    samples = run_sampler(shard_fn, shards, k)
     with open(LOGS + 'women_control_sample.csv', 'w') as outfile: 
         writer = csv.writer(outfile, delimiter='\t')
         for word in samples: 
@@ -343,6 +343,7 @@ def sample_women_contexts_per_month(k=1000):
                 else: 
                     p_cache[term] = 'singular'
             all_words.add(term)
+    matcher = build_vocab_matcher(all_words)
             
     categories = get_sr_cats()
     samples = defaultdict(list) # {month_plural/singular: [text]}
@@ -361,16 +362,14 @@ def sample_women_contexts_per_month(k=1000):
                 cat = categories[sr]
                 if cat == 'Health' or cat == 'Criticism': continue
 
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            word_count[month] += 1
-                            if len(samples[month]) < k and valid_line(text): 
-                                samples[month].append((line_number, word, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * word_count[month])
-                                if idx < k: 
-                                    samples[month][idx] = (line_number, word, sr, text)
+                for word in vocab_in_text(matcher, text): 
+                    word_count[month] += 1
+                    if len(samples[month]) < k and valid_line(text): 
+                        samples[month].append((line_number, word, sr, text))
+                    elif valid_line(text): 
+                        idx = int(random.random() * word_count[month])
+                        if idx < k: 
+                            samples[month][idx] = (line_number, word, sr, text)
                 line_number += 1  
         if os.path.exists(POSTS + 'RS_' + month + '/part-00000'): 
             post_path = POSTS + 'RS_' + month + '/part-00000'
@@ -384,16 +383,14 @@ def sample_women_contexts_per_month(k=1000):
                 cat = categories[sr]
                 if cat == 'Health' or cat == 'Criticism': continue
 
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            word_count[month] += 1
-                            if len(samples[month]) < k and valid_line(text): 
-                                samples[month].append((line_number, word, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * word_count[month])
-                                if idx < k: 
-                                    samples[month][idx] = (line_number, word, sr, text)
+                for word in vocab_in_text(matcher, text): 
+                    word_count[month] += 1
+                    if len(samples[month]) < k and valid_line(text): 
+                        samples[month].append((line_number, word, sr, text))
+                    elif valid_line(text): 
+                        idx = int(random.random() * word_count[month])
+                        if idx < k: 
+                            samples[month][idx] = (line_number, word, sr, text)
                 line_number += 1           
     # through forums
     for f in os.listdir(FORUMS):
@@ -411,18 +408,16 @@ def sample_women_contexts_per_month(k=1000):
                     year = date_time_str[0]
                     month = date_time_str[1]
                 month = year + '-' + month
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            item_key = month + '_' + p_cache[word]
-                            word_count[item_key] += 1
-                            if len(samples[item_key]) < k:
-                                samples[item_key].append((line_number, word, f, text))
-                            else: 
-                                idx = int(random.random() * word_count[item_key])
-                                if idx < k: 
-                                    samples[item_key][idx] = (line_number, word, f, text)
-                            line_number += 1
+                for word in vocab_in_text(matcher, text): 
+                    item_key = month + '_' + p_cache[word]
+                    word_count[item_key] += 1
+                    if len(samples[item_key]) < k:
+                        samples[item_key].append((line_number, word, f, text))
+                    else: 
+                        idx = int(random.random() * word_count[item_key])
+                        if idx < k: 
+                            samples[item_key][idx] = (line_number, word, f, text)
+                    line_number += 1
     with open(LOGS + 'women_extreme_sample_time.csv', 'w') as outfile: 
         writer = csv.writer(outfile, delimiter='\t')
         for item_key in samples: 
@@ -442,6 +437,7 @@ def sample_women_contexts_per_month(k=1000):
                 else: 
                     p_cache[term] = 'singular'
             all_words.add(term)
+    matcher = build_vocab_matcher(all_words)
 
     samples = defaultdict(list) # {month_plural/singular: [text]}
     word_count = Counter() # {month_plural/singular: number of times feminine words seen}
@@ -463,17 +459,15 @@ def sample_women_contexts_per_month(k=1000):
                     continue
                 sr = d['subreddit'].lower()
 
-                for word in all_words: 
-                    if word in text: # fast check
-                        if re.search(r'\b' + re.escape(word) + r'\b', text) is not None: 
-                            item_key = month + '_' + p_cache[word]
-                            word_count[item_key] += 1
-                            if len(samples[item_key]) < k and valid_line(text): 
-                                samples[item_key].append((line_number, word, sr, text))
-                            elif valid_line(text): 
-                                idx = int(random.random() * word_count[item_key])
-                                if idx < k: 
-                                    samples[item_key][idx] = (line_number, word, sr, text)
+                for word in vocab_in_text(matcher, text): 
+                    item_key = month + '_' + p_cache[word]
+                    word_count[item_key] += 1
+                    if len(samples[item_key]) < k and valid_line(text): 
+                        samples[item_key].append((line_number, word, sr, text))
+                    elif valid_line(text): 
+                        idx = int(random.random() * word_count[item_key])
+                        if idx < k: 
+                            samples[item_key][idx] = (line_number, word, sr, text)
                 line_number += 1
     with open(LOGS + 'women_control_sample_time.csv', 'w') as outfile: 
         writer = csv.writer(outfile, delimiter='\t')
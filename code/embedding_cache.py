@@ -0,0 +1,155 @@
+'''
+Persistent cache of pooled BERT embeddings, so that rerunning
+an experiment, or switching how contexts are selected, only
+embeds the contexts we have not seen before.
+
+Each vector is addressed by a hash of the model, its layers,
+the words of the example and the target span. Vectors are kept
+in one sqlite file, and the least recently used ones are evicted
+once the cache holds more than max_bytes of vectors.
+
+Usage: call enable_cache(path) once in a script, after which
+embedding_engine.embed_spans() reads from and writes to the cache.
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+
+MAX_CACHE_BYTES = 50 * 2**30 # 50 GB, about 4 million 3072-dim vectors
+SQL_BATCH = 500 # keys per query, under sqlite's variable limit
+
+_cache = {'path': None, 'max_bytes': MAX_CACHE_BYTES, 'conn': None, 'pid': None}
+
+def enable_cache(path, max_bytes=MAX_CACHE_BYTES):
+    '''
+    @inputs:
+    - path: sqlite file, created if it doesn't exist
+    - max_bytes: total size of vectors to keep before evicting
+    '''
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    _cache['path'] = path
+    _cache['max_bytes'] = max_bytes
+    _cache['conn'] = None
+
+def disable_cache():
+    if _cache['conn'] is not None:
+        _cache['conn'].close()
+    _cache['path'] = None
+    _cache['conn'] = None
+
+def get_cache():
+    '''
+    @output:
+    - sqlite connection, or None if the cache is not enabled.
+    Connections are opened lazily, one per process.
+    '''
+    if _cache['path'] is None:
+        return None
+    if _cache['conn'] is None or _cache['pid'] != os.getpid():
+        conn = sqlite3.connect(_cache['path'], timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        create_tables(conn)
+        _cache['conn'] = conn
+        _cache['pid'] = os.getpid()
+    return _cache['conn']
+
+def create_tables(conn):
+    '''
+    vec is the last column, so that reading the other columns doesn't
+    touch the overflow pages of each ~12 KB vector. The total size of
+    the vectors is kept in meta by triggers instead of summed when needed.
+    '''
+    conn.execute('''CREATE TABLE IF NOT EXISTS vectors
+                    (key BLOB PRIMARY KEY, nbytes INTEGER, last_used REAL, vec BLOB)''')
+    # covers the eviction scan, which reads nbytes in last_used order
+    conn.execute('CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used, nbytes)')
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER)')
+    conn.execute('INSERT OR IGNORE INTO meta VALUES (0, 0)')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS vectors_insert AFTER INSERT ON vectors
+                    BEGIN UPDATE meta SET total_bytes = total_bytes + new.nbytes WHERE id = 0; END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS vectors_delete AFTER DELETE ON vectors
+                    BEGIN UPDATE meta SET total_bytes = total_bytes - old.nbytes WHERE id = 0; END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS vectors_update AFTER UPDATE OF nbytes ON vectors
+                    BEGIN UPDATE meta SET total_bytes = total_bytes - old.nbytes + new.nbytes WHERE id = 0; END''')
+    conn.commit()
+
+def span_key(words, span, model_name, layers):
+    '''
+    @inputs:
+    - words: an example, a list of words
+    - span: list of word indices of the target
+    @output:
+    - 16-byte md5 digest identifying the pooled vector
+    '''
+    contents = json.dumps([model_name, list(layers), list(words), sorted(int(i) for i in span)])
+    return hashlib.md5(contents.encode('utf-8')).digest()
+
+def lookup(keys):
+    '''
+    @output:
+    - {key : float32 vector} for the keys that are cached
+    '''
+    conn = get_cache()
+    found = {}
+    keys = list(set(keys))
+    for start in range(0, len(keys), SQL_BATCH):
+        chunk = keys[start:start + SQL_BATCH]
+        rows = conn.execute('SELECT key, vec FROM vectors WHERE key IN (' +
+                            ','.join('?' * len(chunk)) + ')', chunk).fetchall()
+        for key, vec in rows:
+            found[key] = np.frombuffer(vec, dtype=np.float32)
+    if found:
+        now = time.time()
+        conn.executemany('UPDATE vectors SET last_used = ? WHERE key = ?',
+                         [(now, key) for key in found])
+        conn.commit()
+    return found
+
+def store(items):
+    '''
+    Adds {key : vector} to the cache and evicts the least
+    recently used vectors if it is over its size bound
+    '''
+    conn = get_cache()
+    now = time.time()
+    rows = []
+    for key, vec in items.items():
+        vec = np.ascontiguousarray(vec, dtype=np.float32)
+        rows.append((key, vec.nbytes, now, vec.tobytes()))
+    # an upsert rather than INSERT OR REPLACE, whose implicit delete doesn't fire triggers
+    conn.executemany('''INSERT INTO vectors VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE
+                        SET nbytes = excluded.nbytes, last_used = excluded.last_used, vec = excluded.vec''', rows)
+    evict(conn, _cache['max_bytes'])
+    conn.commit()
+
+def total_bytes(conn):
+    return conn.execute('SELECT total_bytes FROM meta WHERE id = 0').fetchone()[0]
+
+def evict(conn, max_bytes):
+    '''
+    Deletes the least recently used vectors, row by row in last_used
+    order, until the cache is back under max_bytes
+    '''
+    excess = total_bytes(conn) - max_bytes
+    if excess <= 0:
+        return
+    rowids = []
+    freed = 0
+    for rowid, nbytes in conn.execute('SELECT rowid, nbytes FROM vectors ORDER BY last_used'):
+        rowids.append((rowid,))
+        freed += nbytes
+        if freed >= excess: break
+    conn.executemany('DELETE FROM vectors WHERE rowid = ?', rowids)
+
+def cache_size():
+    '''
+    @output:
+    - number of cached vectors, their total bytes
+    '''
+    conn = get_cache()
+    return conn.execute('SELECT COUNT(*) FROM vectors').fetchone()[0], total_bytes(conn)
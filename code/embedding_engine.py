@@ -0,0 +1,157 @@
+'''
+BERT embeddings of target words in context, shared by
+the embedding scripts.
+
+The model is loaded once per process. A target is a span of word
+indices in a pre-tokenized example, and its embedding is the mean
+of its wordpieces' last four hidden layers, concatenated (3072 dims).
+'''
+from functools import lru_cache
+import numpy as np
+import torch
+from transformers import BertTokenizerFast, BertModel
+import embedding_cache
+
+MODEL_NAME = 'bert-base-uncased'
+LAYERS = [-4, -3, -2, -1] # last four layers
+EMBED_DIM = 3072
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+@lru_cache(maxsize=None)
+def load_bert():
+    tokenizer = BertTokenizerFast.from_pretrained(MODEL_NAME)
+    model = BertModel.from_pretrained(MODEL_NAME)
+    model.to(device)
+    model.eval()
+    return tokenizer, model
+
+def encode_batch(batch):
+    '''
+    @inputs:
+    - batch: list of examples, each a list of words
+    @output:
+    - tokenizer output, whose word_ids() give the words that survived truncation
+    '''
+    tokenizer, _ = load_bert()
+    return tokenizer(batch, is_split_into_words=True, padding=True, truncation=True,
+                     return_tensors="pt")
+
+def span_mask(encoded_inputs, batch_spans):
+    '''
+    @inputs:
+    - batch_spans: for each example, a list of target spans, each a list of word indices
+    @output:
+    - num targets x (batch_size * seq_len) mask of each target's wordpieces
+    in the flattened batch
+    '''
+    batch_size, seq_len = encoded_inputs['input_ids'].shape
+    word_ids = torch.tensor([[-1 if w is None else w for w in encoded_inputs.word_ids(j)]
+                             for j in range(batch_size)])
+    rows = []
+    for j, spans in enumerate(batch_spans):
+        for span in spans:
+            row = torch.zeros(batch_size, seq_len)
+            row[j] = torch.isin(word_ids[j], torch.tensor(list(span), dtype=torch.long)).float()
+            rows.append(row.flatten())
+    if len(rows) == 0:
+        return torch.zeros(0, batch_size * seq_len)
+    return torch.stack(rows)
+
+def pool_spans(encoded_inputs, batch_spans):
+    '''
+    Runs the model and mean-pools each target's wordpieces with one matmul.
+    @output:
+    - num targets x 3072 float tensor on device, in the order of batch_spans,
+    with a row of nan for targets that were truncated away
+    '''
+    _, model = load_bert()
+    mask = span_mask(encoded_inputs, batch_spans).to(device)
+    encoded_inputs = encoded_inputs.to(device)
+    with torch.inference_mode():
+        outputs = model(**encoded_inputs, output_hidden_states=True)
+        states = outputs.hidden_states # tuple
+        # batch_size x seq_len x 3072
+        vector = torch.cat([states[i] for i in LAYERS], 2) # concatenate last four
+        summed = mask @ vector.reshape(-1, vector.shape[-1])
+        return summed / mask.sum(dim=1, keepdim=True) # average word pieces
+
+def embed_spans(batch, batch_spans):
+    '''
+    encode_batch() and pool_spans() for a batch of examples.
+    If the embedding cache is enabled (see embedding_cache.py),
+    only examples with a target that isn't cached are run through the model.
+    '''
+    if embedding_cache.get_cache() is None:
+        return pool_spans(encode_batch(batch), batch_spans)
+    keys = [[embedding_cache.span_key(words, span, MODEL_NAME, LAYERS) for span in spans]
+            for words, spans in zip(batch, batch_spans)]
+    found = embedding_cache.lookup([k for example_keys in keys for k in example_keys])
+    missing = [j for j in range(len(batch)) if any(k not in found for k in keys[j])]
+    if len(missing) != 0:
+        new_embeds = pool_spans(encode_batch([batch[j] for j in missing]),
+                                [batch_spans[j] for j in missing]).cpu().numpy()
+        new_keys = [k for j in missing for k in keys[j]]
+        new_items = dict(zip(new_keys, new_embeds))
+        embedding_cache.store(new_items)
+        found.update(new_items)
+    word_embeds = np.array([found[k] for example_keys in keys for k in example_keys],
+                           dtype=np.float32).reshape(-1, EMBED_DIM)
+    return torch.from_numpy(word_embeds).to(device)
+
+def word_spans(words, targets):
+    '''
+    @inputs:
+    - words: an example, a list of words
+    - targets: target words to find
+    @output:
+    - {target : [indices of all of its occurrences]} for targets that occur
+    '''
+    spans = {}
+    for i, w in enumerate(words):
+        if w in targets:
+            spans.setdefault(w, []).append(i)
+    return spans
+
+# --------------
+# Streaming mean and std
+# --------------
+
+def new_stats(dim=EMBED_DIM):
+    '''
+    Running (count, mean, sum of squared deviations) of vectors
+    '''
+    return (0, np.zeros(dim), np.zeros(dim))
+
+def merge_stats(a, b):
+    '''
+    Combines two running stats (Chan et al.), e.g. from different shards
+    '''
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    if count == 0:
+        return a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / count)
+    m2 = m2_a + m2_b + np.square(delta) * (count_a * count_b / count)
+    return (count, mean, m2)
+
+def update_stats(stats, vecs):
+    '''
+    Adds a batch of vectors, num vectors x dim, to running stats
+    '''
+    vecs = np.asarray(vecs, dtype=np.float64)
+    if vecs.shape[0] == 0:
+        return stats
+    batch_mean = vecs.mean(axis=0)
+    batch_m2 = np.square(vecs - batch_mean).sum(axis=0)
+    return merge_stats(stats, (vecs.shape[0], batch_mean, batch_m2))
+
+def finalize_stats(stats):
+    '''
+    @output:
+    - count, mean, population std
+    '''
+    count, mean, m2 = stats
+    return count, mean, np.sqrt(m2 / count)
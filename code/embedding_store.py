@@ -0,0 +1,113 @@
+'''
+On-disk format for term embeddings, used instead of
+json dicts of float lists.
+
+A store with prefix p is three files:
+- p.npy: float32 matrix, one row per key
+- p_keys.txt: keys in row order, one per line
+- p_counts.npy: int64 number of occurrences behind each row
+'''
+import json
+import numpy as np
+from scipy import sparse
+
+def store_paths(prefix):
+    return prefix + '.npy', prefix + '_keys.txt', prefix + '_counts.npy'
+
+def save_embedding_store(prefix, keys, matrix, counts=None):
+    '''
+    @inputs:
+    - keys: list of str, e.g. term_category_year
+    - matrix: len(keys) x dim array
+    - counts: per-row occurrence counts, all ones if None
+    '''
+    matrix_path, keys_path, counts_path = store_paths(prefix)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    assert matrix.shape[0] == len(keys)
+    if counts is None:
+        counts = np.ones(len(keys), dtype=np.int64)
+    np.save(matrix_path, matrix)
+    np.save(counts_path, np.asarray(counts, dtype=np.int64))
+    with open(keys_path, 'w') as outfile:
+        for key in keys:
+            outfile.write(key + '\n')
+
+def load_embedding_store(prefix, mmap=True):
+    '''
+    @output:
+    - matrix: float32 array, memory-mapped read-only if mmap
+    - keys: list of str in row order
+    - counts: int64 array
+    '''
+    matrix_path, keys_path, counts_path = store_paths(prefix)
+    matrix = np.load(matrix_path, mmap_mode='r' if mmap else None)
+    counts = np.load(counts_path)
+    with open(keys_path, 'r') as infile:
+        keys = [line.rstrip('\n') for line in infile]
+    return matrix, keys, counts
+
+def save_vec_dict(prefix, vecs, counts):
+    '''
+    Saves {key : summed vector} and {key : count} as the
+    mean vector of each key, in sorted key order
+    '''
+    keys = sorted(counts.keys())
+    matrix = np.array([vecs[k] / counts[k] for k in keys], dtype=np.float32)
+    save_embedding_store(prefix, keys, matrix, [counts[k] for k in keys])
+
+def convert_json_embeddings(json_path, counts_path=None, prefix=None):
+    '''
+    Converts an older {key : vector} json, and optionally its
+    {key : count} json, to a store next to it
+    '''
+    if prefix is None:
+        prefix = json_path.replace('.json', '')
+    with open(json_path, 'r') as infile:
+        d = json.load(infile)
+    counts = None
+    keys = sorted(d.keys())
+    if counts_path is not None:
+        with open(counts_path, 'r') as infile:
+            word_counts = json.load(infile)
+        counts = [word_counts[k] for k in keys]
+    save_embedding_store(prefix, keys, np.array([d[k] for k in keys], dtype=np.float32), counts)
+
+def stack_stores(prefixes):
+    '''
+    Concatenates several stores
+    @output:
+    - matrix, keys, counts: as in load_embedding_store
+    - sources: the prefix that each row came from
+    '''
+    matrices = []
+    all_keys = []
+    all_counts = []
+    sources = []
+    for prefix in prefixes:
+        matrix, keys, counts = load_embedding_store(prefix)
+        matrices.append(matrix)
+        all_keys.extend(keys)
+        all_counts.append(counts)
+        sources.extend([prefix] * len(keys))
+    return np.concatenate(matrices), all_keys, np.concatenate(all_counts), sources
+
+def group_means(matrix, counts, group_keys):
+    '''
+    Count-weighted mean of the rows in each group, computed
+    as one sparse indicator matmul.
+    @inputs:
+    - group_keys: group of each row, rows with None are dropped
+    @output:
+    - groups: sorted list of group keys
+    - means: len(groups) x dim float32 array
+    - group_counts: total count of each group
+    '''
+    keep = np.array([g is not None for g in group_keys], dtype=bool)
+    groups, group_ids = np.unique(np.array([g for g in group_keys if g is not None], dtype=object),
+                                  return_inverse=True)
+    weights = np.asarray(counts, dtype=np.float64)[keep]
+    indicator = sparse.csr_matrix((weights, (group_ids, np.nonzero(keep)[0])),
+                                  shape=(len(groups), matrix.shape[0]))
+    group_counts = np.asarray(indicator.sum(axis=1)).flatten()
+    means = (indicator @ matrix) / group_counts[:, None]
+    return list(groups), means.astype(np.float32), group_counts.astype(np.int64)
@@ -6,21 +6,32 @@ Possible file extensions include
 - .bz2
 - .zst
 - .xz
+
+Dumps are decompressed as a stream in-process, and records are
+parsed and filtered in that same task, so no decompressed copy
+of a month is ever written to disk or shuffled. 
 """
-from pyspark import SparkConf, SparkContext
-import subprocess
+from pyspark import SparkConf, SparkContext, StorageLevel
+from pyspark.sql import Row, SQLContext
+from pyspark.sql.types import StructType, StructField, StringType, LongType
+import zstandard
+import lzma
+import bz2
+import io
 import time
 import json
 import os
 import csv 
 from collections import Counter
-from helpers import get_sr_cats
+from helpers import get_sr_cats, parse_record, check_valid_comment, check_valid_post, RECORD_FIELDS, MONTH_STORE
+from helpers import build_vocab_matcher, find_vocab
 from nltk import ngrams
 from functools import partial
 import string
 
 conf = SparkConf()
 sc = SparkContext(conf=conf)
+sqlContext = SQLContext(sc)
 
 IN_S = '/mnt/data0/corpora/reddit/submissions/'
 IN_C = '/mnt/data0/corpora/reddit/comments/'
@@ -31,28 +42,38 @@ LOGS = ROOT + 'logs/'
 SUBS = ROOT + 'data/submissions/'
 COMS = ROOT + 'data/comments/'
 CONTROL = ROOT + 'data/reddit_control/'
+PUNCT_TABLE = str.maketrans(string.punctuation, ' ' * len(string.punctuation))
+DUMP_EXTENSIONS = ('.zst', '.xz', '.bz2')
 
-def unpack_file(d, f):
-    start = time.time()
-    print("Unpacking", d, f)
-    if f.endswith('.xz'): 
-        p = subprocess.Popen(['xz', '--keep', '--decompress', f], cwd=d)
-        p.wait()
-    elif f.endswith('.zst'): 
-        p = subprocess.Popen(['unzstd', f], cwd=d)
-        p.wait()
-    elif f.endswith('.bz2'): 
-        p = subprocess.Popen(['bzip2', '-dk', f], cwd=d) 
-        p.wait()
+def read_dump(path): 
+    '''
+    Yields lines of a compressed dump, decompressing as we go. 
+    Newer .zst dumps are compressed with a long window, so
+    the decompressor needs a window of up to 2^31 bytes. 
+    '''
+    if path.endswith('.zst'): 
+        dctx = zstandard.ZstdDecompressor(max_window_size=2**31)
+        stream = io.TextIOWrapper(dctx.stream_reader(open(path, 'rb')), 
+                                  encoding='utf-8', errors='replace')
+    elif path.endswith('.xz'): 
+        stream = lzma.open(path, 'rt', encoding='utf-8', errors='replace')
+    elif path.endswith('.bz2'): 
+        stream = bz2.open(path, 'rt', encoding='utf-8', errors='replace')
     else: 
-        print("NOT IMPLEMENTED")
-    print("TIME:", time.time()-start)
-    
-def pack_file(d, f): 
-    filename = f.split('.')[0]
-    print("Deleting", d, filename)
-    p = subprocess.Popen(['rm', filename], cwd=d)
-    p.wait()
+        raise ValueError("Unknown dump extension: " + path)
+    with stream: 
+        for line in stream: 
+            yield line.rstrip('\n')
+            
+def dump_rdd(d, f): 
+    '''
+    RDD of lines of a compressed dump. Compressed dumps are not splittable,
+    so the stream is read by a single task and later filters are pipelined on it. 
+    '''
+    if not f.endswith(DUMP_EXTENSIONS): 
+        raise ValueError("Unknown dump extension: " + d + f)
+    print("Streaming", d, f)
+    return sc.parallelize([d + f], 1).flatMap(read_dump)
 
 def check_duplicate_months(d, months): 
     """
@@ -62,21 +83,15 @@ def check_duplicate_months(d, months):
     for dups in months: 
         dup1 = dups[0]
         dup2 = dups[1]
-        unpack_file(d, dup1)
-        filename = dup1.split('.')[0]
         # map to IDs, collect as set
-        data = sc.textFile(d + filename)
+        data = dump_rdd(d, dup1)
         data = data.map(lambda line: json.loads(line)['id'])
         ids1 = set(data.collect())
-        pack_file(d, dup1)
         
-        unpack_file(d, dup2)
-        filename = dup2.split('.')[0]
         # map to IDs, collect as set
-        data = sc.textFile(d + filename)
+        data = dump_rdd(d, dup2)
         data = data.map(lambda line: json.loads(line)['id'])
         ids2 = set(data.collect())
-        pack_file(d, dup2)
         
         # check that the IDs are the same for both files
         if ids1 != ids2: 
@@ -84,12 +99,58 @@ def check_duplicate_months(d, months):
         else: 
             print("IT IS FINE!!!!!!!!!!")
 
-def get_dumb_lines(line): 
-    try: 
-        json.loads(line)
-    except json.decoder.JSONDecodeError:
-        return True
-    return False
+def parse_lines(data): 
+    '''
+    Pairs each raw line with its parsed record, so the bad json
+    check and all subreddit/content filters share a single json decode. 
+    Bad jsons have a record of None. 
+    '''
+    return data.map(lambda line: (line, parse_record(line)))
+
+def tag_line(tup, keep=None): 
+    '''
+    @inputs: 
+    - tup: (line, record) from parse_lines()
+    - keep: function of a record that is True for lines to keep
+    @output: 
+    - ('bad', line) for bad jsons, ('keep', line) for kept lines, otherwise None
+    '''
+    line, d = tup
+    if d is None: return ('bad', line)
+    if keep(d): return ('keep', line)
+    return None
+
+def filter_dump(in_d, f, out_d, keep): 
+    '''
+    Writes the lines of a dump whose record passes keep to out_d + filename,
+    and its bad jsons to out_d + 'bad_jsons/'. 
+    
+    The dump is decompressed, parsed and tagged in one streaming task,
+    and only the tagged lines, a small fraction of the month, are persisted
+    for the two outputs. Kept lines are written in dump order. 
+    '''
+    filename = f.split('.')[0]
+    data = parse_lines(dump_rdd(in_d, f))
+    tagged = data.map(partial(tag_line, keep=keep)).filter(lambda tup: tup is not None)
+    tagged = tagged.persist(StorageLevel.MEMORY_AND_DISK)
+    rel_data = tagged.filter(lambda tup: tup[0] == 'keep').map(lambda tup: tup[1])
+    rel_data.coalesce(1).saveAsTextFile(out_d + filename)
+    not_wanted = tagged.filter(lambda tup: tup[0] == 'bad').map(lambda tup: tup[1]).collect()
+    tagged.unpersist()
+    if len(not_wanted) > 0: 
+        # write bad lines to bad_jsons
+        with open(out_d + 'bad_jsons/' + filename + '.txt', 'w') as outfile: 
+            for line in not_wanted:
+                outfile.write(line + '\n') 
+
+def in_subreddits(d, subs): 
+    return d is not None and 'subreddit' in d and d['subreddit'].lower() in subs
+
+def in_subreddits_with_vocab(d, subs, matcher=None): 
+    return in_subreddits(d, subs) and content_has_vocab(d, matcher=matcher)
+
+def not_in_subreddits(d, subs): 
+    return d is not None and 'subreddit' in d and d['subreddit'].lower() not in subs
 
 def extract_relevant_subreddits(in_d, out_d): 
     """
@@ -110,19 +171,7 @@ def extract_relevant_subreddits(in_d, out_d):
     for f in os.listdir(in_d):
         filename = f.split('.')[0]
         if os.path.isdir(out_d + filename): continue # skip ones we already have
-        unpack_file(in_d, f)
-        data = sc.textFile(in_d + filename)
-        not_wanted = data.filter(get_dumb_lines).collect()
-        data = data.filter(lambda line: not get_dumb_lines(line))
-        rel_data = data.filter(lambda line: 'subreddit' in json.loads(line) and \
-                    json.loads(line)['subreddit'].lower() in relevant_subs)
-        rel_data.coalesce(1).saveAsTextFile(out_d + filename)
-        if len(not_wanted) > 0: 
-            # write bad lines to bad_jsons
-            with open(out_d + 'bad_jsons/' + filename + '.txt', 'w') as outfile: 
-                for line in not_wanted:
-                    outfile.write(line + '\n') 
-        pack_file(in_d, f)
+        filter_dump(in_d, f, out_d, partial(in_subreddits, subs=relevant_subs))
         
 def get_month_totals(): 
     '''
@@ -193,19 +242,15 @@ def sample_reddit_control():
         
         # if inputs exist, filter only subreddits not in our dataset 
         if sub_input != '' and com_input != '': 
-            unpack_file(IN_S, sub_input)
-            unpack_file(IN_C, com_input) 
-            filename = sub_input.split('.')[0]
-            data = sc.textFile(IN_S + filename) 
-            data = data.filter(lambda line: not get_dumb_lines(line))
-            sub_data = data.filter(lambda line: 'subreddit' in json.loads(line) and \
-                        json.loads(line)['subreddit'].lower() not in relevant_subs)
+            data = dump_rdd(IN_S, sub_input)
+            data = parse_lines(data)
+            sub_data = data.filter(lambda tup: not_in_subreddits(tup[1], relevant_subs))
+            sub_data = sub_data.map(lambda tup: tup[0])
         
-            filename = com_input.split('.')[0]
-            data = sc.textFile(IN_C + filename) 
-            data = data.filter(lambda line: not get_dumb_lines(line))
-            com_data = data.filter(lambda line: 'subreddit' in json.loads(line) and \
-                        json.loads(line)['subreddit'].lower() not in relevant_subs)
+            data = dump_rdd(IN_C, com_input)
+            data = parse_lines(data)
+            com_data = data.filter(lambda tup: not_in_subreddits(tup[1], relevant_subs))
+            com_data = com_data.map(lambda tup: tup[0])
 
             # sample from posts and comments
             sample_size = month_totals[month]
@@ -213,10 +258,6 @@ def sample_reddit_control():
             all_data = com_data.union(sub_data)
             sampled_data = sc.parallelize(all_data.takeSample(False, sample_size, seed))
             sampled_data.coalesce(1).saveAsTextFile(DATA + 'reddit_control/' + month)
-    
-            # pack posts and comments
-            pack_file(IN_S, sub_input) 
-            pack_file(IN_C, com_input) 
         print("TIME:", time.time() - start)
         
 def extract_subreddits_main(): 
@@ -245,14 +286,13 @@ def get_n_gramlist(nngramlist, toks, author, n=2):
         nngramlist.append((author, ' '.join(s)))                
     return nngramlist
     
-def get_ngrams(line): 
+def get_ngrams(d): 
     '''
-    Gets 10-grams for each post/comment.
+    Gets 10-grams for each post/comment record.
     This is using white-space splitting because it is faster and
     tokenization should not affect things if there are large amounts 
     of copied text between posts/comments
     '''
-    d = json.loads(line)
     if 'author' not in d: return []
     author = d['author'].lower()
     if 'body' in d: 
@@ -265,21 +305,6 @@ def get_ngrams(line):
     all_grams = list(set(all_grams))
     return all_grams
 
-def check_valid_comment(line): 
-    '''
-    For Reddit comments
-    '''
-    comment = json.loads(line)
-    return 'body' in comment and comment['body'].strip() != '[deleted]' \
-            and comment['body'].strip() != '[removed]'
-
-def check_valid_post(line): 
-    '''
-    For Reddit posts
-    '''
-    d = json.loads(line)
-    return 'selftext' in d
-    
 def detect_bots(): 
     '''
     This function finds users who tend to write
@@ -291,7 +316,7 @@ def detect_bots():
     for filename in os.listdir(COMS): 
         if filename == 'bad_jsons': continue
         m = filename.replace('RC_', '')
-        cdata = sc.textFile(COMS + filename + '/part-00000')
+        cdata = sc.textFile(COMS + filename + '/part-00000').map(parse_record)
         cdata = cdata.filter(check_valid_comment)
         cdata = cdata.flatMap(get_ngrams).map(lambda n: (n, 1)).reduceByKey(lambda n1, n2: n1 + n2)
         
@@ -299,11 +324,11 @@ def detect_bots():
             post_path = SUBS + 'RS_' + m + '/part-00000'
         else: 
             post_path = SUBS + 'RS_v2_' + m + '/part-00000'
-        pdata = sc.textFile(post_path)
+        pdata = sc.textFile(post_path).map(parse_record)
         pdata = pdata.flatMap(get_ngrams).map(lambda n: (n, 1)).reduceByKey(lambda n1, n2: n1 + n2)
         data = cdata.union(pdata).reduceByKey(lambda n1, n2: n1 + n2)
 
-        file_data = sc.textFile(CONTROL + m + '/part-00000')
+        file_data = sc.textFile(CONTROL + m + '/part-00000').map(parse_record)
         cdata = file_data.filter(check_valid_comment)
         pdata = file_data.filter(check_valid_post)
         cdata = cdata.flatMap(get_ngrams).map(lambda n: (n, 1)).reduceByKey(lambda n1, n2: n1 + n2)
@@ -339,16 +364,11 @@ def count_posts_per_subreddit():
         filename = f.split('.')[0]
         if os.path.isdir(DATA + 'all_reddit_post_counts/' + filename): continue # skip ones we already have
 
-        unpack_file(IN_S, f)
-        data = sc.textFile(IN_S + filename) 
-        data = data.filter(lambda line: not get_dumb_lines(line))
-        sub_data = data.filter(lambda line: 'subreddit' in json.loads(line) and \
-                    json.loads(line)['subreddit'].lower() not in relevant_subs)
-        sub_data = sub_data.map(lambda line: (json.loads(line)['subreddit'].lower(), 1))
+        data = dump_rdd(IN_S, f).map(parse_record)
+        sub_data = data.filter(lambda d: not_in_subreddits(d, relevant_subs))
+        sub_data = sub_data.map(lambda d: (d['subreddit'].lower(), 1))
         sub_data = sub_data.reduceByKey(lambda n1, n2: n1 + n2).map(lambda tup: tup[0] + ' ' + str(tup[1]))
         sub_data.coalesce(1).saveAsTextFile(DATA + 'all_reddit_post_counts/' + filename)
-
-        pack_file(IN_S, f) 
         print("TIME:", time.time() - start)
         
 def get_top_subreddits(): 
@@ -370,31 +390,25 @@ def get_top_subreddits():
         for tup in data.most_common(): 
             outfile.write(tup[0] + ' ' + str(tup[1]) + '\n')
             
-def content_has_vocab(line, vocab=set()): 
+def content_has_vocab(d, matcher=None): 
     '''
     @inputs: 
-    - vocab: vocab words to find
+    - d: record from parse_record()
+    - matcher: vocab words to find, from build_vocab_matcher()
     
     This function uses a fast/basic tokenizer, since
     we are looking for words over the entirety of Reddit
     '''
-    d = json.loads(line)
     if 'selftext' in d: 
         text = d['selftext'].lower()
     elif 'body' in d: 
         text = d['body'].lower()
     else: 
         text = ''
-    text = text.translate(str.maketrans(string.punctuation, ' ' * len(string.punctuation)))
-    toks = text.split()
-    unigrams = set(toks)
-    bigrams = set()
-    for s in ngrams(toks,n=2):        
-        bigrams.add(' '.join(s))  
-    overlap = (unigrams & vocab) | (bigrams & vocab)
-    if len(overlap) > 0: 
-        return True
-    return False
+    text = text.translate(PUNCT_TABLE)
+    # single spaces between tokens so bigrams match 
+    text = ' '.join(text.split())
+    return len(find_vocab(matcher, text)) > 0
             
 def extract_mainstream_subreddits(in_d, out_d, vocab, relevant_subs): 
     """
@@ -404,26 +418,14 @@ def extract_mainstream_subreddits(in_d, out_d, vocab, relevant_subs):
     - in_d: folder with inputs
     - out_d: folder with outputs
     """
+    matcher = build_vocab_matcher(vocab)
     all_files = sorted(os.listdir(in_d))
     for f in all_files:
         year = f.split('-')[0].split('_')[-1]
         if year in ['2005', '2006', '2020', '2021']: continue
         filename = f.split('.')[0]
         if os.path.isdir(out_d + filename): continue # skip ones we already have
-        unpack_file(in_d, f)
-        data = sc.textFile(in_d + filename)
-        not_wanted = data.filter(get_dumb_lines).collect()
-        data = data.filter(lambda line: not get_dumb_lines(line))
-        rel_data = data.filter(lambda line: 'subreddit' in json.loads(line) and \
-                    json.loads(line)['subreddit'].lower() in relevant_subs)
-        rel_data = rel_data.filter(partial(content_has_vocab, vocab=vocab))
-        rel_data.coalesce(1).saveAsTextFile(out_d + filename)
-        if len(not_wanted) > 0: 
-            # write bad lines to bad_jsons
-            with open(out_d + 'bad_jsons/' + filename + '.txt', 'w') as outfile: 
-                for line in not_wanted:
-                    outfile.write(line + '\n') 
-        pack_file(in_d, f)
+        filter_dump(in_d, f, out_d, partial(in_subreddits_with_vocab, subs=relevant_subs, matcher=matcher))
         
 def extract_lexical_innovations(): 
     '''
@@ -463,19 +465,7 @@ def extract_select_subreddits(in_d, out_d, relevant_subs):
         if year in ['2005', '2006', '2020', '2021']: continue
         filename = f.split('.')[0]
         if os.path.isdir(out_d + filename): continue # skip ones we already have
-        unpack_file(in_d, f)
-        data = sc.textFile(in_d + filename)
-        not_wanted = data.filter(get_dumb_lines).collect()
-        data = data.filter(lambda line: not get_dumb_lines(line))
-        rel_data = data.filter(lambda line: 'subreddit' in json.loads(line) and \
-                    json.loads(line)['subreddit'].lower() in relevant_subs)
-        rel_data.coalesce(1).saveAsTextFile(out_d + filename)
-        if len(not_wanted) > 0: 
-            # write bad lines to bad_jsons
-            with open(out_d + 'bad_jsons/' + filename + '.txt', 'w') as outfile: 
-                for line in not_wanted:
-                    outfile.write(line + '\n') 
-        pack_file(in_d, f)
+        filter_dump(in_d, f, out_d, partial(in_subreddits, subs=relevant_subs))
     
 def filter_reddit_dating(): 
     subreddit_list = ['relationships', 'relationship_advice', 'dating_advice', 'breakups', 'dating']
@@ -486,6 +476,56 @@ def filter_reddit_dating():
     out_d = '/mnt/data0/lucy/manosphere/data/reddit_dating/'
     extract_select_subreddits(in_d, out_d, subreddit_list)
 
+def record_to_row(d, month='', kind=''): 
+    '''
+    Converts a record from parse_record() into a row of the month store
+    '''
+    row = {k: d.get(k) for k in RECORD_FIELDS}
+    row['subreddit'] = row['subreddit'].lower()
+    if row['created_utc'] is not None: 
+        row['created_utc'] = int(row['created_utc'])
+    row['month'] = month
+    row['kind'] = kind
+    return Row(**row)
+    
+def build_month_store(): 
+    '''
+    One-time conversion of the filtered Reddit corpus from part-00000
+    jsons into a Parquet store partitioned by month and subreddit, 
+    keeping only the fields in RECORD_FIELDS. 
+    
+    Comments and posts of a month are written together, and only
+    partitions of months that are written get overwritten, so
+    this can be rerun on new months. 
+    Use helpers.read_month_store() to read it back. 
+    '''
+    sqlContext.setConf('spark.sql.sources.partitionOverwriteMode', 'dynamic')
+    schema = StructType([
+      StructField('id', StringType(), True),
+      StructField('author', StringType(), True),
+      StructField('subreddit', StringType(), True),
+      StructField('created_utc', LongType(), True),
+      StructField('body', StringType(), True),
+      StructField('selftext', StringType(), True),
+      StructField('month', StringType(), True),
+      StructField('kind', StringType(), True),
+      ])
+    for filename in sorted(os.listdir(COMS)): 
+        if filename == 'bad_jsons': continue
+        m = filename.replace('RC_', '')
+        cdata = sc.textFile(COMS + filename + '/part-00000').map(parse_record)
+        cdata = cdata.map(partial(record_to_row, month=m, kind='RC'))
+        
+        if os.path.exists(SUBS + 'RS_' + m + '/part-00000'): 
+            post_path = SUBS + 'RS_' + m + '/part-00000'
+        else: 
+            post_path = SUBS + 'RS_v2_' + m + '/part-00000'
+        pdata = sc.textFile(post_path).map(parse_record)
+        pdata = pdata.map(partial(record_to_row, month=m, kind='RS'))
+        
+        df = sqlContext.createDataFrame(cdata.union(pdata), schema)
+        df.write.mode('overwrite').partitionBy('month', 'subreddit').parquet(MONTH_STORE)
+
 def main(): 
     #check_duplicates_main()
     #extract_subreddits_main()
@@ -494,6 +534,7 @@ def main():
     #count_posts_per_subreddit()
     #get_top_subreddits()
     #extract_lexical_innovations()
+    #build_month_store()
     filter_reddit_dating()
     sc.stop()
 
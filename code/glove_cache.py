@@ -0,0 +1,73 @@
+'''
+Binary cache of GloVe vectors, so that glove.6B.300d.txt
+is parsed once instead of every time we load a few words.
+
+The cache is an embedding store (see embedding_store.py) next to
+the text file, plus mean.npy and std.npy of all vectors. It is
+rebuilt if the text file is newer than it.
+'''
+import os
+from functools import lru_cache
+import numpy as np
+from embedding_store import save_embedding_store, load_embedding_store
+
+GLOVE_NAME = 'glove.6B.300d'
+
+def build_glove_cache(glove_folder):
+    '''
+    Parses the text file into a float32 matrix and vocab,
+    and saves the mean and std of the vectors
+    '''
+    words = []
+    vecs = []
+    with open(glove_folder + GLOVE_NAME + '.txt', 'r') as infile:
+        for line in infile:
+            contents = line.split()
+            words.append(contents[0])
+            vecs.append(np.array(contents[1:], dtype=np.float32))
+    matrix = np.array(vecs)
+    save_embedding_store(glove_folder + GLOVE_NAME, words, matrix)
+    np.save(glove_folder + 'mean.npy', matrix.mean(axis=0, dtype=np.float64))
+    np.save(glove_folder + 'std.npy', matrix.std(axis=0, dtype=np.float64))
+
+def check_glove_cache(glove_folder):
+    txt_path = glove_folder + GLOVE_NAME + '.txt'
+    for path in [glove_folder + GLOVE_NAME + '.npy', glove_folder + GLOVE_NAME + '_keys.txt',
+                 glove_folder + 'mean.npy', glove_folder + 'std.npy']:
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(txt_path):
+            build_glove_cache(glove_folder)
+            return
+
+@lru_cache(maxsize=None)
+def load_glove(glove_folder):
+    '''
+    @output:
+    - matrix: memory-mapped float32 matrix of all vectors
+    - word_index: {word : row}
+    '''
+    check_glove_cache(glove_folder)
+    matrix, words, _ = load_embedding_store(glove_folder + GLOVE_NAME)
+    word_index = {w: i for i, w in enumerate(words)}
+    return matrix, word_index
+
+def load_glove_vocab(glove_folder):
+    '''
+    Set of GloVe words, without loading any vectors
+    '''
+    check_glove_cache(glove_folder)
+    with open(glove_folder + GLOVE_NAME + '_keys.txt', 'r') as infile:
+        return set(line.rstrip('\n') for line in infile)
+
+def load_glove_mean_std(glove_folder):
+    check_glove_cache(glove_folder)
+    return np.load(glove_folder + 'mean.npy'), np.load(glove_folder + 'std.npy')
+
+def lookup_glove(glove_folder, words):
+    '''
+    @output:
+    - {word : float64 vector} for the words that are in GloVe
+    '''
+    matrix, word_index = load_glove(glove_folder)
+    found = [w for w in words if w in word_index]
+    rows = matrix[[word_index[w] for w in found]].astype(np.float64)
+    return dict(zip(found, rows))
@@ -13,8 +13,9 @@ from pyspark.sql.types import StructType,StructField, StringType, IntegerType
 from pyspark.sql import Row, SQLContext
 from pyspark.sql.functions import col
 from functools import partial
-from helpers import check_valid_comment, check_valid_post, remove_bots, get_bot_set, get_sr_cats
+from helpers import check_valid_comment, check_valid_post, remove_bots, get_bot_set, get_sr_cats, parse_record
 from collections import defaultdict
+from count_tensor import export_count_tensor
 import os
 from tqdm import tqdm
 
@@ -78,11 +79,10 @@ def get_n_gramlist(nngramlist, toks, sr, n=2):
         nngramlist.append((sr, ' '.join(s)))                
     return nngramlist
 
-def get_ngrams_comment(line, tokenizer=None, per_comment=True): 
+def get_ngrams_comment(d, tokenizer=None, per_comment=True): 
     '''
-    Bigrams and unigrams in Reddit comment
+    Bigrams and unigrams in Reddit comment record
     '''
-    d = json.loads(line)
     sr = d['subreddit'].lower()
     toks = tokenizer.tokenize(d['body'])
     all_grams = [(sr, i) for i in toks]
@@ -91,11 +91,10 @@ def get_ngrams_comment(line, tokenizer=None, per_comment=True):
         all_grams = list(set(all_grams))
     return all_grams
 
-def get_ngrams_post(line, tokenizer=None, per_comment=True): 
+def get_ngrams_post(d, tokenizer=None, per_comment=True): 
     '''
-    Bigrams and unigrams in Reddit comment
+    Bigrams and unigrams in Reddit post record
     '''
-    d = json.loads(line)
     all_grams = set()
     sr = d['subreddit'].lower()
     toks = tokenizer.tokenize(d['selftext'])
@@ -122,7 +121,7 @@ def count_sr(per_comment=True):
     for filename in os.listdir(COMS): 
         if filename == 'bad_jsons': continue
         m = filename.replace('RC_', '')
-        cdata = sc.textFile(COMS + filename + '/part-00000')
+        cdata = sc.textFile(COMS + filename + '/part-00000').map(parse_record)
         cdata = cdata.filter(check_valid_comment)
         cdata = cdata.filter(partial(remove_bots, bot_set=bots))
         cdata = cdata.flatMap(partial(get_ngrams_comment, tokenizer=tokenizer, per_comment=per_comment))
@@ -133,7 +132,7 @@ def count_sr(per_comment=True):
             post_path = SUBS + 'RS_' + m + '/part-00000'
         else: 
             post_path = SUBS + 'RS_v2_' + m + '/part-00000'
-        pdata = sc.textFile(post_path)
+        pdata = sc.textFile(post_path).map(parse_record)
         pdata = pdata.filter(partial(remove_bots, bot_set=bots))
         pdata = pdata.flatMap(partial(get_ngrams_post, tokenizer=tokenizer, per_comment=per_comment))
         pdata = pdata.map(lambda n: (n, 1))
@@ -169,7 +168,7 @@ def count_control(per_comment=True):
     for filename in os.listdir(CONTROL): 
         if filename == 'bad_jsons': continue
         m = filename.replace('RC_', '').replace('RS_v2_', '').replace('RS_', '')
-        file_data = sc.textFile(CONTROL + filename + '/part-00000')
+        file_data = sc.textFile(CONTROL + filename + '/part-00000').map(parse_record)
         file_data = file_data.filter(partial(remove_bots, bot_set=bots))
         
         if filename.startswith('RC_'): 
@@ -272,12 +271,21 @@ def get_total_tokens():
     outfile.write('control:' + str(um_totals) + '\n')
     outfile.close()
     
-def count_vocab_mainstream(line, tokenizer=None, vocab=set()): 
+def export_count_tensors(per_comment=True): 
+    '''
+    Exports each count parquet as a sparse tensor (see count_tensor.py)
+    in a folder next to it, for queries that don't need Spark
+    '''
+    suffix = '_set' if per_comment else ''
+    for name in ['subreddit_counts', 'forum_counts', 'control_counts']: 
+        df = sqlContext.read.parquet(WORD_COUNT_DIR + name + suffix)
+        export_count_tensor(df, WORD_COUNT_DIR + name + suffix + '_tensor/')
+    
+def count_vocab_mainstream(d, tokenizer=None, vocab=set()): 
     '''
-    Counts vocab words for mainstream reddit
+    Counts vocab words for mainstream reddit record
     These are PER-COMMENT counts
     '''
-    d = json.loads(line)
     if 'selftext' in d: 
         text = d['selftext'].lower()
     elif 'body' in d: 
@@ -327,7 +335,7 @@ def count_lexical_innovations():
         if not os.path.exists(com_input) and not os.path.exists(sub_input): continue
 
         if os.path.exists(sub_input): 
-            pdata = sc.textFile(sub_input)
+            pdata = sc.textFile(sub_input).map(parse_record)
             pdata = pdata.filter(partial(remove_bots, bot_set=bots))
             pdata = pdata.flatMap(partial(count_vocab_mainstream, tokenizer=tokenizer, vocab=vocab))
             pdata = pdata.reduceByKey(lambda n1, n2: n1 + n2)
@@ -335,7 +343,7 @@ def count_lexical_innovations():
             pdata = sc.emptyRDD()
         
         if os.path.exists(com_input): 
-            cdata = sc.textFile(com_input)
+            cdata = sc.textFile(com_input).map(parse_record)
             cdata = cdata.filter(partial(remove_bots, bot_set=bots))
             cdata = cdata.flatMap(partial(count_vocab_mainstream, tokenizer=tokenizer, vocab=vocab))
             cdata = cdata.reduceByKey(lambda n1, n2: n1 + n2)
@@ -441,6 +449,7 @@ def main():
     count_control()
 #     count_sr()
 #     count_forum()
+#     export_count_tensors()
     get_total_tokens()
 #     count_lexical_innovations()
 #     mainstream_sustained_periods()
@@ -7,6 +7,10 @@ ROOT = '/mnt/data0/lucy/manosphere/'
 PEOPLE_FILE = ROOT + 'data/people.csv'
 # entire vocab after NER 
 ANN_FILE = ROOT + 'data/ann_sig_entities.csv'
+# Pushshift fields kept by parse_record()
+RECORD_FIELDS = ['id', 'author', 'subreddit', 'created_utc', 'body', 'selftext']
+# Parquet store of the filtered Reddit corpus, partitioned by month and subreddit 
+MONTH_STORE = ROOT + 'data/month_store/'
 
 def get_vocab(): 
     '''
@@ -64,19 +68,29 @@ def get_manual_people():
                 words.add(plural.lower())
     return words, sing2plural
 
-def check_valid_comment(line): 
+def parse_record(line): 
     '''
-    For Reddit comments
+    Decodes a Pushshift line once into a compact record that
+    only keeps the fields we use downstream. 
+    Returns None if the line is not a valid json. 
     '''
-    comment = json.loads(line)
-    return 'body' in comment and comment['body'].strip() != '[deleted]' \
-            and comment['body'].strip() != '[removed]'
+    try: 
+        d = json.loads(line)
+    except json.decoder.JSONDecodeError:
+        return None
+    return {k: d[k] for k in RECORD_FIELDS if k in d}
 
-def check_valid_post(line): 
+def check_valid_comment(d): 
     '''
-    For Reddit posts
+    For Reddit comments, where d is a record from parse_record()
+    '''
+    return 'body' in d and d['body'].strip() != '[deleted]' \
+            and d['body'].strip() != '[removed]'
+
+def check_valid_post(d): 
+    '''
+    For Reddit posts, where d is a record from parse_record()
     '''
-    d = json.loads(line)
     return 'selftext' in d
 
 def get_bot_set(): 
@@ -89,9 +103,89 @@ def get_bot_set():
             bots.add(line.strip())
     return bots
     
-def remove_bots(line, bot_set=set()): 
+def remove_bots(d, bot_set=set()): 
     '''
-    Remove post if written by bots 
+    Remove post if written by bots, where d is a record from parse_record()
     '''
-    d = json.loads(line)
     return 'author' in d and d['author'] not in bot_set
+
+def read_month_store(months=None, subreddits=None, categories=None, kind=None, columns=None): 
+    '''
+    Yields records from the Parquet store built by filter_reddit.build_month_store(). 
+    Records are dicts with the same keys as parse_record() (fields that are 
+    missing are dropped), so check_valid_comment, remove_bots etc. work on them. 
+    Only the requested columns are read, and month/subreddit filters
+    prune whole partitions before any file is opened. 
+    @inputs: 
+    - months: list of months, e.g. ['2015-01'], or None for all months
+    - subreddits: list of lowercased subreddit names, or None for all
+    - categories: list of subreddit categories, which are mapped to subreddits
+    - kind: 'RC' for comments, 'RS' for posts, or None for both
+    - columns: fields to read, defaults to RECORD_FIELDS
+    '''
+    # imported here so that helpers doesn't need pyarrow outside the month store
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    if columns is None: 
+        columns = RECORD_FIELDS
+    partitioning = ds.partitioning(pa.schema([('month', pa.string()), 
+                                              ('subreddit', pa.string())]), flavor='hive')
+    dataset = ds.dataset(MONTH_STORE, format='parquet', partitioning=partitioning)
+    if categories is not None: 
+        sr_cats = get_sr_cats()
+        cat_subreddits = [sr for sr in sr_cats if sr_cats[sr] in categories]
+        if subreddits is not None: 
+            cat_subreddits = [sr for sr in cat_subreddits if sr in subreddits]
+        subreddits = cat_subreddits
+    expr = None
+    for field, values in [('month', months), ('subreddit', subreddits)]: 
+        if values is None: continue
+        cond = ds.field(field).isin(list(values))
+        expr = cond if expr is None else expr & cond
+    if kind is not None: 
+        cond = ds.field('kind') == kind
+        expr = cond if expr is None else expr & cond
+    for batch in dataset.to_batches(columns=columns, filter=expr): 
+        for row in batch.to_pylist(): 
+            yield {k: v for k, v in row.items() if v is not None}
+
+def build_vocab_matcher(vocab): 
+    '''
+    Builds an Aho-Corasick automaton over vocab words (unigrams and bigrams)
+    once, so that all of them can be found in a single pass over a text. 
+    '''
+    # imported here so that helpers doesn't need pyahocorasick outside vocab matching
+    import ahocorasick
+    matcher = ahocorasick.Automaton()
+    for word in vocab: 
+        matcher.add_word(word, word)
+    matcher.make_automaton()
+    return matcher
+
+def is_word_boundary(text, i): 
+    '''
+    Same as regex \\b at index i of text
+    '''
+    before = i > 0 and (text[i-1].isalnum() or text[i-1] == '_')
+    after = i < len(text) and (text[i].isalnum() or text[i] == '_')
+    return before != after
+
+def find_vocab(matcher, text): 
+    '''
+    Returns [(start index, word)] for every occurrence of a vocab word in text
+    that re.search(r'\\b' + re.escape(word) + r'\\b', text) would also match. 
+    Overlapping matches, e.g. a bigram and a unigram inside it, are all kept. 
+    '''
+    hits = []
+    if len(matcher) == 0: return hits
+    for end, word in matcher.iter(text): 
+        start = end - len(word) + 1
+        if is_word_boundary(text, start) and is_word_boundary(text, end + 1): 
+            hits.append((start, word))
+    return hits
+
+def vocab_in_text(matcher, text): 
+    '''
+    Set of vocab words that occur in text
+    '''
+    return set([word for _, word in find_vocab(matcher, text)])
@@ -1,75 +1,195 @@
-import random
-import numpy as np 
-from collections import defaultdict
+'''
+K-Spectral Centroid clustering of time series (Yang & Leskovec, 2011),
+which groups series by shape regardless of their scale.
+
+Each iteration is vectorized over all series: clusters are
+boolean membership masks, centroids are the top eigenvectors of a
+stack of per-cluster matrices, and the distances from every series
+to every centroid are one matrix product. Restarts from different random
+memberships can run in parallel, and the one with the lowest objective is kept.
+
+With max_shift > 0, the distance also minimizes over shifting the centroid
+by up to max_shift months, as in the paper. The correlations of every
+series with every shifted centroid are computed at once with FFTs.
+'''
+import numpy as np
 from numpy import linalg as LA
-from copy import deepcopy
+from multiprocessing import Pool
 
 ROOT = '/mnt/data0/lucy/manosphere/'
 LOGS = ROOT + 'logs/'
 TIME_SERIES_DIR = LOGS + 'time_series/'
+MAX_ITER = 100
+CHUNK_ROWS = 2000 # series per FFT batch in shift_distances()
 
-def cluster_time_series(k): 
-    
-    random.seed(0)
-    dataset = 'manosphere'
+def load_time_series(dataset):
     word_list = []
-    with open(TIME_SERIES_DIR + 'vocab_' + dataset + '_set.txt', 'r') as infile: 
-            for line in infile: 
-                word_list.append(line.strip())
+    with open(TIME_SERIES_DIR + 'vocab_' + dataset + '_set.txt', 'r') as infile:
+        for line in infile:
+            word_list.append(line.strip())
     matrix = np.load(TIME_SERIES_DIR + 'time_series_' + dataset + '_smoothed_set.npy')
-    # N = number of time series
-    N = matrix.shape[0]
-    
-    # cluster membership for each time series
-    mem = np.array([random.randint(0, k-1) for idx in range(N)])
-    
-    # optimal alpha, as defined in the paper
-    alpha = lambda x, y: np.dot(x, y) / np.dot(y, y)
-    
-    # d^ as defined in the paper
-    d_hat = lambda x, y: (np.linalg.norm(x - alpha(x,y)*y)) / (np.linalg.norm(x))
-    
-    for it in range(100):
-        print("Iteration", it)
-        prev_mem = deepcopy(mem)
-        mu = np.zeros((k, matrix[0].shape[0]))
-        for j in range(k):
-            A = []
-            for vec_idx in range(N): 
-                if mem[vec_idx] == j: 
-                    vec = matrix[vec_idx]
-                    A.append(vec)
-            A = np.array(A)
-            if A.shape[0] == 0: 
-                mu[j] = np.zeros(matrix[0].shape[0])
-                continue
-            interm = np.sqrt(np.sum(np.square(A), 1))
-            B = np.divide(A, np.tile(interm, (A.shape[1], 1)).transpose())
-            M = np.matmul(np.transpose(B), B) - A.shape[0]*np.identity(A.shape[1])
-            w, v = LA.eig(M)
-            idx = np.argmin(np.absolute(w))
-            if np.sum(v[:,idx]) < 0: 
-                mu[j] = -v[:,idx]
-            else: 
-                mu[j] = v[:,idx]
+    return word_list, matrix
+
+def normalize_rows(matrix):
+    '''
+    Rows scaled to unit norm, all-zero rows are left as zeros
+    '''
+    norms = LA.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+def ksc_centroids(X_normed, mem, k):
+    '''
+    The centroid of a cluster minimizes the sum of squared d_hat to its members,
+    which is the top eigenvector of B^T B, where B is the cluster's normalized series.
+    @inputs:
+    - X_normed: N x T row-normalized time series
+    - mem: cluster of each series
+    @output:
+    - mu: k x T unit norm centroids, rows of zeros for empty clusters
+    '''
+    masks = mem[None, :] == np.arange(k)[:, None] # k x N
+    B = masks[:, :, None] * X_normed[None, :, :] # k x N x T
+    M = np.matmul(B.transpose(0, 2, 1), B) # k x T x T, symmetric
+    w, v = LA.eigh(M) # eigenvalues in ascending order
+    mu = v[:, :, -1]
+    # same sign convention as before, centroids sum to a positive number
+    mu[mu.sum(axis=1) < 0] *= -1
+    mu[~masks.any(axis=1)] = 0
+    return mu
+
+def ksc_distances(X_normed, mu):
+    '''
+    d_hat(x, y) = ||x - alpha y|| / ||x|| with the optimal scale alpha = x.y / y.y,
+    which for unit x and y is sqrt(1 - (x.y)^2).
+    @output:
+    - N x k distances, inf to empty clusters
+    '''
+    sims = X_normed @ normalize_rows(mu).T
+    dist = np.sqrt(np.clip(1 - np.square(sims), 0, None))
+    dist[:, ~mu.any(axis=1)] = np.inf
+    return dist
+
+def shifted_sq_norms(mu, shifts):
+    '''
+    @output:
+    - k x len(shifts) squared norms of each centroid shifted by q,
+    mu_q[t] = mu[t - q], with the months shifted in filled with zeros
+    '''
+    T = mu.shape[1]
+    # cumsum[:, m] is the sum of the first m squared values
+    cumsum = np.concatenate([np.zeros((mu.shape[0], 1)), np.cumsum(np.square(mu), axis=1)], axis=1)
+    right = cumsum[:, T - np.clip(shifts, 0, None)] # q >= 0 drops the last q months
+    left = cumsum[:, [T]] - cumsum[:, np.clip(-shifts, 0, None)] # q < 0 drops the first -q months
+    return np.where(shifts >= 0, right, left)
 
-        for vec_idx in range(N): 
-            vec = matrix[vec_idx]
-            distances = []
-            for j in range(k): 
-                distances.append(d_hat(vec, mu[j]))
-            j_star = np.argmin(distances)
-            mem[vec_idx] = j_star
-            
-        if np.linalg.norm(prev_mem - mem) == 0: 
+def shift_distances(X_normed, mu, max_shift, chunk_rows=CHUNK_ROWS):
+    '''
+    d_hat minimized over shifts of each centroid by -max_shift to max_shift months.
+    x . mu_q for all q is the cross-correlation of x and mu, computed
+    with zero-padded FFTs for all series and centroids in a batch.
+    @output:
+    - dist: N x k distances, inf to empty clusters
+    - best_shifts: N x k shift q of each centroid that is closest to each series
+    '''
+    N, T = X_normed.shape
+    assert 0 <= max_shift < T
+    shifts = np.arange(-max_shift, max_shift + 1)
+    fft_len = 1 << int(np.ceil(np.log2(2 * T - 1))) # long enough that correlation isn't circular
+    sq_norms = shifted_sq_norms(mu, shifts) # k x num shifts
+    mu_fft = np.conj(np.fft.rfft(mu, n=fft_len))
+    dist = np.empty((N, mu.shape[0]))
+    best_shifts = np.empty((N, mu.shape[0]), dtype=int)
+    for start in range(0, N, chunk_rows):
+        X_fft = np.fft.rfft(X_normed[start:start + chunk_rows], n=fft_len)
+        # corr[n, j, q mod fft_len] = sum_t x_n[t] mu_j[t - q]
+        corr = np.fft.irfft(X_fft[:, None, :] * mu_fft[None, :, :], n=fft_len)
+        corr = corr[:, :, shifts % fft_len] # chunk x k x num shifts
+        # squared cosine similarity of x and mu_q, since x is unit norm
+        sq_sims = np.divide(np.square(corr), sq_norms, out=np.zeros_like(corr), where=sq_norms > 0)
+        best = np.argmax(sq_sims, axis=2)
+        best_sq_sims = np.take_along_axis(sq_sims, best[:, :, None], axis=2)[:, :, 0]
+        dist[start:start + chunk_rows] = np.sqrt(np.clip(1 - best_sq_sims, 0, None))
+        best_shifts[start:start + chunk_rows] = shifts[best]
+    dist[:, ~mu.any(axis=1)] = np.inf
+    return dist, best_shifts
+
+def shift_rows(matrix, shifts):
+    '''
+    Aligns each series to its centroid, out[n, t] = matrix[n, t + shifts[n]],
+    with zeros for months that fall outside the series
+    '''
+    N, T = matrix.shape
+    cols = np.arange(T)[None, :] + shifts[:, None]
+    valid = (cols >= 0) & (cols < T)
+    return np.where(valid, matrix[np.arange(N)[:, None], np.clip(cols, 0, T - 1)], 0)
+
+def ksc_run(matrix, k, seed, max_iter=MAX_ITER, max_shift=0):
+    '''
+    One run of KSC from a random membership
+    - max_shift: if > 0, distances are also minimized over shifts of up to this many months
+    @output:
+    - mem: cluster of each series
+    - mu: k x T centroids
+    - objective: sum of squared d_hat from each series to its centroid
+    - shifts: shift of each series' centroid, all 0 if max_shift is 0
+    '''
+    rng = np.random.default_rng(seed)
+    X_normed = normalize_rows(np.asarray(matrix, dtype=np.float64))
+    N = X_normed.shape[0]
+    mem = rng.integers(0, k, size=N)
+    shifts = np.zeros(N, dtype=int)
+    for it in range(max_iter):
+        if max_shift > 0:
+            # members are aligned to their centroid before it is recomputed
+            mu = ksc_centroids(normalize_rows(shift_rows(X_normed, shifts)), mem, k)
+            dist, best_shifts = shift_distances(X_normed, mu, max_shift)
+        else:
+            mu = ksc_centroids(X_normed, mem, k)
+            dist = ksc_distances(X_normed, mu)
+            best_shifts = np.zeros(dist.shape, dtype=int)
+        new_mem = np.argmin(dist, axis=1)
+        new_shifts = best_shifts[np.arange(N), new_mem]
+        if np.array_equal(new_mem, mem) and np.array_equal(new_shifts, shifts):
             break
-    np.save(TIME_SERIES_DIR + 'mu_' + str(k) + '.npy', mu)
-    np.save(TIME_SERIES_DIR + 'clusters_set_' + str(k) + '.npy', mem)
-    
-def main(): 
-    cluster_time_series(4)
-    cluster_time_series(6)
-    cluster_time_series(8)
+        mem = new_mem
+        shifts = new_shifts
+    objective = np.sum(np.square(dist[np.arange(N), mem]))
+    return mem, mu, objective, shifts
+
+def ksc(matrix, k, restarts=10, seed=0, processes=None, max_iter=MAX_ITER, max_shift=0):
+    '''
+    @inputs:
+    - matrix: N x T time series
+    - restarts: number of random initializations
+    - processes: if not None, restarts are run in a process pool of this size
+    - max_shift: maximum shift in months for shift-invariant distances, 0 for none
+    @output:
+    - mem, mu, objective, shifts of the restart with the lowest objective
+    '''
+    # each restart has its own seed so results don't depend on processes
+    tasks = [(matrix, k, [seed, r], max_iter, max_shift) for r in range(restarts)]
+    if processes is None:
+        results = [ksc_run(*task) for task in tasks]
+    else:
+        with Pool(processes=processes) as pool:
+            results = pool.starmap(ksc_run, tasks)
+    return min(results, key=lambda res: res[2])
+
+def cluster_time_series(k, dataset='manosphere', restarts=10, processes=None, max_shift=0):
+    word_list, matrix = load_time_series(dataset)
+    mem, mu, objective, shifts = ksc(matrix, k, restarts=restarts, processes=processes,
+                                     max_shift=max_shift)
+    print("k =", k, "objective:", objective)
+    suffix = str(k) if max_shift == 0 else str(k) + '_shift' + str(max_shift)
+    np.save(TIME_SERIES_DIR + 'mu_' + suffix + '.npy', mu)
+    np.save(TIME_SERIES_DIR + 'clusters_set_' + suffix + '.npy', mem)
+    if max_shift > 0:
+        np.save(TIME_SERIES_DIR + 'shifts_set_' + suffix + '.npy', shifts)
+    return objective
+
+def main():
+    for k in [4, 6, 8]:
+        cluster_time_series(k, restarts=20, processes=4)
 
 if __name__ == '__main__':
     main()
@@ -5,6 +5,7 @@ from pyspark import SparkConf, SparkContext
 from pyspark.sql import SQLContext
 from pyspark.sql.functions import col, split, sum
 from helpers import get_sr_cats
+from smoothing import moving_average_kernel, smooth_file
 import math
 from scipy.stats import spearmanr
 from collections import Counter, defaultdict
@@ -22,6 +23,8 @@ FORUMS = ROOT + 'data/cleaned_forums/'
 WORD_COUNT_DIR = LOGS + 'gram_counts/'
 TIME_SERIES_DIR = LOGS + 'time_series/'
 ANN_FILE = ROOT + 'data/ann_sig_entities.csv'
+MIN_MONTH = '2005-11'
+MAX_MONTH = '2019-12'
 
 def load_gram_counts(categories, sqlContext): 
     reddit_df = sqlContext.read.parquet(WORD_COUNT_DIR + 'subreddit_counts_set')
@@ -78,12 +81,9 @@ def get_time_series(word, df, um_totals, bm_totals):
     elif len(word.split(' ')) == 2: 
         totals = bm_totals
     # divide month counts by total month count 
-    min_month = '2005-11'
-    max_month = '2019-12'
-
     ts = []
     
-    for m in month_year_iter(min_month, max_month): 
+    for m in month_year_iter(MIN_MONTH, MAX_MONTH): 
         if m not in totals: 
             ts.append(0)
         else: 
@@ -91,6 +91,41 @@ def get_time_series(word, df, um_totals, bm_totals):
             ts.append(prob)
     return ts
 
+def get_time_series_matrix(word_df, words, um_totals, bm_totals): 
+    '''
+    Same as get_time_series() for a whole vocabulary, with one 
+    grouped aggregation over (word, month) instead of one Spark job per word. 
+    
+    - word_df: dataframe containing word counts, filtered to words
+    - words: words to get time series for, in row order
+    - um_totals: total number of unigrams per month
+    - bm_totals: total number of bigrams per month
+    @output: 
+    - len(words) x months matrix of normalized frequencies
+    '''
+    months = list(month_year_iter(MIN_MONTH, MAX_MONTH))
+    month_idx = {m: j for j, m in enumerate(months)}
+    vocab = sorted(set(words))
+    vocab_idx = {w: i for i, w in enumerate(vocab)}
+    
+    # sum counts per word and month 
+    counts = np.zeros((len(vocab), len(months)))
+    word_month_counts = word_df.groupBy('word', 'month').agg(sum('count').alias('summed_count')).collect()
+    for row in word_month_counts: 
+        if row.word in vocab_idx and row.month in month_idx: 
+            counts[vocab_idx[row.word], month_idx[row.month]] = row.summed_count
+    counts = counts[[vocab_idx[w] for w in words]]
+    
+    # row i of totals is the total number of (i+1)-grams per month, 0 if missing
+    totals = np.zeros((2, len(months)))
+    for j, m in enumerate(months): 
+        totals[0, j] = um_totals.get(m, 0)
+        totals[1, j] = bm_totals.get(m, 0)
+    gram_len = np.array([len(w.split(' ')) for w in words], dtype=int)
+    assert (gram_len < 3).all()
+    row_totals = totals[gram_len - 1]
+    return np.divide(counts, row_totals, out=np.zeros_like(counts), where=row_totals > 0)
+
 def save_word_count_data(sqlContext, dataset): 
     '''
     This function is used to save a combined
@@ -182,25 +217,20 @@ def get_multiple_time_series(dataset, sqlContext):
     # filter the count dataframe just to the words we care about
     word_df = df.filter(df.word.isin(words))
 
-    matrix = []
+    matrix = get_time_series_matrix(word_df, words, um_totals, bm_totals)
     with open(TIME_SERIES_DIR + 'vocab_' + dataset + '_set.txt', 'w') as outfile: 
         for w in words: 
             outfile.write(w + '\n')
-            ts = get_time_series(w, word_df, um_totals, bm_totals)
-            matrix.append(ts)
-    matrix = np.array(matrix)
     np.save(TIME_SERIES_DIR + 'time_series_' + dataset + '_set.npy', matrix)
             
-def smooth_time_series(dataset): 
-    matrix = np.load(TIME_SERIES_DIR + 'time_series_' + dataset + '_set.npy')
-    kernel_size = 3 # make sure to modify the code below if you change this
-    kernel = np.ones(kernel_size) / kernel_size
-    for i in range(matrix.shape[0]): 
-        smoothed = np.convolve(matrix[i], kernel, mode='valid')
-        smoothed = np.concatenate(([matrix[i][0]/2 + matrix[i][1]/2], smoothed, [matrix[i][-1]/2 + matrix[i][-2]/2]))
-        assert smoothed.shape == matrix[i].shape
-        matrix[i] = smoothed
-    np.save(TIME_SERIES_DIR + 'time_series_' + dataset + '_smoothed_set.npy', matrix) 
+def smooth_time_series(dataset, kernel=None): 
+    '''
+    - kernel: see smoothing.py, default is a 3-month moving average
+    '''
+    if kernel is None: 
+        kernel = moving_average_kernel(3)
+    smooth_file(TIME_SERIES_DIR + 'time_series_' + dataset + '_set.npy', 
+                TIME_SERIES_DIR + 'time_series_' + dataset + '_smoothed_set.npy', kernel)
     
 def time_series_prep_and_run(): 
     '''
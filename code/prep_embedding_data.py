@@ -9,7 +9,7 @@ from functools import partial
 from nltk import tokenize
 import sys
 sys.path.insert(0, '/mnt/data0/lucy/manosphere/code')
-from helpers import check_valid_comment, check_valid_post, remove_bots, get_bot_set, get_vocab
+from helpers import check_valid_comment, check_valid_post, remove_bots, get_bot_set, get_vocab, parse_record, build_vocab_matcher, find_vocab
 import os
 import csv
 from collections import defaultdict
@@ -41,10 +41,12 @@ def get_subreddit_categories():
                 categories[name] = cat
     return categories
 
-def preprocess_text(text, idx, cat, tokenizer=None, vocab=set()): 
+def preprocess_text(text, idx, cat, tokenizer=None, matcher=None): 
     '''
     idx is the comment/post's ID, and id_suffix is the sentence ID
     cat is category + year 
+    matcher is from build_vocab_matcher(), and finds vocab unigrams
+    and bigrams in one pass over the space-joined tokens
     '''
     sents = tokenize.sent_tokenize(text)
     id2sent = [] # (idx + id_suffix, sent)
@@ -55,41 +57,32 @@ def preprocess_text(text, idx, cat, tokenizer=None, vocab=set()):
         if len(tokens) < 5 or len(tokens) > 150: 
             continue
         words_in_sent = set()
-        for i in range(len(tokens)): 
-            if i > 0 and tokens[i-1] + ' ' + tokens[i] in vocab: 
-                # bigram:
-                term = tokens[i-1] + ' ' + tokens[i]
-                word2id.append(((term, cat), idx + '-' + str(id_suffix)))
-                words_in_sent.add(term)
-            if tokens[i] in vocab: 
-                # unigram: 
-                word2id.append(((tokens[i], cat), idx + '-' + str(id_suffix)))
-                words_in_sent.add(tokens[i])
+        for _, term in find_vocab(matcher, ' '.join(tokens)): 
+            word2id.append(((term, cat), idx + '-' + str(id_suffix)))
+            words_in_sent.add(term)
         if len(words_in_sent) > 0: 
             id2sent.append((idx + '-' + str(id_suffix), sent))
         id_suffix += 1
     return word2id, id2sent
 
-def preprocess_comment(line, tokenizer=None, year='', vocab=set(), categories={}): 
-    d = json.loads(line)
+def preprocess_comment(d, tokenizer=None, year='', matcher=None, categories={}): 
     sr = d['subreddit'].lower()
     if sr not in categories: 
         # health or criticism
         return ([], [])
     idx = d['id']
     cat = categories[sr] + '_' + year
-    word2id, id2sent = preprocess_text(d['body'], idx, cat, tokenizer=tokenizer, vocab=vocab)
+    word2id, id2sent = preprocess_text(d['body'], idx, cat, tokenizer=tokenizer, matcher=matcher)
     return (word2id, id2sent)
 
-def preprocess_post(line, tokenizer=None, year='', vocab=set(), categories={}): 
-    d = json.loads(line)
+def preprocess_post(d, tokenizer=None, year='', matcher=None, categories={}): 
     sr = d['subreddit'].lower()
     idx = d['id']
     if sr not in categories: 
         # health or criticism
         return ([], [])
     cat = categories[sr] + '_' + year
-    word2id, id2sent = preprocess_text(d['selftext'], idx, cat, tokenizer=tokenizer, vocab=vocab)
+    word2id, id2sent = preprocess_text(d['selftext'], idx, cat, tokenizer=tokenizer, matcher=matcher)
     return (word2id, id2sent)
 
 def exact_sample(tup): 
@@ -106,7 +99,7 @@ def preprocess_dataset_reddit():
     We have up to 500 samples of each word in an 
     ideology (e.g. MRA/PUA) in a year (e.g. 2008). 
     '''
-    vocab = get_vocab()
+    matcher = build_vocab_matcher(get_vocab())
     tokenizer = BasicTokenizer(do_lower_case=True)
     bots = get_bot_set()
     
@@ -122,10 +115,10 @@ def preprocess_dataset_reddit():
         all_id2sent = sc.emptyRDD() # [(id, sent)]
         for filename in year_month[y]: 
             m = filename.replace('RC_', '')
-            cdata = sc.textFile(COMS + filename + '/part-00000')
+            cdata = sc.textFile(COMS + filename + '/part-00000').map(parse_record)
             cdata = cdata.filter(check_valid_comment)
             cdata = cdata.filter(partial(remove_bots, bot_set=bots))
-            cdata = cdata.map(partial(preprocess_comment, tokenizer=tokenizer, year=y, vocab=vocab, categories=categories))
+            cdata = cdata.map(partial(preprocess_comment, tokenizer=tokenizer, year=y, matcher=matcher, categories=categories))
             cword2id = cdata.flatMap(lambda x: x[0]).map(lambda tup: (tup[0], [tup[1]]))
             cword2id = cword2id.reduceByKey(lambda n1, n2: n1 + n2)
             cid2sent = cdata.flatMap(lambda x: x[1])
@@ -134,10 +127,10 @@ def preprocess_dataset_reddit():
                 post_path = SUBS + 'RS_' + m + '/part-00000'
             else: 
                 post_path = SUBS + 'RS_v2_' + m + '/part-00000'
-            pdata = sc.textFile(post_path)
+            pdata = sc.textFile(post_path).map(parse_record)
             pdata = pdata.filter(check_valid_post)
             pdata = pdata.filter(partial(remove_bots, bot_set=bots))
-            pdata = pdata.map(partial(preprocess_post, tokenizer=tokenizer, year=y, vocab=vocab, categories=categories))
+            pdata = pdata.map(partial(preprocess_post, tokenizer=tokenizer, year=y, matcher=matcher, categories=categories))
             pword2id = pdata.flatMap(lambda x: x[0]).map(lambda tup: (tup[0], [tup[1]]))
             pword2id = pword2id.reduceByKey(lambda n1, n2: n1 + n2)
             pid2sent = pdata.flatMap(lambda x: x[1])
@@ -157,18 +150,17 @@ def preprocess_dataset_reddit():
                 
     sc.stop()
     
-def preprocess_post(line, tokenizer=None, year='', vocab=set(), categories={}): 
-    d = json.loads(line)
+def preprocess_post(d, tokenizer=None, year='', matcher=None, categories={}): 
     sr = d['subreddit'].lower()
     idx = d['id']
     if sr not in categories: 
         # health or criticism
         return ([], [])
     cat = categories[sr] + '_' + year
-    word2id, id2sent = preprocess_text(d['selftext'], idx, cat, tokenizer=tokenizer, vocab=vocab)
+    word2id, id2sent = preprocess_text(d['selftext'], idx, cat, tokenizer=tokenizer, matcher=matcher)
     return (word2id, id2sent)
     
-def preprocess_forum_post(line, tokenizer=None, forum='', vocab=set(), categories={}): 
+def preprocess_forum_post(line, tokenizer=None, forum='', matcher=None, categories={}): 
     d = json.loads(line)
     idx = str(d['id_post'])
     if d['date_post'] is None: 
@@ -177,16 +169,16 @@ def preprocess_forum_post(line, tokenizer=None, forum='', vocab=set(), categorie
         date_time_str = d["date_post"].split('-')
         year = date_time_str[0]
     cat = forum + '_' + year
-    word2id, id2sent = preprocess_text(d['text_post'], idx, cat, tokenizer=tokenizer, vocab=vocab)
+    word2id, id2sent = preprocess_text(d['text_post'], idx, cat, tokenizer=tokenizer, matcher=matcher)
     return (word2id, id2sent)
     
 def preprocess_dataset_forums(): 
-    vocab = get_vocab()
+    matcher = build_vocab_matcher(get_vocab())
     tokenizer = BasicTokenizer(do_lower_case=True)
     
     for filename in os.listdir(FORUMS):
         data = sc.textFile(FORUMS + filename)
-        data = data.map(partial(preprocess_forum_post, tokenizer=tokenizer, forum=filename, vocab=vocab))
+        data = data.map(partial(preprocess_forum_post, tokenizer=tokenizer, forum=filename, matcher=matcher))
         word2id = data.flatMap(lambda x: x[0]).map(lambda tup: (tup[0], [tup[1]]))
         word2id = word2id.reduceByKey(lambda n1, n2: n1 + n2)
         id2sent = data.flatMap(lambda x: x[1])
@@ -215,6 +207,7 @@ def preprocess_gender_variant_sents():
     Ideally code should be refactored so repeated code does not exist. 
     '''
     vocab = ['moids', 'femoids', 'foids', 'women', 'men']
+    matcher = build_vocab_matcher(vocab)
     tokenizer = BasicTokenizer(do_lower_case=True)
     bots = get_bot_set()
     categories = get_subreddit_categories()
@@ -231,10 +224,10 @@ def preprocess_gender_variant_sents():
         all_id2sent = sc.emptyRDD() # [(id, sent)]
         for filename in year_month[y]: 
             m = filename.replace('RC_', '')
-            cdata = sc.textFile(COMS + filename + '/part-00000')
+            cdata = sc.textFile(COMS + filename + '/part-00000').map(parse_record)
             cdata = cdata.filter(check_valid_comment)
             cdata = cdata.filter(partial(remove_bots, bot_set=bots))
-            cdata = cdata.map(partial(preprocess_comment, tokenizer=tokenizer, year=y, vocab=vocab, categories=categories))
+            cdata = cdata.map(partial(preprocess_comment, tokenizer=tokenizer, year=y, matcher=matcher, categories=categories))
             cword2id = cdata.flatMap(lambda x: x[0]).map(lambda tup: (tup[0], [tup[1]]))
             cword2id = cword2id.reduceByKey(lambda n1, n2: n1 + n2)
             cid2sent = cdata.flatMap(lambda x: x[1])
@@ -243,10 +236,10 @@ def preprocess_gender_variant_sents():
                 post_path = SUBS + 'RS_' + m + '/part-00000'
             else: 
                 post_path = SUBS + 'RS_v2_' + m + '/part-00000'
-            pdata = sc.textFile(post_path)
+            pdata = sc.textFile(post_path).map(parse_record)
             pdata = pdata.filter(check_valid_post)
             pdata = pdata.filter(partial(remove_bots, bot_set=bots))
-            pdata = pdata.map(partial(preprocess_post, tokenizer=tokenizer, year=y, vocab=vocab, categories=categories))
+            pdata = pdata.map(partial(preprocess_post, tokenizer=tokenizer, year=y, matcher=matcher, categories=categories))
             pword2id = pdata.flatMap(lambda x: x[0]).map(lambda tup: (tup[0], [tup[1]]))
             pword2id = pword2id.reduceByKey(lambda n1, n2: n1 + n2)
             pid2sent = pdata.flatMap(lambda x: x[1])
@@ -266,7 +259,7 @@ def preprocess_gender_variant_sents():
             
     for filename in os.listdir(FORUMS):
         data = sc.textFile(FORUMS + filename)
-        data = data.map(partial(preprocess_forum_post, tokenizer=tokenizer, forum=filename, vocab=vocab))
+        data = data.map(partial(preprocess_forum_post, tokenizer=tokenizer, forum=filename, matcher=matcher))
         word2id = data.flatMap(lambda x: x[0]).map(lambda tup: (tup[0], [tup[1]]))
         word2id = word2id.filter(lambda tup: tup[0][1].split('_')[-1] in target_years).reduceByKey(lambda n1, n2: n1 + n2)
         id2sent = data.flatMap(lambda x: x[1])
@@ -24,6 +24,7 @@ from bs4 import BeautifulSoup
 import os
 import re
 from nltk import tokenize
+from glove_cache import load_glove_vocab
 
 ROOT = '/mnt/data0/lucy/manosphere/'
 DATA = ROOT + 'data/'
@@ -80,11 +81,7 @@ def get_occupation_pages_part1():
     Some occupations do not have a wikipedia page, in which
     case we leave them out. 
     '''
-    glove_vocab = set()
-    with open(GLOVE + 'glove.6B.300d.txt', 'r') as infile:
-        for line in infile: 
-            contents = line.split()
-            glove_vocab.add(contents[0])
+    glove_vocab = load_glove_vocab(GLOVE)
             
     with open(DATA + 'semantics/cleaned/occupations.json', 'r') as infile:
         classes = json.load(infile)
@@ -194,11 +191,7 @@ def retrieve_wordnet_axes():
     Like in the semaxis paper where poles are expanded using
     neighbors, here poles are expanded using synsets, or groups of synonymous words 
     '''
-    glove_vocab = set()
-    with open(GLOVE + 'glove.6B.300d.txt', 'r') as infile:
-        for line in infile: 
-            contents = line.split()
-            glove_vocab.add(contents[0])
+    glove_vocab = load_glove_vocab(GLOVE)
             
     i = 0
     seen = set() # adjective clusters already seen
@@ -0,0 +1,94 @@
+'''
+Smoothing time series matrices with an arbitrary kernel.
+
+Each series is convolved with the kernel along the time axis. At the
+edges the kernel is renormalized over the months that exist, so
+a 3-month moving average averages the first two months at the start
+of a series, and similarly at the end.
+
+Matrices are processed in chunks of rows, so .npy files can
+be smoothed through memory maps without loading them.
+'''
+import math
+import numpy as np
+from scipy.ndimage import convolve1d
+
+CHUNK_ROWS = 10000
+
+def moving_average_kernel(width=3):
+    assert width % 2 == 1, "kernel width should be odd so it is centered"
+    return np.ones(width) / width
+
+def exponential_kernel(halflife, width=None, causal=False):
+    '''
+    Weights that halve every halflife months away from the center
+    - width: number of months on each side, by default 3 halflives
+    - causal: only use the current and past months, like an exponentially weighted moving average
+    '''
+    if width is None:
+        width = int(math.ceil(3 * halflife))
+    offsets = np.arange(-width, width + 1)
+    kernel = np.power(0.5, np.abs(offsets) / halflife)
+    if causal:
+        # kernel is flipped in the convolution, so positive offsets are past months
+        kernel[offsets < 0] = 0
+    return kernel / kernel.sum()
+
+def gaussian_kernel(sigma, width=None):
+    '''
+    - width: number of months on each side, by default 3 sigmas
+    '''
+    if width is None:
+        width = int(math.ceil(3 * sigma))
+    offsets = np.arange(-width, width + 1)
+    kernel = np.exp(-0.5 * np.square(offsets / sigma))
+    return kernel / kernel.sum()
+
+KERNELS = {
+    'moving_average': moving_average_kernel,
+    'exponential': exponential_kernel,
+    'gaussian': gaussian_kernel,
+}
+
+def get_kernel(name, **params):
+    '''
+    e.g. get_kernel('gaussian', sigma=2)
+    '''
+    return KERNELS[name](**params)
+
+def smooth_matrix(matrix, kernel, axis=1, out=None, chunk_rows=CHUNK_ROWS):
+    '''
+    @inputs:
+    - matrix: 2D array, possibly memory-mapped, with time along axis
+    - kernel: odd-length weights, centered on the current month
+    - out: array of the same shape to write to, e.g. a writable memory map,
+    a new array if None
+    @output:
+    - out, the smoothed matrix
+    '''
+    kernel = np.asarray(kernel, dtype=np.float64)
+    assert kernel.ndim == 1 and len(kernel) % 2 == 1, "kernel should have odd length"
+    if out is None:
+        out = np.empty(matrix.shape, dtype=np.float64)
+    # weight of the kernel that falls inside the series at each month
+    norm = convolve1d(np.ones(matrix.shape[axis]), kernel, mode='constant', cval=0.0)
+    norm_shape = [1, 1]
+    norm_shape[axis] = -1
+    norm = norm.reshape(norm_shape)
+    other_axis = 1 - axis
+    for start in range(0, matrix.shape[other_axis], chunk_rows):
+        chunk = np.s_[start:start + chunk_rows]
+        idx = (chunk, slice(None)) if axis == 1 else (slice(None), chunk)
+        values = np.asarray(matrix[idx], dtype=np.float64)
+        out[idx] = convolve1d(values, kernel, axis=axis, mode='constant', cval=0.0) / norm
+    return out
+
+def smooth_file(in_path, out_path, kernel, axis=1, chunk_rows=CHUNK_ROWS):
+    '''
+    Smooths a .npy matrix into another .npy file, through memory maps
+    '''
+    matrix = np.load(in_path, mmap_mode='r')
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float64, shape=matrix.shape)
+    smooth_matrix(matrix, kernel, axis=axis, out=out, chunk_rows=chunk_rows)
+    out.flush()
+    del out
@@ -6,7 +6,7 @@ This script does the following:
 Separate functions handle doing these things
 for GloVe and BERT. 
 '''
-from collections import defaultdict
+from collections import defaultdict, Counter
 import json
 from nltk.corpus import wordnet as wn
 import numpy as np
@@ -15,7 +15,7 @@ from sklearn.metrics.pairwise import cosine_similarity
 import csv
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
-from scipy import spatial, stats
+from scipy import stats
 import math
 from sklearn.feature_selection import SelectKBest, f_classif, SelectPercentile
 import requests
@@ -26,12 +26,20 @@ import re
 from nltk import tokenize
 import random
 import itertools
+import hashlib
+from functools import lru_cache
+from multiprocessing import Pool
+from embedding_store import load_embedding_store
+from glove_cache import build_glove_cache, load_glove_mean_std, lookup_glove
 
 #ROOT = '/global/scratch/users/lucy3_li/manosphere/'
 ROOT = '/mnt/data0/lucy/manosphere/'
 DATA = ROOT + 'data/'
 GLOVE = DATA + 'glove/'
 LOGS = ROOT + 'logs/'
+AXES_CACHE = LOGS + 'semantics_val/axes_cache/'
+# bump when the artifact's contents change
+AXES_CACHE_VERSION = 1
                 
 def load_wordnet_axes(): 
     '''
@@ -87,18 +95,9 @@ def get_mean_std_glove():
     '''
     This is no longer used, because
     it did not make GloVe perform better. 
+    mean.npy and std.npy are saved with the GloVe cache. 
     '''
-    all_vecs = []
-    with open(GLOVE + 'glove.6B.300d.txt', 'r') as infile:
-        for line in infile: 
-            contents = line.split()
-            word = contents[0]
-            vec = np.array([float(i) for i in contents[1:]])
-            all_vecs.append(vec)
-    glove_mean = np.mean(all_vecs, axis=0)
-    np.save(GLOVE + 'mean.npy', glove_mean)
-    glove_std = np.std(all_vecs, axis=0)
-    np.save(GLOVE + 'std.npy', glove_std)
+    build_glove_cache(GLOVE)
 
 def get_glove_vecs(vocab, axes_vocab, exp_name): 
     '''
@@ -111,23 +110,16 @@ def get_glove_vecs(vocab, axes_vocab, exp_name):
     - dictionary from word or bigram to GloVe embedding
     '''
     if 'zscore' in exp_name: 
-        glove_mean = np.load(GLOVE + 'mean.npy')
-        glove_std = np.load(GLOVE + 'std.npy')
+        glove_mean, glove_std = load_glove_mean_std(GLOVE)
     bigram_tokens = set()
     for w in vocab: 
         tokens = w.split()
         if len(tokens) == 2: 
             bigram_tokens.update(tokens)
-    glove_vecs = {}
-    with open(GLOVE + 'glove.6B.300d.txt', 'r') as infile:
-        for line in infile: 
-            contents = line.split()
-            word = contents[0]
-            if word in vocab or word in axes_vocab or word in bigram_tokens: 
-                vec = np.array([float(i) for i in contents[1:]])
-                if 'zscore' in exp_name: 
-                    vec = (vec - glove_mean) / glove_std
-                glove_vecs[word] = vec
+    glove_vecs = lookup_glove(GLOVE, set(vocab) | set(axes_vocab) | bigram_tokens)
+    if 'zscore' in exp_name: 
+        for word in glove_vecs: 
+            glove_vecs[word] = (glove_vecs[word] - glove_mean) / glove_std
     # average representations for bigrams
     for w in vocab: 
         tokens = w.split()
@@ -187,50 +179,71 @@ def save_frameaxis_inputs(file_path, sent_path, lexicon_name, exp_name):
             for word in word_order: 
                 outfile.write(word + '\n')
 
-def frameaxis_helper(score_matrices, word_matrices, adj_poles, calc_pval=False): 
+def bootstrap_means(sims, sample_size, rng, num_samples=1000): 
+    '''
+    Means of bootstrap samples of rows of sims, for all columns at once. 
+    The same resampled rows are used for every column (axis). 
+    @inputs: 
+    - sims: num words x num axes
+    - sample_size: number of rows in each sample
+    @output: 
+    - num_samples x num axes array of sample means
+    '''
+    n = sims.shape[0]
+    idx = rng.integers(0, n, size=(num_samples, sample_size))
+    # how many times each row is drawn in each sample
+    offsets = idx + np.arange(num_samples)[:, None] * n
+    row_counts = np.bincount(offsets.ravel(), minlength=num_samples * n).reshape(num_samples, n)
+    return row_counts @ sims / sample_size
+
+def frameaxis_category(score_matrix, word_matrix, microframes, poles, calc_pval, seed): 
+    '''
+    Biases of one category to all axes, run by frameaxis_helper(). 
+    @output: 
+    - { pole : (p_val, effect, bias1, bias2) }
+    '''
+    c_w_f = cosine_similarity(word_matrix, microframes) # words x axes
+    c_w_f1 = c_w_f[score_matrix == 0] # all other occupations
+    c_w_f2 = c_w_f[score_matrix == 1] # this occupation category
+    b_t_f1 = np.mean(c_w_f1, axis=0) # bias 
+    b_t_f2 = np.mean(c_w_f2, axis=0) # bias
+    
+    # calculate diff between these occupations' mean and population cosine sim
+    # using bootstrap sample of all occupations of size c_w_f2.shape[0]
+    if calc_pval: 
+        # calculate statistical significance 
+        rng = np.random.default_rng(seed)
+        random_samples = bootstrap_means(c_w_f, c_w_f2.shape[0], rng)
+        t_stat, p_vals = stats.ttest_1samp(random_samples, b_t_f2, axis=0) # one sample t test 
+        effects = b_t_f2 - np.mean(random_samples, axis=0)
+    else: 
+        p_vals = np.zeros(len(poles), dtype=int)
+        effects = np.zeros(len(poles), dtype=int)
+    biases = {}
+    for i, pole in enumerate(poles): 
+        biases[pole] = (p_vals[i].item(), effects[i].item(), b_t_f1[i].item(), b_t_f2[i].item())
+    return biases
+
+def frameaxis_helper(score_matrices, word_matrices, axes_art, calc_pval=False, processes=None): 
     '''
     called by frameaxis_bert() and frameaxis_glove()
     Calculates bias and also performs bootstrapping. 
+    - axes_art: output of load_axis_artifact() or axis_artifact_from_poles()
+    - processes: if not None, categories are run in a process pool of this size
     '''
-    np.random.seed(0)
-    biases = defaultdict(dict) # {c : { pole : (bias_sep, effect, bias1, bias2) } }
-    for c in score_matrices: 
-        score_matrix = score_matrices[c]
-        word_matrix = word_matrices[c]
-        
-        for pole in tqdm(adj_poles): 
-            left_vecs, right_vecs = adj_poles[pole]
-            this_word_matrix = word_matrix
-                
-            microframe = left_vecs.mean(axis=0) - right_vecs.mean(axis=0)
-            c_w_f = cosine_similarity(this_word_matrix, microframe.reshape(1, -1))
-            c_w_f1 = c_w_f[score_matrix == 0] # all other occupations
-            c_w_f2 = c_w_f[score_matrix == 1] # this occupation category
-            b_t_f1 = np.mean(c_w_f1) # bias 
-            b_t_f2 = np.mean(c_w_f2) # bias
-            
-            # calculate diff between these occupations' mean and population cosine sim
-            # using bootstrap sample of all occupations of size c_w_f2.shape[0]
-            if calc_pval: 
-                # calculate statistical significance 
-                random_samples = []
-                random_std = []
-                N = 1000
-                for i in range(N): 
-                    # bootstrap samples from everywhere
-                    idx = np.random.choice(c_w_f.shape[0], size=c_w_f2.shape[0], replace=True)
-                    sample = c_w_f[idx, :]
-                    # calculate bias on sample
-                    b_t_sample = np.mean(sample)
-                    std_sample = np.std(sample)
-                    random_samples.append(b_t_sample)
-                    random_std.append(std_sample)
-                t_stat, p_val = stats.ttest_1samp(random_samples, b_t_f2) # one sample t test 
-                effect = b_t_f2 - np.mean(random_samples)
-            else: 
-                p_val = 0
-                effect = 0
-            biases[c][pole] = (p_val, effect, b_t_f1, b_t_f2)
+    microframes = axes_art['left'] - axes_art['right']
+    poles = [str(pole) for pole in axes_art['poles']]
+    # each category has its own seed so results don't depend on processes
+    tasks = [(score_matrices[c], word_matrices[c], microframes, poles, calc_pval, [0, i]) 
+             for i, c in enumerate(score_matrices)]
+    if processes is None: 
+        results = [frameaxis_category(*task) for task in tqdm(tasks)]
+    else: 
+        with Pool(processes=processes) as pool: 
+            results = pool.starmap(frameaxis_category, tasks)
+    biases = {} # {c : { pole : (bias_sep, effect, bias1, bias2) } }
+    for c, res in zip(score_matrices, results): 
+        biases[c] = res
     return biases
 
 def load_inputs(file_path, lexicon_name): 
@@ -247,7 +260,7 @@ def load_inputs(file_path, lexicon_name):
 
     return score_matrices, word_matrices
         
-def frameaxis_glove(file_path, sent_path, lexicon_name, calc_pval=False, exp_name=''): 
+def frameaxis_glove(file_path, sent_path, lexicon_name, calc_pval=False, exp_name='', processes=None): 
     '''
     Need to call save_frameaxis_inputs() before running this function. 
     '''
@@ -258,18 +271,19 @@ def frameaxis_glove(file_path, sent_path, lexicon_name, calc_pval=False, exp_nam
     vocab = set(sent_dict.keys())
     axes, axes_vocab = load_wordnet_axes()
     glove_vecs = get_glove_vecs(vocab, axes_vocab, exp_name)
-    adj_poles = get_poles_glove(glove_vecs, axes)
+    axes_art = axis_artifact_from_poles(get_poles_glove(glove_vecs, axes))
     score_matrices, word_matrices = load_inputs(file_path, lexicon_name)
     
-    biases = frameaxis_helper(score_matrices, word_matrices, adj_poles, calc_pval=calc_pval)
+    biases = frameaxis_helper(score_matrices, word_matrices, axes_art, calc_pval=calc_pval, 
+                              processes=processes)
                 
     with open(LOGS + 'semantics_val/' + lexicon_name + '/frameaxis_' + exp_name + '.json', 'w') as outfile:
         json.dump(biases, outfile)
         
-def get_poles_bert(axes, exp_name): 
-    assert 'bert' in exp_name
-    
-    adj_poles = {} # synset : (right_vec, left_vec)
+def get_bert_folder(exp_name): 
+    '''
+    Folder of pole embeddings for a BERT experiment 
+    '''
     if exp_name in ['bert-default', 'bert-zscore']: 
         in_folder = LOGS + 'wikipedia/substitutes/bert-default/'
     elif 'sub' in exp_name: 
@@ -283,6 +297,13 @@ def get_poles_bert(axes, exp_name):
         if exp_name.startswith('bert-base-prob'): 
             short_name = exp_name.replace('-zscore', '')
             in_folder = LOGS + 'wikipedia/substitutes/' + short_name + '/'
+    return in_folder
+
+def get_poles_bert(axes, exp_name): 
+    assert 'bert' in exp_name
+    
+    adj_poles = {} # synset : (right_vec, left_vec)
+    in_folder = get_bert_folder(exp_name)
     with open(in_folder + 'word_rep_key.json', 'r') as infile: 
         word_rep_keys = json.load(infile)
     for pole in sorted(axes.keys()): 
@@ -296,33 +317,147 @@ def get_poles_bert(axes, exp_name):
         right_vec = np.array(right_vec)
         adj_poles[pole] = (left_vec, right_vec)
     return adj_poles
+
+def get_good_axes(exp_name): 
+    '''
+    Synsets where both poles' adjectives are, on average, closer to 
+    their own side in leave-one-out validation. 
+    This is copied from axes_occupation_viz.ipynb. 
+    '''
+    quality_file_path = LOGS + 'semantics_val/axes_quality_' + exp_name + '.txt'
+    scores = defaultdict(dict) # {synset: {word : (predicted, true)}}
+    with open(quality_file_path, 'r') as infile: 
+        for line in infile: 
+            contents = line.strip().split('\t')
+            scores[contents[0]][contents[1]] = (float(contents[2]), contents[3])
+    avg_scores = Counter()
+    good_synsets = set()
+    for synset in scores: 
+        left_scores = []
+        right_scores = []
+        for w in scores[synset]: 
+            if scores[synset][w][1] == 'left': 
+                left_scores.append(-1*scores[synset][w][0])
+            else: 
+                right_scores.append(scores[synset][w][0])
+        if left_scores != []: 
+            # some are empty since they only had one word with reps
+            avg_scores[synset + '_left'] = np.mean(left_scores) 
+        if right_scores != []: 
+            avg_scores[synset + '_right'] = np.mean(right_scores) 
+        if avg_scores[synset + '_left'] >= 0 and avg_scores[synset + '_right'] >= 0: 
+            good_synsets.add(synset)
+    return good_synsets
+
+def axis_artifact_from_poles(adj_poles, good_axes=None): 
+    '''
+    @inputs: 
+    - adj_poles: output of get_poles_bert() or get_poles_glove()
+    - good_axes: set of synsets, or None if axes have not been validated yet
+    @output: 
+    - {'poles': sorted synsets, 'left'/'right': pole centroids, 
+    'left_counts'/'right_counts': number of vectors in each pole, 
+    'microframes': right centroid - left centroid, 'good_mask': bool array}
+    '''
+    poles = sorted(adj_poles.keys())
+    art = {'poles': np.array(poles, dtype=str)}
+    art['left'] = np.array([adj_poles[pole][0].mean(axis=0) for pole in poles])
+    art['right'] = np.array([adj_poles[pole][1].mean(axis=0) for pole in poles])
+    art['left_counts'] = np.array([adj_poles[pole][0].shape[0] for pole in poles])
+    art['right_counts'] = np.array([adj_poles[pole][1].shape[0] for pole in poles])
+    art['microframes'] = art['right'] - art['left']
+    if good_axes is None: 
+        art['good_mask'] = np.ones(len(poles), dtype=bool)
+    else: 
+        art['good_mask'] = np.array([pole in good_axes for pole in poles], dtype=bool)
+    return art
+
+def axis_source_files(exp_name): 
+    '''
+    Files that the axis artifact of a BERT experiment is computed from 
+    '''
+    paths = [LOGS + 'semantics_val/wordnet_axes.txt']
+    if 'zscore' in exp_name: 
+        paths.extend([LOGS + 'wikipedia/mean_BERT.npy', LOGS + 'wikipedia/std_BERT.npy'])
+    # get_vecs_and_map() falls back on bert-default
+    for folder in set([get_bert_folder(exp_name), LOGS + 'wikipedia/substitutes/bert-default/']): 
+        for f in sorted(os.listdir(folder)): 
+            if f.endswith('.npy') or f == 'word_rep_key.json': 
+                paths.append(folder + f)
+    return paths
+
+def axis_signature(exp_name): 
+    '''
+    Hash of the version, path, size and modification time of each source file, 
+    so that changed pole files invalidate the cached artifact. 
+    The axes quality file is rewritten by loo_val_bert(), so the good axes 
+    read from it are hashed instead of its modification time. 
+    '''
+    stats = [AXES_CACHE_VERSION]
+    for path in axis_source_files(exp_name): 
+        if os.path.exists(path): 
+            st = os.stat(path)
+            stats.append([path, st.st_size, st.st_mtime_ns])
+    if os.path.exists(LOGS + 'semantics_val/axes_quality_' + exp_name + '.txt'): 
+        stats.append(sorted(get_good_axes(exp_name)))
+    return hashlib.md5(json.dumps(stats).encode('utf-8')).hexdigest()
+
+def build_axis_artifact(exp_name, signature=None): 
+    '''
+    Computes pole centroids and microframes for a BERT experiment, 
+    e.g. bert-base-prob-zscore, and saves them to AXES_CACHE
+    '''
+    if signature is None: 
+        signature = axis_signature(exp_name)
+    axes, axes_vocab = load_wordnet_axes()
+    adj_poles = get_poles_bert(axes, exp_name)
+    good_axes = None
+    if os.path.exists(LOGS + 'semantics_val/axes_quality_' + exp_name + '.txt'): 
+        good_axes = get_good_axes(exp_name)
+    art = axis_artifact_from_poles(adj_poles, good_axes=good_axes)
+    os.makedirs(AXES_CACHE, exist_ok=True)
+    out_path = AXES_CACHE + exp_name + '.npz'
+    with open(out_path + '.tmp', 'wb') as outfile: 
+        np.savez(outfile, signature=np.array(signature), **art)
+    os.replace(out_path + '.tmp', out_path)
+    return art
+
+def load_axis_artifact(exp_name): 
+    '''
+    Loads the cached axis artifact of a BERT experiment, 
+    rebuilding it if it is missing or its source files changed. 
+    See axis_artifact_from_poles() for its contents. 
+    '''
+    signature = axis_signature(exp_name)
+    path = AXES_CACHE + exp_name + '.npz'
+    if os.path.exists(path): 
+        with np.load(path) as cached: 
+            if str(cached['signature']) == signature: 
+                return {k: cached[k] for k in cached.files if k != 'signature'}
+    return build_axis_artifact(exp_name, signature=signature)
         
 def frameaxis_bert(file_path, lexicon_name, exp_name='', calc_pval=False, normalize_person=True,
-                   random_person=False): 
+                   random_person=False, processes=None): 
     '''
     Analous to frameaxis_glove(). 
     @inputs: 
     - calc_pval: whether to do bootstrapping for significance
     - random_person: whether to use randomly sampled person vectors or other occupations,
         intended for exp_name='person'
+    - processes: size of process pool over lexicon categories, see frameaxis_helper()
     '''
     print("running", exp_name)
     with open(file_path, 'r') as infile:
         lexicon_dict = json.load(infile)
-    with open(LOGS + 'semantics_val/' + lexicon_name + '_BERT.json', 'r') as infile: 
-        bert_vecs = json.load(infile)
+    bert_matrix, bert_keys, _ = load_embedding_store(LOGS + 'semantics_val/' + lexicon_name + '_BERT')
     if 'zscore' in exp_name: 
         bert_mean = np.load(LOGS + 'wikipedia/mean_BERT.npy')
         bert_std = np.load(LOGS + 'wikipedia/std_BERT.npy')
-        for vec in bert_vecs: 
-            bert_vecs[vec] = (np.array(bert_vecs[vec]) - bert_mean) / bert_std
-    else: 
-        for vec in bert_vecs: 
-            bert_vecs[vec] = np.array(bert_vecs[vec])
+        bert_matrix = (bert_matrix - bert_mean) / bert_std
+    bert_vecs = dict(zip(bert_keys, bert_matrix))
         
-    axes, axes_vocab = load_wordnet_axes()
     print("getting poles...")
-    adj_poles = get_poles_bert(axes, exp_name)
+    axes_art = load_axis_artifact(exp_name)
         
     print("getting matrices...")
     score_matrices = {}
@@ -359,25 +494,51 @@ def frameaxis_bert(file_path, lexicon_name, exp_name='', calc_pval=False, normal
         word_matrices[c] = np.array(word_matrix)
         
     print("running frameaxis...")
-    biases = frameaxis_helper(score_matrices, word_matrices, adj_poles, calc_pval=calc_pval)
+    biases = frameaxis_helper(score_matrices, word_matrices, axes_art, calc_pval=calc_pval, 
+                              processes=processes)
     
     if random_person: 
         exp_name += '_randomp'
     with open(LOGS + 'semantics_val/' + lexicon_name + '/frameaxis_' + exp_name + '.json', 'w') as outfile:
         json.dump(biases, outfile)
         
-def loo_val_helper(arr, left_vec, right_vec, exp_name):
+def loo_sims(side_vec, groups, other_centroid, side): 
     '''
     called by loo_val_glove() and loo_val_bert()
-    Takes mean of each pole, creates microframe, and calculates
-    cosine similarity of array. 
-    '''
-    left_pole = left_vec.mean(axis=0)
-    right_pole = right_vec.mean(axis=0)
-    microframe = right_pole - left_pole
-    sim = 1 - spatial.distance.cosine(arr, microframe)
-    if math.isnan(sim): print(microframe, arr, sim)
-    return sim
+    Closed-form leave-one-out for one side of an axis: the pole centroid 
+    without a word is (sum - word's sum) / (n - k), so the microframes 
+    and cosine similarities for all held-out words are computed at once. 
+    @inputs: 
+    - side_vec: n x dim matrix of one side's vectors 
+    - groups: list of row indices for each held-out word
+    - other_centroid: centroid of the other side
+    - side: 'left' or 'right', which side side_vec is 
+    @output: 
+    - sims: similarity of each word's mean vector to the microframe without it
+    - has_rest: whether the side has vectors left after holding out the word 
+    '''
+    side_vec = np.asarray(side_vec, dtype=np.float64)
+    n = side_vec.shape[0]
+    indicator = np.zeros((len(groups), n))
+    for i, idx in enumerate(groups): 
+        indicator[i, idx] = 1
+    k = indicator.sum(axis=1)
+    held_sums = indicator @ side_vec
+    arrs = held_sums / k[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'): 
+        rest_centroids = (side_vec.sum(axis=0) - held_sums) / (n - k)[:, None]
+        if side == 'left': 
+            microframes = other_centroid - rest_centroids
+        else: 
+            microframes = rest_centroids - other_centroid
+        sims = (arrs * microframes).sum(axis=1) / \
+            (np.linalg.norm(arrs, axis=1) * np.linalg.norm(microframes, axis=1))
+    return sims, n - k > 0
+
+def write_loo_sims(outfile, pole, words, sims, side): 
+    for w, sim in zip(words, sims): 
+        if math.isnan(sim): print("NaN similarity:", pole, w, side)
+        outfile.write(pole + '\t' + w + '\t' + str(sim) + '\t' + side + '\n')
         
 def loo_val_glove(vec_dict, axes, exp_name): 
     '''
@@ -387,38 +548,32 @@ def loo_val_glove(vec_dict, axes, exp_name):
     with open(LOGS + 'semantics_val/axes_quality_' + exp_name + '.txt', 'w') as outfile: 
         for pole in sorted(axes.keys()): 
             left = axes[pole][0] # list of words
-            left_vec = [] # list of vectors 
-            left_vocab = []
-            for w in left: 
-                if w in vec_dict: 
-                    left_vec.append(vec_dict[w])
-                    left_vocab.append(w)
+            left_vocab = [w for w in left if w in vec_dict]
             right = axes[pole][1]
-            right_vec = [] # list of vectors 
-            right_vocab = []
-            for w in right: 
-                if w in vec_dict: 
-                    right_vec.append(vec_dict[w])
-                    right_vocab.append(w)
-
-            left_vec = np.ma.array(left_vec, mask=False)
-            right_vec = np.ma.array(right_vec, mask=False)
-            for i in range(left_vec.shape[0]): 
-                mask = np.ones(left_vec.shape[0], dtype=bool)
-                mask[i] = False
-                new_left = left_vec[mask,:]
-                arr = left_vec[i]
-                sim = loo_val_helper(arr, new_left, right_vec, exp_name=exp_name)
-                outfile.write(pole + '\t' + left_vocab[i] + '\t' + str(sim) + '\tleft\n')
+            right_vocab = [w for w in right if w in vec_dict]
+            left_vec = np.array([vec_dict[w] for w in left_vocab], dtype=np.float64)
+            right_vec = np.array([vec_dict[w] for w in right_vocab], dtype=np.float64)
+            
+            with np.errstate(invalid='ignore'): 
+                left_centroid = left_vec.mean(axis=0)
+                right_centroid = right_vec.mean(axis=0)
+            groups = [[i] for i in range(len(left_vocab))]
+            sims, _ = loo_sims(left_vec, groups, right_centroid, 'left')
+            write_loo_sims(outfile, pole, left_vocab, sims, 'left')
+            groups = [[i] for i in range(len(right_vocab))]
+            sims, _ = loo_sims(right_vec, groups, left_centroid, 'right')
+            write_loo_sims(outfile, pole, right_vocab, sims, 'right')
+                
+@lru_cache(maxsize=None)
+def load_word_rep_keys(in_folder): 
+    with open(in_folder + 'word_rep_key.json', 'r') as infile: 
+        return json.load(infile)
 
-            for i in range(right_vec.shape[0]): 
-                mask = np.ones(right_vec.shape[0], dtype=bool)
-                mask[i] = False
-                new_right = right_vec[mask,:]
-                arr = right_vec[i]
-                sim = loo_val_helper(arr, left_vec, new_right, exp_name=exp_name)
-                outfile.write(pole + '\t' + right_vocab[i]
-                              + '\t' + str(sim) + '\tright\n')
+@lru_cache(maxsize=None)
+def load_bert_mean_std(): 
+    bert_mean = np.load(LOGS + 'wikipedia/mean_BERT.npy')
+    bert_std = np.load(LOGS + 'wikipedia/std_BERT.npy')
+    return bert_mean, bert_std
                 
 def get_vecs_and_map(in_folder, side, side_pole, word_rep_keys, exp_name): 
     '''
@@ -431,8 +586,7 @@ def get_vecs_and_map(in_folder, side, side_pole, word_rep_keys, exp_name):
     if side_pole not in word_rep_keys: 
         # fall back on bert random
         in_folder = LOGS + 'wikipedia/substitutes/bert-default/'
-        with open(in_folder + 'word_rep_key.json', 'r') as infile: 
-            word_rep_keys = json.load(infile)
+        word_rep_keys = load_word_rep_keys(in_folder)
  
     rep_keys = word_rep_keys[side_pole] # [[line_num, word]]
     rep_keys_map = defaultdict(list) 
@@ -442,70 +596,61 @@ def get_vecs_and_map(in_folder, side, side_pole, word_rep_keys, exp_name):
         rep_keys_map[w].append(i)
     side_vec = np.load(in_folder + side_pole + '.npy')
     if 'zscore' in exp_name: 
-        bert_mean = np.load(LOGS + 'wikipedia/mean_BERT.npy')
-        bert_std = np.load(LOGS + 'wikipedia/std_BERT.npy')
+        bert_mean, bert_std = load_bert_mean_std()
         side_vec = (side_vec - bert_mean) / bert_std
     side_vec = np.ma.array(side_vec, mask=False)
     return side_vec, rep_keys_map
 
-def loo_val_bert(in_folder, axes, exp_name): 
-    with open(in_folder + 'word_rep_key.json', 'r') as infile: 
-        word_rep_keys = json.load(infile)
+def loo_val_bert_axis(pole, axis, centroids, in_folder, exp_name): 
+    '''
+    Leave-one-out lines for one axis, run in a worker by loo_val_bert() 
+    @inputs: 
+    - axis: ([left pole adj], [right pole adj])
+    - centroids: (left centroid, right centroid) from the axis artifact
+    '''
+    word_rep_keys = load_word_rep_keys(in_folder)
+    left_centroid, right_centroid = centroids
+    lines = []
+    for side, other_centroid in (('left', right_centroid), ('right', left_centroid)): 
+        side_words = axis[0] if side == 'left' else axis[1]
+        side_vec, rep_keys_map = get_vecs_and_map(in_folder, side_words, pole + '_' + side, \
+                                                  word_rep_keys, exp_name)
+        words = list(rep_keys_map.keys())
+        sims, has_rest = loo_sims(side_vec, [rep_keys_map[w] for w in words], other_centroid, side)
+        for w, sim, keep in zip(words, sims, has_rest): 
+            # skip words that are the only word with reps on their side
+            if not keep: continue
+            if math.isnan(sim): print("NaN similarity:", pole, w, side)
+            lines.append(pole + '\t' + w + '\t' + str(sim) + '\t' + side + '\n')
+    return lines
+
+def star_loo_val_bert_axis(task): 
+    return loo_val_bert_axis(*task)
+
+def loo_val_bert(in_folder, axes, exp_name, processes=None): 
+    '''
+    Axes are validated in parallel, and written out in sorted order.
+    '''
+    # the side that isn't left out uses the cached pole centroid
+    axes_art = load_axis_artifact(exp_name)
+    pole_idx = {str(pole): i for i, pole in enumerate(axes_art['poles'])}
+    poles = sorted(axes.keys())
+    tasks = [(pole, axes[pole], (axes_art['left'][pole_idx[pole]], axes_art['right'][pole_idx[pole]]), 
+              in_folder, exp_name) for pole in poles]
     with open(LOGS + 'semantics_val/axes_quality_' + exp_name + '.txt', 'w') as outfile: 
-        for pole in tqdm(sorted(axes.keys())): 
-            left = axes[pole][0] # list of words
-            left_pole = pole + '_left'
-            left_vec, lrep_keys_map = get_vecs_and_map(in_folder, left, left_pole, \
-                                                               word_rep_keys, exp_name)
-            
-            right = axes[pole][1]
-            right_pole = pole + '_right'
-            right_vec, rrep_keys_map = get_vecs_and_map(in_folder, right, right_pole, \
-                                                               word_rep_keys, exp_name)
-            
-            for w in lrep_keys_map: 
-                idx = lrep_keys_map[w]
-                mask = np.ones(left_vec.shape[0], dtype=bool)
-                mask[idx] = False # mask out vectors corresponding to word
-                new_left = left_vec[mask,:]
-                if new_left.shape[0] == 0: continue
-                arr = left_vec[idx,:].mean(axis=0) 
-                sim = loo_val_helper(arr, new_left, right_vec, exp_name=exp_name)
-                outfile.write(pole + '\t' + w + '\t' + str(sim) + '\tleft\n')
+        with Pool(processes=processes) as pool: 
+            for lines in tqdm(pool.imap(star_loo_val_bert_axis, tasks), total=len(tasks)): 
+                outfile.writelines(lines)
                 
-            for w in rrep_keys_map: 
-                idx = rrep_keys_map[w]
-                mask = np.ones(right_vec.shape[0], dtype=bool)
-                mask[idx] = False
-                new_right = right_vec[mask,:]
-                if new_right.shape[0] == 0: continue
-                arr = right_vec[idx,:].mean(axis=0)
-                sim = loo_val_helper(arr, left_vec, new_right, exp_name=exp_name)
-                outfile.write(pole + '\t' + w + '\t' + str(sim) + '\tright\n')
-
-def check_separability(exp_name): 
+def check_separability(exp_name, processes=None): 
     axes, axes_vocab = load_wordnet_axes()
     vocab = set()
     if exp_name in ['default', 'glove-zscore']: 
         vec_dict = get_glove_vecs(vocab, axes_vocab, exp_name)
         loo_val_glove(vec_dict, axes, exp_name)
         return
-    if exp_name in ['bert-default', 'bert-zscore']: 
-        in_folder = LOGS + 'wikipedia/substitutes/bert-default/'
-        loo_val_bert(in_folder, axes, exp_name)
-    elif 'sub' in exp_name and 'bert' in exp_name: 
-        if exp_name.startswith('bert-base-sub') and 'mask' not in exp_name: 
-            in_folder = LOGS + 'wikipedia/substitutes/bert-base-sub/'
-        elif exp_name.startswith('bert-base-sub') and 'mask' in exp_name: 
-            in_folder = LOGS + 'wikipedia/substitutes/bert-base-sub-mask/'
-        else: 
-            in_folder = LOGS + 'wikipedia/substitutes/' + exp_name + '/'
-        loo_val_bert(in_folder, axes, exp_name)
-    elif 'prob' in exp_name and 'bert' in exp_name: 
-        if exp_name.startswith('bert-base-prob'): 
-            short_name = exp_name.replace('-zscore', '')
-            in_folder = LOGS + 'wikipedia/substitutes/' + short_name + '/'
-        loo_val_bert(in_folder, axes, exp_name)
+    if 'bert' in exp_name: 
+        loo_val_bert(get_bert_folder(exp_name), axes, exp_name, processes=processes)
     
 def main(): 
 #     # ------ SEPARABILITY ------
@@ -17,7 +17,7 @@ BERT mean and std
 import requests
 import json
 from tqdm import tqdm
-from transformers import BasicTokenizer, BertTokenizerFast, BertModel, BertTokenizer
+from transformers import BasicTokenizer
 from pyspark import SparkConf, SparkContext
 from pyspark.sql import Row, SQLContext
 from functools import partial
@@ -28,14 +28,17 @@ from nltk import tokenize
 import numpy as np
 import os
 import copy
+from embedding_store import save_vec_dict
+from bert_batching import pack_batches
+from embedding_engine import embed_spans, encode_batch, pool_spans, word_spans
+from embedding_cache import enable_cache
+from embedding_engine import new_stats, update_stats, finalize_stats
 
 #ROOT = '/global/scratch/users/lucy3_li/manosphere/'
 ROOT = '/mnt/data0/lucy/manosphere/'
 DATA = ROOT + 'data/'
 LOGS = ROOT + 'logs/'
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
 # --------------
 # Adjective functions
 # --------------
@@ -231,13 +234,9 @@ def batch_adj_data(input_json, exp_name):
     '''
     with open(input_json, 'r') as infile:
         lines_tokens = json.load(infile) # {line_num: [(adj, synset)]}
-    batch_size = 8
-    batch_sentences = [] # each item is a list
-    batch_words = [] # each item is a list
-    batch_tups = []
-    curr_batch = []
-    curr_words = []
-    curr_tups = []
+    sentences = [] # each item is a list
+    words = [] # each item is a list
+    tups = []
     btokenizer = BasicTokenizer(do_lower_case=True)
     vocab = set()
     with open(LOGS + 'wikipedia/adj_data/part-00000', 'r') as infile: 
@@ -262,35 +261,18 @@ def batch_adj_data(input_json, exp_name):
                     if tokens[i] in dashed_words or tokens[i] in words_in_line: 
                         new_tokens = copy.deepcopy(tokens)
                         new_tokens[i] = '[MASK]'
-                        curr_batch.append(new_tokens)
-                        curr_words.append(words_in_line)
-                        curr_tups.append(tups_in_line)
-                        if len(curr_batch) == batch_size: 
-                            batch_sentences.append(curr_batch)
-                            batch_words.append(curr_words)
-                            batch_tups.append(curr_tups)
-                            curr_batch = []
-                            curr_words = []
-                            curr_tups = []                
+                        sentences.append(new_tokens)
+                        words.append(words_in_line)
+                        tups.append(tups_in_line)
             else: 
                 for i in range(len(tokens)): 
                     if tokens[i] in dashed_words:
                         tokens[i] = tokens[i].replace('xqxq', '-')
-                curr_batch.append(tokens)
-                curr_words.append(words_in_line)
-                curr_tups.append(tups_in_line)
-                if len(curr_batch) == batch_size: 
-                    batch_sentences.append(curr_batch)
-                    batch_words.append(curr_words)
-                    batch_tups.append(curr_tups)
-                    curr_batch = []
-                    curr_words = []
-                    curr_tups = []
-        if len(curr_batch) != 0: # fence post
-            batch_sentences.append(curr_batch)
-            batch_words.append(curr_words)
-            batch_tups.append(curr_tups)
-    return batch_sentences, batch_words, batch_tups, vocab
+                sentences.append(tokens)
+                words.append(words_in_line)
+                tups.append(tups_in_line)
+    batch_sentences, batch_words, batch_tups, batch_idx = pack_batches(sentences, words, tups)
+    return batch_sentences, batch_words, batch_tups, batch_idx, vocab
 
 def get_adj_embeddings(exp_name, save_agg=True): 
     '''
@@ -310,13 +292,7 @@ def get_adj_embeddings(exp_name, save_agg=True):
     elif exp_name == 'bert-default': 
         input_json = LOGS + 'wikipedia/adj_lines_random.json'
     print("Batching contexts...")
-    batch_sentences, batch_words, batch_tups, vocab = batch_adj_data(input_json, exp_name)
-    print("Getting model...")
-    tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
-    model = BertModel.from_pretrained('bert-base-uncased')
-    layers = [-4, -3, -2, -1] # last four layers
-    model.to(device)
-    model.eval()
+    batch_sentences, batch_words, batch_tups, batch_idx, vocab = batch_adj_data(input_json, exp_name)
     # initialize word representations
     if save_agg: 
         word_reps = {}
@@ -324,38 +300,28 @@ def get_adj_embeddings(exp_name, save_agg=True):
             word_reps[tup] = np.zeros(3072)
         word_counts = Counter()
     else: 
-        word_reps = defaultdict(list) # {ss : [numpy arrays]}
-        # {ss : [(line_num, adj)]} where index corresponds to vector in word_reps 
-        word_rep_keys = defaultdict(list) 
+        # {ss : [(example index, numpy array, [line_num, adj])]}, sorted back into input order at the end
+        ss_reps = defaultdict(list) 
     for i, batch in enumerate(tqdm(batch_sentences)): # for every batch
-        word_tokenids = {} # { j : { word : [token ids] } }
-        encoded_inputs = tokenizer(batch, is_split_into_words=True, padding=True, truncation=True, 
-             return_tensors="pt")
-        encoded_inputs.to(device)
-        outputs = model(**encoded_inputs, output_hidden_states=True)
-        states = outputs.hidden_states # tuple
-        # batch_size x seq_len x 3072
-        vector = torch.cat([states[i] for i in layers], 2) # concatenate last four
+        batch_spans = []
         for j in range(len(batch)): # for every example
-            word_ids = encoded_inputs.word_ids(j)
-            word_tokenids = defaultdict(list) # {word : [token ids]}
-            for k, word_id in enumerate(word_ids): # for every token
-                if word_id is not None: 
-                    curr_word = batch[j][word_id]
-                    if 'mask' in exp_name: 
-                        if curr_word == '[MASK]': 
-                            word_tokenids[curr_word].append(k)
-                    else: 
-                        if curr_word in batch_words[i][j]: 
-                            word_tokenids[curr_word].append(k)
+            if 'mask' in exp_name: 
+                word_tokenids = word_spans(batch[j], set(['[MASK]'])) 
+            else: 
+                word_tokenids = word_spans(batch[j], set(batch_words[i][j])) 
+            spans = []
             for tup in batch_tups[i][j]: 
                 line_num, word, ss = tup
                 if 'mask' in exp_name: 
-                    token_ids_word = np.array(word_tokenids['[MASK]']) 
+                    spans.append(word_tokenids.get('[MASK]', []))
                 else: 
-                    token_ids_word = np.array(word_tokenids[word]) 
-                word_embed = vector[j][token_ids_word]
-                word_embed = word_embed.mean(dim=0).detach().cpu().numpy() # average word pieces
+                    spans.append(word_tokenids.get(word, []))
+            batch_spans.append(spans)
+        word_embeds = iter(embed_spans(batch, batch_spans).cpu().numpy())
+        for j in range(len(batch)): # for every example
+            for tup in batch_tups[i][j]: 
+                line_num, word, ss = tup
+                word_embed = next(word_embeds)
                 if np.isnan(word_embed).any(): 
                     print("PROBLEM!!!", word, batch[j])
                     return 
@@ -364,8 +330,7 @@ def get_adj_embeddings(exp_name, save_agg=True):
                     word_reps[word_ss] += word_embed
                     word_counts[word_ss] += 1
                 else: 
-                    word_reps[ss].append(word_embed)
-                    word_rep_keys[ss].append([line_num, word])
+                    ss_reps[ss].append((batch_idx[i][j], word_embed, [line_num, word]))
         torch.cuda.empty_cache()
     if save_agg: 
         res = {}
@@ -377,9 +342,12 @@ def get_adj_embeddings(exp_name, save_agg=True):
         out_folder = LOGS + 'wikipedia/substitutes/' + exp_name + '/'
         if not os.path.exists(out_folder):
             os.makedirs(out_folder)
-        for ss in word_reps: 
-            out_array = np.array(word_reps[ss])
+        word_rep_keys = {} # {ss : [(line_num, adj)]} where index corresponds to row in ss.npy
+        for ss in ss_reps: 
+            ss_reps[ss].sort(key=lambda tup: tup[0])
+            out_array = np.array([tup[1] for tup in ss_reps[ss]])
             np.save(out_folder + ss + '.npy', out_array)
+            word_rep_keys[ss] = [tup[2] for tup in ss_reps[ss]]
         with open(out_folder + 'word_rep_key.json', 'w') as outfile: 
             json.dump(word_rep_keys, outfile)
         
@@ -391,23 +359,20 @@ def get_occupation_embeddings(occ_sents_path, outpath, find_person=False):
     '''
     For each stretch of wikitext, get BERT embeddings
     of occupation words
+    outpath is an embedding store prefix (see embedding_store.py)
     '''
     with open(occ_sents_path, 'r') as infile: 
         occ_sents = json.load(infile) 
         
     print("Batching data...")
-    batch_size = 8
-    batch_sentences = [] # each item is a list
-    batch_idx = [] # each item is a list
-    batch_words = []
-    curr_batch = []
-    curr_words = []
-    curr_idx = []
+    sentences = [] # each item is a list
+    target_idx = [] # each item is a list
+    words = []
     btokenizer = BasicTokenizer(do_lower_case=True)
     for occ in occ_sents: 
         for text in occ_sents[occ]: 
             tokens = btokenizer.tokenize(text)
-            curr_batch.append(tokens)
+            sentences.append(tokens)
             # take care of bigrams 
             curr_word_tokens = btokenizer.tokenize(occ)
             word_ids = []
@@ -423,50 +388,20 @@ def get_occupation_embeddings(occ_sents_path, outpath, find_person=False):
                     if ' '.join(window) == temp_str:
                         word_ids.extend(range(i, i+len(curr_word_tokens)))
             assert len(word_ids) != 0
-            curr_idx.append(word_ids)
-            curr_words.append(occ)
-            if len(curr_batch) == batch_size: 
-                batch_sentences.append(curr_batch)
-                batch_words.append(curr_words)
-                batch_idx.append(curr_idx)
-                curr_batch = []
-                curr_words = []
-                curr_idx = []
-    if len(curr_batch) != 0: # fence post
-        batch_sentences.append(curr_batch)
-        batch_words.append(curr_words)
-        batch_idx.append(curr_idx)
+            target_idx.append(word_ids)
+            words.append(occ)
+    batch_sentences, batch_words, batch_idx, _ = pack_batches(sentences, words, target_idx)
 
-    print("Getting model...")
-    tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
-    model = BertModel.from_pretrained('bert-base-uncased')
-    layers = [-4, -3, -2, -1] # last four layers
-    model.to(device)
-    model.eval()
-    
     word_reps = {}
     for occ in occ_sents: 
         word_reps[occ] = np.zeros(3072)
     word_counts = Counter()
     
     for i, batch in enumerate(tqdm(batch_sentences)): # for every batch
-        word_tokenids = {} # { j : { word : [token ids] } }
-        encoded_inputs = tokenizer(batch, is_split_into_words=True, padding=True, truncation=True, 
-             return_tensors="pt")
-        encoded_inputs.to(device)
-        outputs = model(**encoded_inputs, output_hidden_states=True)
-        states = outputs.hidden_states # tuple
-        # batch_size x seq_len x 3072
-        vector = torch.cat([states[i] for i in layers], 2) # concatenate last four
+        batch_spans = [[word_ids] for word_ids in batch_idx[i]]
+        word_embeds = embed_spans(batch, batch_spans).cpu().numpy()
         for j in range(len(batch)): # for every example
-            word_ids = encoded_inputs.word_ids(j)
-            word_tokenids = []
-            for k, word_id in enumerate(word_ids): # for every token
-                if word_id is not None and word_id in batch_idx[i][j]:
-                    word_tokenids.append(k)
-            token_ids_word = np.array(word_tokenids) 
-            word_embed = vector[j][token_ids_word]
-            word_embed = word_embed.mean(dim=0).cpu().detach().numpy() # average word pieces
+            word_embed = word_embeds[j]
             occ = batch_words[i][j]
             if np.isnan(word_embed).any(): 
                 print("PROBLEM!!!", occ, batch[j], batch_idx[i][j])
@@ -474,20 +409,25 @@ def get_occupation_embeddings(occ_sents_path, outpath, find_person=False):
             word_reps[occ] += word_embed
             word_counts[occ] += 1
     
-    res = {}
-    for w in word_counts: 
-        res[w] = list(word_reps[w] / word_counts[w])
-    with open(outpath, 'w') as outfile: 
-        json.dump(res, outfile)
+    save_vec_dict(outpath, word_reps, word_counts)
         
+def person_embeds(batch): 
+    '''
+    Embedding of the first 'person' in each example of a batch
+    '''
+    batch_spans = []
+    for words in batch: 
+        spans = word_spans(words, set(['person']))
+        # only use first instance
+        batch_spans.append([spans.get('person', [])[:1]])
+    return embed_spans(batch, batch_spans).cpu().numpy()
+
 def get_person_embedding(): 
     '''
     Get mean and std for 'person'.
     '''
     print("Batching data...")
-    batch_size = 8
-    batch_sentences = [] # each item is a list
-    curr_batch = []
+    sentences = [] # each item is a list
     btokenizer = BasicTokenizer(do_lower_case=True)
     
     with open(DATA + 'semantics/person_occupation_sents.json', 'r') as infile: 
@@ -496,87 +436,38 @@ def get_person_embedding():
     for occ in occ_sents: 
         for text in occ_sents[occ]: 
             tokens = btokenizer.tokenize(text)
-            curr_batch.append(tokens)
-            if len(curr_batch) == batch_size: 
-                batch_sentences.append(curr_batch)
-                curr_batch = []
-    if len(curr_batch) != 0: # fence post
-        batch_sentences.append(curr_batch)
-
-    print("Getting model...")
-    tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
-    model = BertModel.from_pretrained('bert-base-uncased')
-    layers = [-4, -3, -2, -1] # last four layers
-    model.to(device)
-    model.eval()
+            sentences.append(tokens)
+    batch_sentences, _ = pack_batches(sentences)
     
-    print("Calculate mean...")
-    word_rep = np.zeros(3072)
-    word_count = 0
+    print("Calculate mean and std...")
+    stats = new_stats()
     for i, batch in enumerate(tqdm(batch_sentences)): # for every batch
-        word_tokenids = {} # { j : { word : [token ids] } }
-        encoded_inputs = tokenizer(batch, is_split_into_words=True, padding=True, truncation=True, 
-             return_tensors="pt")
-        encoded_inputs.to(device)
-        outputs = model(**encoded_inputs, output_hidden_states=True)
-        states = outputs.hidden_states # tuple
-        # batch_size x seq_len x 3072
-        vector = torch.cat([states[i] for i in layers], 2) # concatenate last four
-        for j in range(len(batch)): # for every example
-            word_ids = encoded_inputs.word_ids(j)
-            word_tokenids = []
-            for k, word_id in enumerate(word_ids): # for every token
-                if word_id is not None: 
-                    curr_word = batch[j][word_id]
-                    if curr_word == 'person': 
-                        # only use first instance
-                        word_tokenids.append(k)
-                        break
-            token_ids_word = np.array(word_tokenids) 
-            word_embed = vector[j][token_ids_word]
-            word_embed = word_embed.mean(dim=0).cpu().detach().numpy() 
+        word_embeds = person_embeds(batch)
+        for j, word_embed in enumerate(word_embeds): # for every example
             if np.isnan(word_embed).any(): 
-                print("PROBLEM!!!", batch[j], word_id, word_tokenids)
+                print("PROBLEM!!!", batch[j])
                 return 
-            word_count += 1
-            word_rep += word_embed
-    mean_word_rep = word_rep / word_count
-    
-    print("Calculate std...")
-    word_rep = np.zeros(3072)
-    word_count = 0
-    for i, batch in enumerate(tqdm(batch_sentences)): # for every batch
-        word_tokenids = {} # { j : { word : [token ids] } }
-        encoded_inputs = tokenizer(batch, is_split_into_words=True, padding=True, truncation=True, 
-             return_tensors="pt")
-        encoded_inputs.to(device)
-        outputs = model(**encoded_inputs, output_hidden_states=True)
-        states = outputs.hidden_states # tuple
-        # batch_size x seq_len x 3072
-        vector = torch.cat([states[i] for i in layers], 2) # concatenate last four
-        for j in range(len(batch)): # for every example
-            word_ids = encoded_inputs.word_ids(j)
-            word_tokenids = []
-            for k, word_id in enumerate(word_ids): # for every token
-                if word_id is not None: 
-                    curr_word = batch[j][word_id]
-                    if curr_word == 'person': 
-                        # only use first instance
-                        word_tokenids.append(k)
-                        break
-            token_ids_word = np.array(word_tokenids) 
-            word_embed = vector[j][token_ids_word]
-            word_embed = word_embed.mean(dim=0).cpu().detach().numpy() 
-            if np.isnan(word_embed).any(): 
-                print("PROBLEM!!!", batch[j], word_id, word_tokenids)
-                return 
-            word_embed = np.square(word_embed - mean_word_rep)
-            word_count += 1
-            word_rep += word_embed
-    std_word_rep = np.sqrt(word_rep / word_count)
+        stats = update_stats(stats, word_embeds)
+    word_count, mean_word_rep, std_word_rep = finalize_stats(stats)
     
     np.save(LOGS + 'semantics_val/person_mean.npy', mean_word_rep)
     np.save(LOGS + 'semantics_val/person_std.npy', std_word_rep)
+    
+def random_word_embeds(batch, rng): 
+    '''
+    Embedding of one random word, among those that
+    survive truncation, in each example of a batch
+    - rng: numpy Generator for choosing words
+    '''
+    encoded_inputs = encode_batch(batch)
+    batch_spans = []
+    for j in range(len(batch)): # for every example
+        word_ids = sorted(wi for wi in set(encoded_inputs.word_ids(j)) if wi is not None)
+        word_choice = rng.choice(word_ids)
+        batch_spans.append([[int(word_choice)]])
+    # pooled directly rather than through embed_spans(), since these
+    # one-off samples would only push reusable vectors out of the cache
+    return pool_spans(encoded_inputs, batch_spans).cpu().numpy()
         
 def get_bert_mean_std(): 
     '''
@@ -584,11 +475,10 @@ def get_bert_mean_std():
     from a sample of BERT embeddings, one random
     word per context drawn from approx 10% 
     of the adjective dataset 
+    Both are computed in one pass over the sample. 
     '''
     random.seed(0)
-    batch_size = 6
-    batch_sentences = [] # each item is a list
-    curr_batch = []
+    sentences = [] # each item is a list
     print("Batching data...")
     prob = 5
     btokenizer = BasicTokenizer(do_lower_case=True)
@@ -598,69 +488,23 @@ def get_bert_mean_std():
             contents = line.split('\t')
             text = '\t'.join(contents[1:])
             tokens = btokenizer.tokenize(text)
-            curr_batch.append(tokens)
-            if len(curr_batch) == batch_size: 
-                batch_sentences.append(curr_batch)
-                curr_batch = []
-        if len(curr_batch) != 0: # fence post
-            batch_sentences.append(curr_batch)
+            sentences.append(tokens)
+    batch_sentences, _ = pack_batches(sentences)
     print("Num batches:", len(batch_sentences))
-    print("Getting model...")
-    tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
-    model = BertModel.from_pretrained('bert-base-uncased')
-    layers = [-4, -3, -2, -1] # last four layers
-    model.to(device)
-    model.eval()
-
-    print("Calculate mean...")
-    word_rep = np.zeros(3072)
-    word_count = 0
-    for i, batch in enumerate(tqdm(batch_sentences)): # for every batch
-        encoded_inputs = tokenizer(batch, is_split_into_words=True, 
-                                   padding=True, truncation=True, return_tensors="pt")
-        encoded_inputs.to(device)
-        outputs = model(**encoded_inputs, output_hidden_states=True)
-        states = outputs.hidden_states # tuple
-        # batch_size x seq_len x 3072
-        vector = torch.cat([states[i] for i in layers], 2) # concatenate last four
-        for j in range(len(batch)): # for every example
-            word_ids = np.array([wi for wi in set(encoded_inputs.word_ids(j)) if wi is not None])
-            word_choice = np.random.choice(word_ids, 1)[0]
-            word_tokenids = np.argwhere(word_ids == word_choice)
-            word_embed = vector[j][word_tokenids]
-            word_embed = word_embed.mean(dim=0).cpu().detach().numpy()
-            word_count += 1
-            word_rep += word_embed
-    mean_word_rep = word_rep / word_count
 
-    print("Calculate std...")
-    word_rep = np.zeros(3072)
-    word_count = 0
+    print("Calculate mean and std...")
+    rng = np.random.default_rng(0)
+    stats = new_stats()
     for i, batch in enumerate(tqdm(batch_sentences)): # for every batch
-        encoded_inputs = tokenizer(batch, is_split_into_words=True, 
-                                   padding=True, truncation=True, return_tensors="pt")
-        encoded_inputs.to(device)
-        outputs = model(**encoded_inputs, output_hidden_states=True)
-        states = outputs.hidden_states # tuple
-        # batch_size x seq_len x 3072
-        vector = torch.cat([states[i] for i in layers], 2) # concatenate last four
-        
-        for j in range(len(batch)): # for every example
-            word_ids = np.array([wi for wi in set(encoded_inputs.word_ids(j)) if wi is not None])
-            word_choice = np.random.choice(word_ids, 1)[0]
-            word_tokenids = np.argwhere(word_ids == word_choice)
-            word_embed = vector[j][word_tokenids]
-            word_embed = word_embed.mean(dim=0).flatten().cpu().detach().numpy()
-            word_embed = np.square(word_embed - mean_word_rep)
-            word_count += 1
-            word_rep += word_embed
-    std_word_rep = np.sqrt(word_rep / word_count)
+        stats = update_stats(stats, random_word_embeds(batch, rng))
+    word_count, mean_word_rep, std_word_rep = finalize_stats(stats)
     with open(LOGS + 'wikipedia/mean_std_count.txt', 'w') as outfile: 
         outfile.write(str(word_count) + '\n')
     np.save(LOGS + 'wikipedia/mean_BERT.npy', mean_word_rep)
     np.save(LOGS + 'wikipedia/std_BERT.npy', std_word_rep)
 
 def main(): 
+    enable_cache(LOGS + 'bert_cache/embeddings.sqlite')
     sample_wikipedia()
     #get_axes_contexts()
     #print("----------------------")
@@ -669,9 +513,9 @@ def main():
     #get_adj_embeddings('bert-base-prob', save_agg=False)
     #print("**********************")
     #get_bert_mean_std()
-    #get_occupation_embeddings(DATA + 'semantics/occupation_sents.json', LOGS + 'semantics_val/occupations_BERT.json')
+    #get_occupation_embeddings(DATA + 'semantics/occupation_sents.json', LOGS + 'semantics_val/occupations_BERT')
     #get_occupation_embeddings(DATA + 'semantics/person_occupation_sents.json', 
-    #                          LOGS + 'semantics_val/person_BERT.json', find_person=True)
+    #                          LOGS + 'semantics_val/person_BERT', find_person=True)
     #get_person_embedding()
 
 if __name__ == '__main__':